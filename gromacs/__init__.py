@@ -99,6 +99,14 @@ Output of the command can be caught in a variable and analyzed::
 (See :func:`gromacs.cbook.grompp_qtot` for a more robust implementation of this
 application.)
 
+Many invocations of a tool can run concurrently with :func:`gromacs.map`
+(see :func:`gromacs.core.map_command`)::
+
+   results = gromacs.map(gromacs.trjconv,
+                         [dict(s='md.tpr', f='md.xtc', o='frame{0}.pdb'.format(t), dump=t,
+                               input=('System',)) for t in range(0, 1000, 100)],
+                         workers=4)
+
 
 Warnings and Exceptions
 -----------------------
@@ -160,6 +168,14 @@ value that evaluates to ``True`` (e.g., "True" or "1").
 
 .. _logging: http://docs.python.org/library/logging.html
 
+The time spent in the stages of ``import gromacs`` is recorded in
+:data:`gromacs.import_timings` (and logged at level *debug*)::
+
+   python -c 'import gromacs; print(gromacs.import_timings)'
+
+On Python >= 3.7 :mod:`gromacs.fileformats` (and with it :mod:`numpy`
+and :mod:`matplotlib`) is only imported when it is first used.
+
 Version
 -------
 
@@ -170,8 +186,17 @@ from __future__ import absolute_import
 __docformat__ = "restructuredtext en"
 
 import os
+import re
+import sys
+import time
 import warnings
 import logging
+from collections import OrderedDict
+
+_import_start = time.time()
+
+#: Seconds spent in the stages of ``import gromacs`` (and ``'total'``).
+import_timings = OrderedDict()
 
 # __all__ is extended with all gromacs command instances later
 __all__ = ['config', 'tools', 'cbook', 'fileformats']
@@ -180,7 +205,9 @@ from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
 
-from . import fileformats
+if sys.version_info < (3, 7):
+    # otherwise imported on first access (numpy, matplotlib, ...)
+    from . import fileformats
 from .exceptions import (GromacsError, MissingDataError, ParseError,
                          GromacsFailureWarning, GromacsImportWarning,
                          GromacsValueWarning, AutoCorrectionWarning,
@@ -190,6 +217,7 @@ from .exceptions import (GromacsError, MissingDataError, ParseError,
 
 # Import configuration before anything else
 from . import config
+import_timings['config'] = time.time() - _import_start
 
 
 # NOTE: logging is still iffy; when I reload I add a new logger each
@@ -238,43 +266,92 @@ def stop_logging():
 if os.environ.get('GW_START_LOGGING', False):
     start_logging()
 
+from .core import map_command as map
+
 # Try to load environment variables set by GMXRC
+_stage_start = time.time()
 config.set_gmxrc_environment(config.cfg.getpath("Gromacs", "GMXRC"))
+import_timings['gmxrc'] = time.time() - _stage_start
 
 
 # Add gromacs command **instances** to the top level.
 # These serve as the equivalence of running commands in the shell.
 # (Note that each gromacs command is actually run when the instance is
 # created in order to gather the documentation string.)
+_stage_start = time.time()
 from . import tools
 
-# Ignore warnings from a few programs that do not produce
-# documentation when run with '-h' (only applies when the default for
-# failuremode of core.GromacsCommand is changed to 'warn')
-warnings.simplefilter("ignore", GromacsFailureWarning)
-_have_g_commands = []
-_missing_g_commands = []
-for clsname, cls in tools.registry.items():
-    name = clsname[0].lower() + clsname[1:]    # instances should start with lower case
-    try:
-        globals()[name] = cls()                # add instance of command for immediate use
-        _have_g_commands.append(name)
-    except:
-        _missing_g_commands.append(name)
-warnings.simplefilter("always", GromacsFailureWarning)
-warnings.simplefilter("always", GromacsImportWarning)
+def _command_instance(name):
+    """Return the instance of the command for *name* (lower case class name)"""
+    cls = tools.registry[name[0].upper() + name[1:]]
+    return globals().setdefault(name, cls())    # add instance of command for immediate use
+
+if sys.version_info >= (3, 7):
+    # PEP 562: instances are created (and tools discovered) on first access
+    import importlib
+    import importlib.util
+
+    _modules_all = __all__
+    del __all__
+
+    # names of command instances (see tools.make_valid_identifier())
+    _TOOL_INSTANCE = re.compile(r'^[a-z][a-z0-9_]*$')
+
+    def __getattr__(name):
+        if name == 'fileformats':
+            from . import fileformats
+            return fileformats
+        if name == '__all__':
+            return _modules_all + sorted(clsname[0].lower() + clsname[1:]
+                                         for clsname in tools.registry)
+        if importlib.util.find_spec(__name__ + '.' + name) is not None:
+            # submodule that was not imported yet: no need to look for tools
+            return importlib.import_module(__name__ + '.' + name)
+        if _TOOL_INSTANCE.match(name):
+            try:
+                return _command_instance(name)
+            except KeyError:
+                pass
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(clsname[0].lower() + clsname[1:]
+                                           for clsname in tools.registry))
+else:
+    # Ignore warnings from a few programs that do not produce
+    # documentation when run with '-h' (only applies when the default for
+    # failuremode of core.GromacsCommand is changed to 'warn')
+    warnings.simplefilter("ignore", GromacsFailureWarning)
+    _have_g_commands = []
+    _missing_g_commands = []
+    for clsname in tools.registry:
+        name = clsname[0].lower() + clsname[1:]    # instances should start with lower case
+        try:
+            _command_instance(name)
+            _have_g_commands.append(name)
+        except:
+            _missing_g_commands.append(name)
+
+    _have_g_commands.sort()
+    _missing_g_commands.sort()
+    if len(_missing_g_commands) > 0:
+        warnings.warn("Some Gromacs commands were NOT found; "
+                      "maybe source GMXRC first? The following are missing:\n%r\n" % _missing_g_commands,
+                      category=GromacsImportWarning)
 
-_have_g_commands.sort()
-_missing_g_commands.sort()
-if len(_missing_g_commands) > 0:
-    warnings.warn("Some Gromacs commands were NOT found; "
-                  "maybe source GMXRC first? The following are missing:\n%r\n" % _missing_g_commands,
-                  category=GromacsImportWarning)
+    del name, clsname
 
-del name, cls, clsname
+    # get ALL active command instances with 'from gromacs import *'
+    __all__.extend(_have_g_commands)
+
+warnings.simplefilter("always", GromacsFailureWarning)
+warnings.simplefilter("always", GromacsImportWarning)
 
-# get ALL active command instances with 'from gromacs import *'
-__all__.extend(_have_g_commands)
+import_timings['tools'] = time.time() - _stage_start
+import_timings['total'] = time.time() - _import_start
+logging.getLogger("gromacs").debug("import gromacs: %s", ", ".join(
+    "{0} {1:.3f} s".format(stage, seconds) for stage, seconds in import_timings.items()))
+del _stage_start
 
 
 # cbook should come after the whole of init as it relies on command
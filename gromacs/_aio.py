@@ -0,0 +1,106 @@
+# GromacsWrapper: _aio.py
+# Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+"""
+Running commands from an :mod:`asyncio` event loop
+==================================================
+
+Implementation of :meth:`gromacs.core.Command.arun`. The module uses
+``async``/``await`` and is only imported under Python 3.
+
+.. versionadded:: 0.8.0
+"""
+from __future__ import absolute_import
+
+import asyncio
+import errno
+import locale
+import logging
+import time
+
+from . import core
+
+logger = logging.getLogger('gromacs.core')
+
+
+async def run_command(command, args, kwargs, timeout=None):
+    """Run *command* like :meth:`~gromacs.core.Command._run_command` in the event loop.
+
+    :Returns: the *results* tuple ``(rc, stdout, stderr)``
+    """
+    use_input = kwargs.pop('use_input', True)
+    capturefile = command._setup_capture(kwargs)
+    try:
+        start = time.time()
+        cmd, stdin, stdout, stderr, input, use_shell = command._popen_arguments(*args, **kwargs)
+        built = time.time()
+        command_string = core._command_string(cmd, input)
+        data = None
+        if use_input and input is not None:
+            data = input.read() if hasattr(input, 'read') else input
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+        try:
+            if use_shell:
+                process = await asyncio.create_subprocess_shell(
+                    " ".join(cmd), stdin=stdin, stdout=stdout, stderr=stderr)
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, stdin=stdin, stdout=stdout, stderr=stderr)
+        except OSError as err:
+            logger.error(" ".join(cmd))
+            if err.errno == errno.ENOENT:
+                errmsg = "Failed to find Gromacs command {0!r}, maybe its not on PATH or GMXRC must be sourced?".format(command.command_name)
+                logger.fatal(errmsg)
+                raise OSError(errmsg)
+            raise
+        timing = (start, built - start, time.time() - built)
+        logger.debug(command_string)
+        try:
+            out, err = await asyncio.wait_for(process.communicate(data), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Command timed out after %g s: %s", timeout, command_string)
+            await terminate(process)
+            raise
+        except asyncio.CancelledError:
+            await terminate(process)
+            raise
+    except:
+        if capturefile is not None:
+            logger.error("Use captured command output in %r for diagnosis.", capturefile.name)
+        raise
+    finally:
+        if capturefile is not None:
+            capturefile.close()
+
+    if core._instrumenting():
+        core._record_timing(command, cmd, timing, process.returncode,
+                            core._size(out), core._size(err))
+    result = (process.returncode, decode(out), decode(err))
+    if hasattr(command, 'check_failure'):
+        command.check_failure(result, command_string=command_string)
+    return result
+
+
+async def terminate(process):
+    """Terminate *process* and kill it if it does not exit within :data:`~gromacs.core.TERMINATE_GRACE` seconds."""
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), core.TERMINATE_GRACE)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+def decode(output):
+    # same as the universal_newlines=True of the blocking Popen
+    if output is None:
+        return None
+    output = output.decode(locale.getpreferredencoding(False))
+    return output.replace('\r\n', '\n').replace('\r', '\n')
@@ -78,6 +78,10 @@ Working with topologies and mdp files
 .. autofunction:: edit_mdp
 .. autofunction:: add_mdp_includes
 .. autofunction:: grompp_qtot
+.. autofunction:: grompp_cached
+.. autofunction:: grompp_cache_key
+.. autofunction:: topology_includes
+.. autofunction:: topology_search_path
 
 
 Working with index files
@@ -136,6 +140,11 @@ import warnings
 import tempfile
 import shutil
 import glob
+import hashlib
+import json
+import threading
+from subprocess import PIPE
+from concurrent.futures import ProcessPoolExecutor
 import six
 
 import logging
@@ -145,7 +154,9 @@ import gromacs
 from .exceptions import GromacsError, BadParameterWarning, MissingDataWarning, GromacsValueWarning, GromacsImportWarning
 from . import tools
 from . import utilities
+from . import environment
 from .utilities import asiterable
+from .fileformats import preprocessor
 
 def _define_canned_commands():
     """Define functions for the top level name space.
@@ -482,6 +493,24 @@ class Frames(object):
     iterator can be instructed to only provide a fixed number of
     frames and compute more frames when needed.
 
+    With *maxframes* the trajectory is extracted in chunks of at most
+    *maxframes* frames (time windows selected with the ``-b`` and ``-e``
+    options of ``trjconv``; the frame times are obtained with
+    ``gmxcheck``). While the frames of one chunk are analyzed the next
+    chunk is extracted in the background (*prefetch*) so that at most
+    2 × *maxframes* frames are on disk at any time. A chunk is deleted
+    as soon as the iterator moves on to the next one.
+
+    Analysis functions can be applied to all frames in a pool of
+    processes with :meth:`map`, e.g. ::
+
+       def sasa(frame):
+           gromacs.sasa(s=frame, o=frame + ".xvg", input=["Protein"])
+           return gromacs.fileformats.XVG(frame + ".xvg").array[1, 0]
+
+       frames = gromacs.cbook.Frames("md.tpr", "md.xtc", maxframes=100)
+       results = frames.map(sasa, processes=4)
+
     .. Note:: Setting a limit on the number of frames on disk can lead
               to longish waiting times because ``trjconv`` must
               re-seek to the middle of the trajectory and the only way
@@ -489,12 +518,11 @@ class Frames(object):
               sequentially. This might still be preferrable to filling
               up a disk, though.
 
-    .. Warning:: The *maxframes* option is not implemented yet; use
-                 the *dt* option or similar to keep the number of frames
-                 manageable.
+    .. versionchanged:: 0.8.0
+       Implemented *maxframes*; added *prefetch* and :meth:`map`.
     """
 
-    def __init__(self, structure, trj, maxframes=None, format='pdb', **kwargs):
+    def __init__(self, structure, trj, maxframes=None, format='pdb', prefetch=True, **kwargs):
         """Set up the Frames iterator.
 
         :Arguments:
@@ -508,6 +536,9 @@ class Frames(object):
              maximum number of frames that are extracted to disk at
              one time; set to ``None`` to extract the whole trajectory
              at once. [``None``]
+           prefetch : bool
+             extract the next chunk of *maxframes* frames while the
+             current one is analyzed [``True``]
            kwargs
              All other arguments are passed to
              `class:~gromacs.tools.Trjconv`; the only options that
@@ -517,8 +548,14 @@ class Frames(object):
         self.structure = structure  # tpr or equivalent
         self.trj = trj              # xtc, trr, ...
         self.maxframes = maxframes
+        if self.maxframes is not None and self.maxframes < 1:
+            raise ValueError("maxframes must be a positive number or None")
+        self.prefetch = prefetch
+        self.format = format
+        # time window and time step of the extracted frames
+        self.begin, self.end, self.dt = None, None, kwargs.get('dt')
         if self.maxframes is not None:
-            raise NotImplementedError('sorry, maxframes feature not implemented yet')
+            self.begin, self.end = kwargs.pop('b', None), kwargs.pop('e', None)
 
         self.framedir = tempfile.mkdtemp(prefix="Frames_", suffix='_'+format)
         self.frameprefix = os.path.join(self.framedir, 'frame')
@@ -536,14 +573,133 @@ class Frames(object):
         self.totalframes = 0
 
     def extract(self):
-        """Extract frames from the trajectory to the temporary directory."""
-        # XXX: extract everything at the moment, logic for maxframes not done yet
+        """Extract all frames from the trajectory to the temporary directory."""
         self.extractor.run()
 
+    def trajectory_times(self):
+        """Return the time of the first and last frame and the time step of the trajectory.
+
+        The times are obtained from the output of ``gmxcheck``; the time step
+        is ``None`` for a trajectory with a single frame.
+        """
+        rc, out, err = tools.Gmxcheck(f=self.trj)(stdout=False, stderr=False)
+        output = (out or "") + (err or "")
+        first = re.search(r'Reading frame\s+0\s+time\s+(?P<time>\S+)', output)
+        last = re.search(r'Last frame\s+\d+\s+time\s+(?P<time>\S+)', output)
+        step = re.search(r'^Time\s+\d+\s+(?P<step>\S+)', output, re.MULTILINE)
+        if first is None or last is None:
+            raise GromacsError("Failed to obtain the frame times of {0!r} from gmxcheck".format(self.trj))
+        timestep = float(step.group('step')) if step is not None else None
+        return float(first.group('time')), float(last.group('time')), timestep
+
+    def chunks(self):
+        """Generate the time windows ``(b, e)`` of chunks of at most *maxframes* frames."""
+        start, last, timestep = self.trajectory_times()
+        if self.dt is not None:
+            timestep = float(self.dt)
+        if self.end is not None:
+            last = min(last, float(self.end))
+        if not timestep:
+            yield self.begin, last
+            return
+        # window boundaries half a time step before the frames
+        width = self.maxframes * timestep
+        b = start - 0.5 * timestep
+        if self.begin is not None:
+            b = float(self.begin)
+            start = b
+        k = 0
+        while b <= last:
+            e = min(start + (k + 1) * width - 0.5 * timestep, last)
+            yield b, e
+            k += 1
+            b = start + k * width - 0.5 * timestep
+
+    def _extract_chunk(self, number, begin, end):
+        chunkdir = os.path.join(self.framedir, 'chunk{0:d}'.format(number))
+        os.mkdir(chunkdir)
+        frameprefix = os.path.join(chunkdir, 'frame')
+        kwargs = {'o': frameprefix + '.' + self.format, 'e': end}
+        if begin is not None:
+            kwargs['b'] = begin
+        self.extractor.run(**kwargs)
+        nframes = len(glob.glob(frameprefix + '*' + '.' + self.format))
+        return chunkdir, frameprefix + '%d' + '.' + self.format, nframes
+
+    def _extracted(self):
+        # batches of frames as (chunkdir, frametemplate, nframes), one after the other
+        if self.maxframes is None:
+            nframes = len(self.all_frames)
+            if nframes == 0:
+                self.extract()
+                nframes = len(self.all_frames)
+            yield None, self.frametemplate, nframes
+            return
+        for number, (begin, end) in enumerate(self.chunks()):
+            yield self._extract_chunk(number, begin, end)
+
+    def _produce(self, chunks, queue, slots, stop):
+        try:
+            for number, (begin, end) in enumerate(chunks):
+                slots.acquire()
+                if stop.is_set():
+                    return
+                queue.put(self._extract_chunk(number, begin, end))
+            queue.put(None)
+        except Exception as err:
+            queue.put(err)
+
+    def _prefetched(self):
+        # at most two chunks on disk: the current one and the next one
+        queue = six.moves.queue.Queue()
+        slots = threading.Semaphore(2)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce,
+                                    args=(self.chunks(), queue, slots, stop))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+                slots.release()
+        finally:
+            stop.set()
+            slots.release()
+            producer.join()
+            while not queue.empty():
+                item = queue.get()
+                if isinstance(item, tuple):
+                    shutil.rmtree(item[0], ignore_errors=True)
+
+    def batches(self):
+        """Generate the extracted batches of frames as ``(frametemplate, nframes)``.
+
+        Without *maxframes* the whole trajectory is a single batch. Otherwise
+        each chunk is deleted when the next batch is requested.
+        """
+        if self.maxframes is not None and self.prefetch:
+            extracted = self._prefetched()
+        else:
+            extracted = self._extracted()
+        try:
+            for chunkdir, frametemplate, nframes in extracted:
+                try:
+                    yield frametemplate, nframes
+                finally:
+                    if chunkdir is not None:
+                        shutil.rmtree(chunkdir, ignore_errors=True)
+        finally:
+            extracted.close()
+
     @property
     def all_frames(self):
         """Unordered list of all frames currently held on disk."""
-        return glob.glob(self.frameglob)
+        return glob.glob(self.frameglob) + glob.glob(os.path.join(self.framedir, '*', '*.' + self.format))
 
     @property
     def current_framename(self):
@@ -551,21 +707,62 @@ class Frames(object):
 
     def __iter__(self):
         """Primitive iterator."""
-        frames = self.all_frames
-        if len(frames) == 0:
-            self.extract()
-            frames = self.all_frames
-
-        # filenames are 'Frame0.pdb', 'Frame11.pdb', ... so I must
-        # order manually because glob does not give it in sequence.
-        for i in xrange(len(frames)):
-            self.framenumber = i
-            yield self.current_framename
-        self.totalframes += len(frames)
+        for frametemplate, nframes in self.batches():
+            # filenames are 'Frame0.pdb', 'Frame11.pdb', ... so I must
+            # order manually because glob does not give it in sequence.
+            self.frametemplate = frametemplate
+            for i in range(nframes):
+                self.framenumber = i
+                yield self.current_framename
+            self.totalframes += nframes
+
+    def map(self, func, processes=None):
+        """Apply *func* to the file name of every frame and return the list of results.
+
+        :Arguments:
+           *func*
+              function that takes the file name of a frame; it must be
+              picklable (i.e. defined at the top level of a module) if
+              *processes* is used
+           *processes*
+              analyze the frames of a batch in a pool of this many
+              processes while the next batch is extracted; ``None``
+              analyzes them one after the other [``None``]
+
+        :Returns: list of the results in the order of the frames
+
+        .. versionadded:: 0.8.0
+        """
+        if not processes or processes < 2:
+            return [func(frame) for frame in self]
+        # The pool analyzes one batch while the next one is extracted in this
+        # thread (no prefetch thread so that the workers are never forked
+        # while it runs); at most two batches are on disk.
+        results = []
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            previous = None
+            for batch in self._extracted():
+                chunkdir, frametemplate, nframes = batch
+                futures = [executor.submit(func, frametemplate % i) for i in range(nframes)]
+                if previous is not None:
+                    results.extend(self._collect(*previous))
+                previous = chunkdir, frametemplate, futures
+            if previous is not None:
+                results.extend(self._collect(*previous))
+        return results
+
+    def _collect(self, chunkdir, frametemplate, futures):
+        try:
+            return [future.result() for future in futures]
+        finally:
+            self.frametemplate = frametemplate
+            self.totalframes += len(futures)
+            if chunkdir is not None:
+                shutil.rmtree(chunkdir, ignore_errors=True)
 
     def delete_frames(self):
         """Delete all frames."""
-        for frame in glob.glob(self.frameglob):
+        for frame in self.all_frames:
             os.unlink(frame)
 
     def cleanup(self):
@@ -574,7 +771,7 @@ class Frames(object):
         self.framedir = None
 
     def __del__(self):
-        if self.framedir is not None:
+        if getattr(self, 'framedir', None) is not None:
             self.cleanup()
 
 # Working with topologies
@@ -615,7 +812,7 @@ def grompp_qtot(*args, **kwargs):
     # make sure to capture ALL output
     kwargs['stdout'] = False
     kwargs['stderr'] = False
-    rc, output, error = grompp_warnonly(*args, **kwargs)
+    rc, output, error = _grompp_cached(grompp_warnonly, *args, **kwargs)
     gmxoutput = "\n".join([x for x in [output, error] if x is not None])
     if rc != 0:
         # error occured and we want to see the whole output for debugging
@@ -636,6 +833,210 @@ def grompp_qtot(*args, **kwargs):
     logger.info("system total charge qtot = {qtot!r}".format(**vars()))
     return qtot
 
+
+# Caching grompp results
+# ----------------------
+
+#: Default file names that :program:`grompp` uses for its input and output files.
+GROMPP_DEFAULT_FILES = {'f': 'grompp.mdp', 'c': 'conf.gro', 'p': 'topol.top',
+                        'o': 'topol.tpr', 'po': 'mdout.mdp'}
+#: :program:`grompp` options that name input files (hashed for the cache key).
+GROMPP_INPUT_OPTIONS = ('f', 'c', 'r', 'rb', 'n', 'p', 't', 'e', 'ref', 'imd', 'qmi')
+#: :program:`grompp` options that name output files (restored from the cache).
+GROMPP_OUTPUT_OPTIONS = ('o', 'po', 'pp')
+
+#: Version of the grompp cache record format; bump to invalidate old records.
+GROMPP_CACHE_VERSION = 1
+
+_include_pattern = re.compile(r'^\s*#include\s+["<](?P<filename>[^">]+)[">]')
+
+def topology_search_path(include_dirs=None):
+    """Return the directories that :program:`grompp` searches for ``#include`` files.
+
+    The search path consists of *include_dirs* (typically from the mdp
+    ``include = -I...`` line) followed by all directories in
+    :envvar:`GMXLIB` and the ``top`` directory of the Gromacs
+    installation (from :envvar:`GMXDATA`).
+
+    .. SeeAlso:: :func:`gromacs.fileformats.preprocessor.search_path`
+    """
+    return preprocessor.search_path(include_dirs)
+
+_find_include = preprocessor.find_include
+
+def topology_includes(topology, include_dirs=None):
+    """Find all files that are ``#include``-d by *topology*, recursively.
+
+    Include files are resolved relative to the including file and then
+    along :func:`topology_search_path`. All ``#include`` statements are
+    followed regardless of ``#ifdef`` blocks so the result is a superset
+    of the files that :program:`grompp` actually reads; missing include
+    files are silently skipped.
+
+    :Returns: sorted list of real paths of the included files
+    """
+    searchpath = topology_search_path(include_dirs)
+    seen = set()
+    todo = [os.path.realpath(topology)]
+    while todo:
+        current = todo.pop()
+        try:
+            with open(current) as top:
+                lines = top.readlines()
+        except IOError:
+            continue
+        for line in lines:
+            m = _include_pattern.match(line)
+            if m is None:
+                continue
+            path = _find_include(m.group('filename'), os.path.dirname(current), searchpath)
+            if path is not None and path not in seen:
+                seen.add(path)
+                todo.append(path)
+    return sorted(seen)
+
+def _mdp_include_dirs(mdp):
+    """Return the directories listed in the ``include = -I...`` line of *mdp*."""
+    dirs = []
+    try:
+        with open(mdp) as f:
+            for line in f:
+                line = line.split(';')[0].strip()
+                key, sep, value = line.partition('=')
+                if sep and key.strip() == 'include':
+                    dirs.extend([d[2:] for d in value.split() if d.startswith('-I')])
+    except IOError:
+        pass
+    return dirs
+
+def _update_hash_with_file(h, filename, blocksize=2**20):
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+
+def grompp_cache_key(grompp, *args, **kwargs):
+    """Return a hash over all inputs of a :program:`grompp` invocation.
+
+    The hash covers the :program:`grompp` command line, the content of all
+    input files (mdp, structure, index, topology, ...) and of every file
+    that the topology ``#include``-s (see :func:`topology_includes`).
+
+    :Arguments:
+       *grompp*
+           a :class:`gromacs.tools.Grompp` instance (only used to
+           combine its default arguments with *args* and *kwargs*)
+       *args*, *kwargs*
+           arguments that one would pass to :func:`gromacs.grompp`
+    :Returns: hexdigest of the hash (a string)
+    """
+    _args, gmxargs = grompp._combine_arglist(args, kwargs)
+    for k in ('stdout', 'stderr', 'input', 'use_input', 'stdin'):
+        gmxargs.pop(k, None)
+    files = dict(GROMPP_DEFAULT_FILES)
+    files.update(gmxargs)
+
+    h = hashlib.sha1()
+    h.update(repr(GROMPP_CACHE_VERSION).encode('utf-8'))
+    h.update(repr(getattr(grompp, 'driver', None)).encode('utf-8'))
+    h.update(repr(grompp.command_name).encode('utf-8'))
+    h.update(repr(sorted((str(k).lstrip('_-'), str(v)) for k, v in gmxargs.items()))
+             .encode('utf-8'))
+
+    inputs = [files[k] for k in GROMPP_INPUT_OPTIONS if files.get(k) is not None]
+    includes = topology_includes(files['p'], _mdp_include_dirs(files['f']))
+    for filename in inputs + includes:
+        h.update(filename.encode('utf-8'))
+        if os.path.isfile(filename):
+            _update_hash_with_file(h, filename)
+    for name in ('GMXLIB', 'GMXDATA'):
+        h.update(repr(os.environ.get(name)).encode('utf-8'))
+    return h.hexdigest()
+
+def _grompp_cache_record(tpr):
+    dirname, basename = os.path.split(tpr)
+    return os.path.join(dirname, '.' + basename + '.gwcache')
+
+def _file_signature(filename):
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime]
+
+def _grompp_cached(grompp, *args, **kwargs):
+    """Run *grompp* unless a cached result for identical inputs exists.
+
+    See :func:`grompp_cached`.
+    """
+    cache = kwargs.pop('cache', None)
+    if cache is None:
+        cache = environment.flags['grompp_cache']
+    if not cache:
+        return grompp(*args, **kwargs)
+
+    _args, gmxargs = grompp._combine_arglist(args, kwargs)
+    outputs = [gmxargs.get(k, GROMPP_DEFAULT_FILES.get(k)) for k in GROMPP_OUTPUT_OPTIONS]
+    outputs = [fn for fn in outputs if fn]
+    tpr = outputs[0]
+    record_file = _grompp_cache_record(tpr)
+    key = grompp_cache_key(grompp, *args, **kwargs)
+
+    try:
+        with open(record_file) as f:
+            record = json.load(f)
+        # output that the caller wants to analyze must have been captured previously
+        captured = all(record[stream] is not None for stream in ('stdout', 'stderr')
+                       if kwargs.get(stream) in (False, PIPE))
+        if record['key'] == key and captured and all(
+                _file_signature(fn) == sig for fn, sig in record['outputs'].items()):
+            logger.info("grompp: inputs unchanged, re-using %r (cache key %s)", tpr, key)
+            return 0, record['stdout'], record['stderr']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    rc, output, error = grompp(*args, **kwargs)
+    if rc == 0 and os.path.exists(tpr):
+        record = {'version': GROMPP_CACHE_VERSION,
+                  'key': key,
+                  'outputs': {fn: _file_signature(fn) for fn in outputs
+                              if os.path.exists(fn)},
+                  'stdout': output,
+                  'stderr': error,
+                  }
+        try:
+            with open(record_file, 'w') as f:
+                json.dump(record, f)
+        except (IOError, OSError) as err:
+            logger.warning("grompp: failed to write cache record %r: %s", record_file, err)
+    return rc, output, error
+
+def grompp_cached(*args, **kwargs):
+    """Run :func:`gromacs.grompp` but skip it if nothing changed since the last run.
+
+    A hash over the :program:`grompp` command line and all input files,
+    including all files that the topology ``#include``-s, is stored next
+    to the run input file *o* (as a hidden file ``.TPR.gwcache``) together
+    with the captured output of :program:`grompp`. If the hash matches
+    and the output files (*o*, *po*, and *pp*) have not been modified
+    since, :program:`grompp` is not run again and the recorded output is
+    returned instead.
+
+    :Keywords:
+       *cache*
+           ``True`` to use the cache, ``False`` to always run
+           :program:`grompp`; ``None`` uses the value of the
+           :mod:`gromacs.environment` flag ``grompp_cache`` [``None``]
+       *args*, *kwargs*
+           all other arguments are passed to :func:`gromacs.grompp`
+
+    :Returns: ``(rc, stdout, stderr)`` as for :func:`gromacs.grompp`;
+              *stdout* and *stderr* are only available if they were
+              captured.
+
+    .. versionadded:: 0.8.0
+    """
+    return _grompp_cached(gromacs.grompp, *args, **kwargs)
+
 def _mdp_include_string(dirs):
     """Generate a string that can be added to a mdp 'include = ' line."""
     include_paths = [os.path.expanduser(p) for p in dirs]
@@ -143,6 +143,12 @@ When GromacsWrapper starts up, it tries to set the environment using the
 ``GMXRC`` defined in the config file. If this is left empty or is not in the
 file, nothing is being done.
 
+Sourcing ``GMXRC`` requires a shell. The resulting environment is
+therefore stored in ``cache/gmxrc.json`` in :data:`configdir` (if this
+directory exists, see :func:`setup`) and re-used as long as the path,
+modification time and size of ``GMXRC`` and the environment variables
+that it modifies are unchanged.
+
 .. autofunction:: set_gmxrc_environment
 
 
@@ -228,18 +234,19 @@ completely transparent to the user.
 from __future__ import absolute_import, with_statement, print_function
 
 import os
+import errno
+import json
 import logging
 import re
 import subprocess
 import sys
+import tempfile
 
 if sys.version_info[0] < 3:
     from ConfigParser import SafeConfigParser
 else:
     from configparser import SafeConfigParser
 
-from pkg_resources import resource_filename, resource_listdir
-
 from . import utilities
 
 
@@ -325,7 +332,15 @@ def _generate_template_dict(dirname):
     Templates have to be extracted from the egg because they are used
     by external code. All template filenames are stored in
     :data:`config.templates`.
+
+    Installed as a normal directory, the package files are listed
+    directly (avoiding the slow import of :mod:`pkg_resources`).
     """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), dirname)
+    if os.path.isdir(path):
+        return dict((fn, os.path.join(path, fn)) for fn in os.listdir(path)
+                    if not fn.endswith('~'))
+    from pkg_resources import resource_filename, resource_listdir
     return dict((resource_basename(fn), resource_filename(__name__, dirname +'/'+fn))
                 for fn in resource_listdir(__name__, dirname)
                 if not fn.endswith('~'))
@@ -620,7 +635,13 @@ def check_setup():
      return True
 
 
-def set_gmxrc_environment(gmxrc):
+#: Environment variables that are set by ``GMXRC`` (only v5: 'GMXPREFIX', 'GROMACS_DIR').
+GMXRC_ENVIRONMENT = ['GMXBIN', 'GMXLDLIB', 'GMXMAN', 'GMXDATA',
+                     'LD_LIBRARY_PATH', 'MANPATH', 'PKG_CONFIG_PATH',
+                     'PATH',
+                     'GMXPREFIX', 'GROMACS_DIR']
+
+def set_gmxrc_environment(gmxrc, cache=True):
     """Set the environment from ``GMXRC`` provided in *gmxrc*.
 
     Runs ``GMXRC`` in a subprocess and puts environment variables loaded by it
@@ -629,12 +650,16 @@ def set_gmxrc_environment(gmxrc):
     If *gmxrc* evaluates to ``False`` then nothing is done. If errors occur
     then only a warning will be logged. Thus, it should be safe to just call
     this function.
+
+    With *cache* = ``True`` the environment is taken from the snapshot
+    that a previous call stored in :data:`configdir` if *gmxrc* and the
+    current values of the variables in :data:`GMXRC_ENVIRONMENT` are
+    unchanged; otherwise ``GMXRC`` is run and a new snapshot is written.
+
+    .. versionchanged:: 0.8.0
+       Added the *cache* keyword.
     """
-    # only v5: 'GMXPREFIX', 'GROMACS_DIR'
-    envvars = ['GMXBIN', 'GMXLDLIB', 'GMXMAN', 'GMXDATA',
-               'LD_LIBRARY_PATH', 'MANPATH', 'PKG_CONFIG_PATH',
-               'PATH',
-               'GMXPREFIX', 'GROMACS_DIR']
+    envvars = GMXRC_ENVIRONMENT
     # in order to keep empty values, add ___ sentinels around result
     # (will be removed later)
     cmdargs = ['bash', '-c', ". {0} && echo {1}".format(gmxrc,
@@ -644,16 +669,74 @@ def set_gmxrc_environment(gmxrc):
         logger.debug("set_gmxrc_environment(): no GMXRC, nothing done.")
         return
 
-    try:
-        out = subprocess.check_output(cmdargs)
+    key = _gmxrc_key(gmxrc) if cache else None
+    environment = _read_gmxrc_snapshot(key)
+    if environment is None:
+        try:
+            out = subprocess.check_output(cmdargs)
+        except (subprocess.CalledProcessError, OSError):
+            logger.warning("Failed to automatically set the Gromacs environment"
+                           "from GMXRC=%r", gmxrc)
+            return
         out = out.strip().split()
-        for key, value in zip(envvars, out):
-            value = str(value.decode('ascii').replace('___', ''))  # remove sentinels
-            os.environ[key] = value
-            logger.debug("set_gmxrc_environment(): %s = %r", key, value)
-    except (subprocess.CalledProcessError, OSError):
-        logger.warning("Failed to automatically set the Gromacs environment"
-                       "from GMXRC=%r", gmxrc)
+        # remove sentinels
+        environment = dict((k, str(value.decode('ascii').replace('___', '')))
+                           for k, value in zip(envvars, out))
+        _write_gmxrc_snapshot(key, environment)
+    for k in envvars:
+        if k in environment:
+            os.environ[k] = environment[k]
+            logger.debug("set_gmxrc_environment(): %s = %r", k, environment[k])
+
+def _gmxrc_snapshot_file():
+    return os.path.join(configdir, 'cache', 'gmxrc.json')
+
+def _gmxrc_key(gmxrc):
+    # GMXRC and the variables that it modifies determine the result
+    try:
+        st = os.stat(gmxrc)
+    except OSError:
+        return None
+    return [os.path.realpath(gmxrc), st.st_mtime, st.st_size,
+            [os.environ.get(k) for k in GMXRC_ENVIRONMENT]]
+
+def _read_gmxrc_snapshot(key):
+    if key is None:
+        return None
+    try:
+        with open(_gmxrc_snapshot_file()) as f:
+            snapshot = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        if snapshot['key'] != key:
+            return None
+        environment = dict((str(k), str(v)) for k, v in snapshot['environment'].items()
+                           if k in GMXRC_ENVIRONMENT)
+    except (KeyError, TypeError, AttributeError):
+        logger.debug("set_gmxrc_environment(): ignoring invalid snapshot %r",
+                     _gmxrc_snapshot_file())
+        return None
+    logger.debug("set_gmxrc_environment(): using snapshot %r", _gmxrc_snapshot_file())
+    return environment
+
+def _write_gmxrc_snapshot(key, environment):
+    if key is None or not os.path.isdir(configdir):
+        return
+    filename = _gmxrc_snapshot_file()
+    try:
+        try:
+            os.mkdir(os.path.dirname(filename))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'key': key, 'environment': environment}, f)
+        os.rename(tmp, filename)
+    except (IOError, OSError) as err:
+        logger.debug("set_gmxrc_environment(): failed to write snapshot %r: %s",
+                     filename, err)
 
 
 def get_tool_names():
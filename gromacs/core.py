@@ -72,6 +72,20 @@ reflect the order of output one would see on the screen. If your code captures
 STDOUT for further processing then an uncaptured STDERR is written to the
 capture file.
 
+Commands that run at the same time (e.g. with :func:`map_command`) would
+overwrite each other's output in the single capture file. With the value
+``"rotate"`` ::
+
+    gromacs.environment.flags['capture_output'] = "rotate"
+
+every command writes to its own file instead, named like
+``gromacs_captured_output.<pid>-<n>.txt`` after
+``flags['capture_output_filename']``, with the process id and a counter.
+Only the newest ``flags['capture_output_keep']`` files (default 100) are
+kept. :func:`captured_output_file` returns the file of the last command
+that ran in the current thread and the name of the file of a failed
+command is logged.
+
 .. Note::
 
    There are some commands for which capturing output
@@ -80,20 +94,118 @@ capture file.
    because Python nevertheless stores the output internally first. Thus one
    should avoid capturing progress output from
    e.g. :class:`~gromacs.tools.Mdrun` unless the output has been throttled
-   appropriately.
+   appropriately, or stream it as described below.
+
+Output can also be *streamed*: the keyword *stream* of a command takes a
+function that is called with every line of output while the command
+runs::
+
+    gromacs.mdrun(deffnm="md", v=True, stream=lambda line: print(line, end=""))
+
+:meth:`Command.iterlines` instead returns an iterator over the lines. With
+the value ``"stream"`` of ``capture_output`` ::
+
+    gromacs.environment.flags['capture_output'] = "stream"
+
+all commands stream their output (without a function, it is simply
+discarded). In all cases STDERR is merged into STDOUT unless *stderr* is set
+and only the last ``flags['capture_output_lines']`` lines (default 1000) of
+the output are kept; they are returned as *stdout* (and *stderr*) and are
+searched for Gromacs error messages by :meth:`GromacsCommand.check_failure`.
+Memory use therefore does not grow with the amount of output.
+
+
+Concurrent execution
+--------------------
+
+Gromacs tools run in their own processes, so many invocations can be run
+at the same time from a pool of threads. :meth:`Command.submit` starts the
+command in the shared pool (see :func:`get_executor`) and immediately returns
+a :class:`concurrent.futures.Future` for the *results* tuple
+``(rc, stdout, stderr)``; :func:`map_command` (also available as
+:func:`gromacs.map`) runs a command once for each dict of keyword arguments
+in a list::
+
+  results = gromacs.map(gromacs.trjconv,
+                        [dict(f="md.xtc", o="frame{0}.pdb".format(i), dump=i,
+                              s="md.tpr", input=["System"])
+                         for i in range(100)],
+                        workers=8)
+
+Every invocation is checked with :meth:`GromacsCommand.check_failure` as
+usual, i.e. with the *failuremode* ``'raise'`` the future raises the
+:exc:`~gromacs.exceptions.GromacsError` of the failed command.
+
+Under Python 3, :meth:`Command.arun` runs a command from an :mod:`asyncio`
+event loop instead, with an optional *timeout*::
+
+  rc, out, err = await gromacs.trjconv.arun(s="md.tpr", f="md.xtc", o="protein.xtc",
+                                            input=["Protein"], timeout=600)
+
+Commands can be connected without intermediate files in a
+:class:`Pipeline`, either through standard output and input
+(:meth:`Command.pipe`) or through named pipes (:meth:`Pipeline.fifo`)
+that one tool writes while the next one reads it; all stages run at the
+same time.
+
+Long batch jobs can limit the run time of a command with the *timeout*
+keyword (in seconds); the process is terminated when it runs longer (and
+killed after :data:`TERMINATE_GRACE` seconds). A
+:class:`GromacsCommand` can also retry failures that are known to be
+transient, with a wait that doubles after every attempt::
+
+  mdrun = gromacs.tools.Mdrun(timeout=3600, retries=3, backoff=30,
+                              retry_on=["timeout", "CUDA error"])
+
+.. autofunction:: captured_output_file
+.. autofunction:: map_command
+.. autofunction:: get_executor
+.. autofunction:: shutdown_executor
+.. autodata:: TERMINATE_GRACE
+
+
+Instrumentation
+---------------
+
+With ``flags['instrumentation'] = True`` every command records the time
+to build its command line, to spawn the process and to run it, the size
+of its captured output and its return code in a :class:`CommandTiming`
+of the table returned by :func:`timings`; :func:`format_timings` sums
+them up per command::
+
+  gromacs.environment.flags['instrumentation'] = True
+  gromacs.environment.flags['instrumentation_log'] = "timings.jsonl"
+  ...
+  print(gromacs.core.format_timings())
+
+The records are also appended as JSON lines to the file
+``flags['instrumentation_log']`` if it is set. :func:`profile` records
+the commands of a block of code, even without the flag. The time spent
+in ``import gromacs`` (including tool discovery) is in
+:data:`gromacs.import_timings`.
+
+.. autoclass:: CommandTiming
+.. autofunction:: timings
+.. autofunction:: clear_timings
+.. autofunction:: format_timings
+.. autofunction:: profile
+.. autoclass:: Profile
 
 
 Classes
 -------
 
 .. autoclass:: GromacsCommand
-   :members: __call__, run, transform_args, Popen, help,
-             check_failure, gmxdoc
+   :members: __call__, run, bind, submit, arun, iterlines, pipe, transform_args, Popen,
+             help, check_failure, gmxdoc
    :inherited-members:
 
 .. autoclass:: Command
-   :members:  __call__, run, transform_args, Popen, help,
-             command_name
+   :members:  __call__, run, submit, arun, iterlines, pipe, transform_args, Popen,
+             help, command_name
+
+.. autoclass:: Pipeline
+   :members: run, add, pipe, fifo, close
 
 .. autoclass:: PopenWithInput
    :members:
@@ -103,12 +215,24 @@ import six
 
 __docformat__ = "restructuredtext en"
 
+import os
 import sys
 import re
+import itertools
 import subprocess
 from subprocess import STDOUT, PIPE
 import warnings
+import copy
 import errno
+import json
+import time
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from collections import deque, namedtuple, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import logging
 logger = logging.getLogger('gromacs.core')
@@ -116,6 +240,283 @@ logger = logging.getLogger('gromacs.core')
 
 from .exceptions import GromacsError, GromacsFailureWarning
 from . import environment
+from . import toolcache
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+_thread_state = threading.local()
+_capture_counter = itertools.count(1)
+_capture_files = deque()
+_capture_lock = threading.Lock()
+
+
+def _new_capture_filename():
+    """Return a new capture file name and remove the oldest files beyond ``flags['capture_output_keep']``."""
+    root, ext = os.path.splitext(environment.flags['capture_output_filename'])
+    fn = "{0}.{1}-{2}{3}".format(root, os.getpid(), next(_capture_counter), ext)
+    with _capture_lock:
+        _capture_files.append(fn)
+        while len(_capture_files) > environment.flags['capture_output_keep']:
+            try:
+                os.unlink(_capture_files.popleft())
+            except OSError:
+                pass
+    return fn
+
+
+def captured_output_file():
+    """Return the name of the file with the captured output of the last command of this thread.
+
+    The file name is recorded for ``flags['capture_output']`` set to
+    ``"file"`` or ``"rotate"`` and is ``None`` if no output was captured
+    to a file in the current thread.
+
+    .. versionadded:: 0.8.0
+    """
+    return getattr(_thread_state, 'capture_filename', None)
+
+
+def get_executor(workers=None):
+    """Return the thread pool that runs submitted commands.
+
+    The pool is created on first use and then shared by all commands.
+    Requesting a different number of *workers* replaces the shared pool
+    for later calls; the old pool is not shut down, so that jobs that were
+    submitted to it (or are still being submitted by another thread) are
+    run, and its threads exit when it is no longer used.
+
+    :Keywords:
+       *workers*
+           number of threads, i.e. the maximum number of commands that run
+           at the same time; ``None`` keeps the current pool or uses the
+           number of CPUs for a new one [``None``]
+
+    .. versionadded:: 0.8.0
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or (workers is not None and workers != _executor_workers):
+            _executor_workers = workers or multiprocessing.cpu_count()
+            _executor = ThreadPoolExecutor(max_workers=_executor_workers)
+            logger.debug("started executor with %d workers", _executor_workers)
+        return _executor
+
+
+def shutdown_executor(wait=True):
+    """Shut down the pool of :func:`get_executor`; a new one is created when needed.
+
+    .. versionadded:: 0.8.0
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+def map_command(command, arguments, workers=None):
+    """Run *command* concurrently once for each entry of *arguments*.
+
+    :Arguments:
+       *command*
+           :class:`Command` or :class:`GromacsCommand` instance
+       *arguments*
+           list of dicts of keyword arguments, one for each invocation; the
+           arguments are combined with the defaults of *command* as for
+           :meth:`Command.run`
+       *workers*
+           number of commands that run at the same time; the commands are
+           run in a pool of their own with this many threads instead of the
+           shared pool of :func:`get_executor` [``None``]
+
+    :Returns: list of the *results* tuples ``(rc, stdout, stderr)`` in the
+              order of *arguments*
+    :Raises: the first exception (in the order of *arguments*) after all
+             commands finished, e.g. the :exc:`~gromacs.exceptions.GromacsError`
+             of a failed Gromacs tool with the *failuremode* ``'raise'``
+
+    .. versionadded:: 0.8.0
+    """
+    if workers is None:
+        return _map_futures(get_executor(), command, arguments)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return _map_futures(executor, command, arguments)
+
+
+def _map_futures(executor, command, arguments):
+    futures = [executor.submit(command.run, **kwargs) for kwargs in arguments]
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+#: Seconds that a process has to exit after its *timeout* before it is killed.
+TERMINATE_GRACE = 5.0
+
+
+def _terminate(p):
+    """Terminate the process *p* that ran out of time; kill it after :data:`TERMINATE_GRACE` seconds."""
+    p.timed_out = True
+    try:
+        p.terminate()
+        deadline = time.time() + TERMINATE_GRACE
+        while p.returncode is None and time.time() < deadline:
+            time.sleep(0.05)
+        if p.returncode is None:
+            p.kill()
+    except OSError:
+        pass                    # process already gone
+
+
+def _start_timeout(p, timeout):
+    """Return a started timer that terminates *p* after *timeout* seconds (or ``None``)."""
+    if timeout is None:
+        return None
+    timer = threading.Timer(timeout, _terminate, args=(p,))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+#: Row of the table of :func:`timings`: the name and command line of the
+#: command, its *start* (seconds since the epoch), the seconds spent to
+#: *build* the command line, to *spawn* the process and to *run* it until
+#: all output was read, the *returncode* and the length of the captured
+#: output (``None`` if it was not captured).
+CommandTiming = namedtuple('CommandTiming', ['command', 'commandline', 'start',
+                                             'build', 'spawn', 'runtime', 'returncode',
+                                             'stdout_size', 'stderr_size'])
+
+_timings = []
+_profiles = []
+_timings_lock = threading.Lock()
+
+
+def _instrumenting():
+    return environment.flags['instrumentation'] or bool(_profiles)
+
+
+def _size(output):
+    return None if output is None else len(output)
+
+
+def _record_timing(command, cmd, timing, returncode, stdout_size, stderr_size):
+    """Record the timing of a finished process; *timing* is ``(start, build, spawn)``."""
+    start, build, spawn = timing
+    record = CommandTiming(command.command_name, cmd, start, build, spawn,
+                           time.time() - start - build - spawn, returncode,
+                           stdout_size, stderr_size)
+    with _timings_lock:
+        if environment.flags['instrumentation']:
+            _timings.append(record)
+        for profile in _profiles:
+            profile.records.append(record)
+        logfile = environment.flags['instrumentation_log']
+        if logfile:
+            with open(logfile, 'a') as f:
+                f.write(json.dumps(record._asdict()) + '\n')
+    return record
+
+
+def timings():
+    """Return the list of :class:`CommandTiming` records of all commands.
+
+    Commands are only recorded while ``flags['instrumentation']`` is
+    ``True`` (see :mod:`gromacs.environment`).
+
+    .. versionadded:: 0.8.0
+    """
+    with _timings_lock:
+        return list(_timings)
+
+
+def clear_timings():
+    """Remove all records from the table of :func:`timings`.
+
+    .. versionadded:: 0.8.0
+    """
+    with _timings_lock:
+        del _timings[:]
+
+
+def format_timings(records=None):
+    """Return a table of the total times of *records*, one line per command.
+
+    *records* is a list of :class:`CommandTiming` and defaults to
+    :func:`timings`.
+
+    .. versionadded:: 0.8.0
+    """
+    if records is None:
+        records = timings()
+    totals = OrderedDict()
+    for r in records:
+        t = totals.setdefault(r.command, [0, 0.0, 0.0, 0.0, 0, 0])
+        t[0] += 1
+        t[1] += r.build
+        t[2] += r.spawn
+        t[3] += r.runtime
+        t[4] += r.stdout_size or 0
+        t[5] += r.stderr_size or 0
+    lines = ["{0:<20s} {1:>6s} {2:>10s} {3:>10s} {4:>10s} {5:>10s} {6:>10s}".format(
+        "command", "calls", "build/s", "spawn/s", "runtime/s", "stdout", "stderr")]
+    for name, t in totals.items():
+        lines.append("{0:<20s} {1:6d} {2:10.4f} {3:10.4f} {4:10.3f} {5:10d} {6:10d}".format(
+            name, *t))
+    return "\n".join(lines)
+
+
+class Profile(object):
+    """Timings of the commands that ran in a :func:`profile` block.
+
+    :attr:`records` is the list of :class:`CommandTiming` and :attr:`elapsed`
+    the wall time of the block in seconds.
+
+    .. versionadded:: 0.8.0
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.records = []
+        self.elapsed = None
+
+    def __str__(self):
+        return format_timings(self.records)
+
+
+@contextmanager
+def profile(name=None):
+    """Record the timings of all commands that run in a ``with`` block.
+
+    The :class:`Profile` (with the :class:`CommandTiming` records of the
+    commands that ran in any thread while the block was executed) is
+    returned by the context manager and a summary is logged at the end::
+
+       with gromacs.core.profile("frames") as prof:
+           for t in range(0, 1000, 10):
+               gromacs.trjconv(s="md.tpr", f="md.xtc", o="frame{0}.pdb".format(t),
+                               dump=t, input=["System"])
+       print(prof)
+
+    Records are also written to ``flags['instrumentation_log']``, independent
+    of ``flags['instrumentation']``.
+
+    .. versionadded:: 0.8.0
+    """
+    prof = Profile(name)
+    with _timings_lock:
+        _profiles.append(prof)
+    start = time.time()
+    try:
+        yield prof
+    finally:
+        prof.elapsed = time.time() - start
+        with _timings_lock:
+            _profiles.remove(prof)
+        logger.info("profile %s: %d commands in %.3f s\n%s", name or "",
+                    len(prof.records), prof.elapsed, prof)
+
 
 class Command(object):
     """Wrap simple script or command."""
@@ -124,6 +525,16 @@ class Command(object):
     #: cannot be found by searching :envvar:`PATH`.
     command_name = None
 
+    #: Default maximum run time in seconds of each invocation (``None``: no
+    #: limit); can be replaced by the *timeout* keyword of a call.
+    timeout = None
+
+    #: Keywords that are not options of the command (see :meth:`__call__`).
+    run_keywords = ('input', 'stdin', 'stdout', 'stderr', 'use_input', 'use_shell', 'stream',
+                    'timeout')
+
+    _bound_input = None
+
     def __init__(self, *args, **kwargs):
         """Set up the command class.
 
@@ -178,6 +589,49 @@ class Command(object):
         results, p = self._run_command(*_args, **_kwargs)
         return results
 
+    def submit(self, *args, **kwargs):
+        """Run the command in the background like :meth:`run` and return a future.
+
+        The command is run in the thread pool of :func:`get_executor`. The
+        :meth:`~concurrent.futures.Future.result` of the returned
+        :class:`~concurrent.futures.Future` is the *results* tuple
+        ``(rc, stdout, stderr)`` or it raises the exception of the command
+        (such as a :exc:`~gromacs.exceptions.GromacsError` for a failed
+        Gromacs tool).
+
+        .. versionadded:: 0.8.0
+        """
+        return get_executor().submit(self.run, *args, **kwargs)
+
+    def arun(self, *args, **kwargs):
+        """Run the command from an :mod:`asyncio` event loop (Python 3 only).
+
+        Returns a coroutine that runs the command like :meth:`run`, without
+        blocking the event loop, and returns the *results* tuple
+        ``(rc, stdout, stderr)``::
+
+           rc, out, err = await gromacs.grompp.arun(f="md.mdp", c="conf.gro", o="md.tpr", stdout=False)
+
+        :Keywords:
+           *timeout*
+               maximum run time in seconds; the process is terminated (and
+               killed if it does not exit) and :exc:`asyncio.TimeoutError`
+               is raised when it runs longer [:attr:`timeout`]
+
+        All other arguments are the same as for :meth:`run`, except that the
+        *stream* keyword is not supported and that the result of a Gromacs
+        tool is not cached (*cache* is ignored). When the waiting task is
+        cancelled then the process is terminated, too.
+
+        .. versionadded:: 0.8.0
+        """
+        if six.PY2:
+            raise NotImplementedError("arun() requires Python 3")
+        from . import _aio
+        timeout = kwargs.pop('timeout', self.timeout)
+        _args, _kwargs = self._combine_arglist(args, kwargs)
+        return _aio.run_command(self, _args, _kwargs, timeout=timeout)
+
     def _combine_arglist(self, args, kwargs):
         """Combine the default values and the supplied values."""
         _args = self.args + args
@@ -194,20 +648,136 @@ class Command(object):
         # hack to run command WITHOUT input (-h...) even though user defined
         # input (should have named it "ignore_input" with opposite values...)
         use_input = kwargs.pop('use_input', True)
+        stream = kwargs.pop('stream', None)
+        if stream is not None or (environment.flags['capture_output'] == "stream" and
+                                  not ('stdout' in kwargs or 'stderr' in kwargs)):
+            results = []
+            for line in self._stream(results, use_input, *args, **kwargs):
+                if stream is not None:
+                    stream(line)
+            return results[0]
+
+        timeout = kwargs.pop('timeout', self.timeout)
+        capturefile = self._setup_capture(kwargs)
 
+        try:
+            p = self.Popen(*args, **kwargs)
+            timer = _start_timeout(p, timeout)
+            try:
+                out, err = p.communicate(use_input=use_input) # special Popen knows input!
+            finally:
+                if timer is not None:
+                    timer.cancel()
+        except:
+            if capturefile is not None:
+                logger.error("Use captured command output in %r for diagnosis.", capturefile.name)
+            raise
+        finally:
+            if capturefile is not None:
+                capturefile.close()
+        rc = p.returncode
+        if _instrumenting():
+            _record_timing(self, p.command, p.timing, rc, _size(out), _size(err))
+        if p.timed_out:
+            logger.error("Command %r timed out after %g s.", self.command_name, timeout)
+        if rc != 0 and capturefile is not None:
+            logger.error("Command %r failed; its output was captured in %r.",
+                         self.command_name, capturefile.name)
+        return (rc, out, err), p
+
+    def _stream(self, results, use_input, *args, **kwargs):
+        """Run the command and yield the lines of its output as they appear.
+
+        STDERR is merged into STDOUT unless *stderr* is set. Only the last
+        ``flags['capture_output_lines']`` lines are kept; when the command
+        finished, ``((rc, stdout_tail, stderr_tail), p)`` is appended to the
+        list *results*.
+        """
+        kwargs['stdout'] = PIPE
+        kwargs.setdefault('stderr', STDOUT)
+        timeout = kwargs.pop('timeout', self.timeout)
+        p = self.Popen(*args, **kwargs)
+        timer = _start_timeout(p, timeout)
+        maxlen = environment.flags['capture_output_lines']
+        out, err = deque(maxlen=maxlen), deque(maxlen=maxlen)
+        nout = 0
+        threads = []
+        if p.stdin is not None:
+            threads.append(threading.Thread(target=_write_input,
+                                             args=(p.stdin, p.input if use_input else None)))
+        if p.stderr is not None:
+            threads.append(threading.Thread(target=err.extend, args=(p.stderr,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for line in iter(p.stdout.readline, ''):
+                out.append(line)
+                nout += len(line)
+                yield line
+        finally:
+            # if the caller stopped early then the process gets a broken pipe
+            p.stdout.close()
+            for thread in threads:
+                thread.join()
+            p.wait()
+            if timer is not None:
+                timer.cancel()
+        stderr = "".join(err) if p.stderr is not None else None
+        if _instrumenting():
+            _record_timing(self, p.command, p.timing, p.returncode, nout, _size(stderr))
+        results.append(((p.returncode, "".join(out), stderr), p))
+
+    def iterlines(self, *args, **kwargs):
+        """Run the command and iterate over the lines of its output.
+
+        The lines of STDOUT (with STDERR merged into it unless the
+        *stderr* keyword is given) are yielded while the command runs and
+        are not kept in memory; a Gromacs tool checks for failure (see
+        :meth:`GromacsCommand.check_failure`) with the last
+        ``flags['capture_output_lines']`` lines once all output was read::
+
+           for line in gromacs.mdrun.iterlines(deffnm="md", v=True):
+               if line.startswith("step"):
+                   print(line, end="")
+
+        Arguments are the same as for :meth:`run`, except that the
+        *stream* keyword is not supported and that the result of a Gromacs
+        tool is not cached (*cache* is ignored).
+
+        .. versionadded:: 0.8.0
+        """
+        _args, _kwargs = self._combine_arglist(args, kwargs)
+        use_input = _kwargs.pop('use_input', True)
+        results = []
+        for line in self._stream(results, use_input, *_args, **_kwargs):
+            yield line
+        result, p = results[0]
+        if hasattr(self, 'check_failure'):
+            self.check_failure(result, command_string=p.command_string)
+
+    def _setup_capture(self, kwargs):
+        """Set the *stdout*/*stderr* defaults in *kwargs* for capturing output.
+
+        :Returns: the open capture file or ``None``
+        """
         # logic for capturing output (see docs on I/O and the flags)
         capturefile = None
         if environment.flags['capture_output'] is True:
             # capture into Python vars (see subprocess.Popen.communicate())
             kwargs.setdefault('stderr', PIPE)
             kwargs.setdefault('stdout', PIPE)
-        elif environment.flags['capture_output'] == "file":
+        elif environment.flags['capture_output'] in ("file", "rotate"):
             if 'stdout' in kwargs and 'stderr' in kwargs:
                 pass
             else:
-                # XXX: not race or thread proof; potentially many commands write to the same file
-                fn = environment.flags['capture_output_filename']
-                capturefile = file(fn, "w")   # overwrite (clobber) capture file
+                if environment.flags['capture_output'] == "file":
+                    # XXX: not race or thread proof; potentially many commands write to the same file
+                    fn = environment.flags['capture_output_filename']
+                else:
+                    fn = _new_capture_filename()
+                capturefile = open(fn, "w")   # overwrite (clobber) capture file
+                _thread_state.capture_filename = fn
                 if 'stdout' in kwargs and 'stderr' not in kwargs:
                     # special case of stdout used by code but stderr should be captured to file
                     kwargs.setdefault('stderr', capturefile)
@@ -216,19 +786,7 @@ class Command(object):
                     # (stderr comes *before* stdout in capture file, could split...)
                     kwargs.setdefault('stderr', STDOUT)
                     kwargs.setdefault('stdout', capturefile)
-
-        try:
-            p = self.Popen(*args, **kwargs)
-            out, err = p.communicate(use_input=use_input) # special Popen knows input!
-        except:
-            if capturefile is not None:
-                logger.error("Use captured command output in %r for diagnosis.", capturefile)
-            raise
-        finally:
-            if capturefile is not None:
-                capturefile.close()
-        rc = p.returncode
-        return (rc, out, err), p
+        return capturefile
 
     def _commandline(self, *args, **kwargs):
         """Returns the command line (without pipes) as a list."""
@@ -249,9 +807,29 @@ class Command(object):
         input. This is necessary if one wants to chain the output from
         one command to an input from another.
 
-        :TODO:
-          Write example.
+        :meth:`pipe` and :class:`Pipeline` use it to connect commands.
         """
+        start = time.time()
+        cmd, stdin, stdout, stderr, input, use_shell = self._popen_arguments(*args, **kwargs)
+        built = time.time()
+        try:
+            p = PopenWithInput(cmd, stdin=stdin, stderr=stderr, stdout=stdout,
+                               universal_newlines=True, input=input, shell=use_shell)
+        except OSError as err:
+            logger.error(" ".join(cmd))            # log command line
+            if err.errno == errno.ENOENT:
+                errmsg = "Failed to find Gromacs command {0!r}, maybe its not on PATH or GMXRC must be sourced?".format(self.command_name)
+                logger.fatal(errmsg)
+                raise OSError(errmsg)
+            else:
+                logger.exception("Setting up Gromacs command {0!r} raised an exception.".format(self.command_name))
+                raise
+        p.timing = (start, built - start, time.time() - built)
+        logger.debug(p.command_string)
+        return p
+
+    def _popen_arguments(self, *args, **kwargs):
+        """Return ``(cmd, stdin, stdout, stderr, input, use_shell)`` for starting the process."""
         stderr = kwargs.pop('stderr', None)     # default: print to stderr (if STDOUT then merge)
         if stderr is False:                     # False: capture it
             stderr = PIPE
@@ -268,35 +846,18 @@ class Command(object):
         input = kwargs.pop('input', None)
 
         use_shell = kwargs.pop('use_shell', False)
+        if kwargs.pop('stream', None) is not None:
+            raise ValueError("The stream keyword is only supported by run().")
+        for name in self.run_keywords:
+            kwargs.pop(name, None)              # e.g. cache, which only run() uses
         if input:
             stdin = PIPE
-            if isinstance(input, six.string_types) and not input.endswith('\n'):
-                # make sure that input is a simple string with \n line endings
-                input = six.text_type(input) + '\n'
-            else:
-                try:
-                    # make sure that input is a simple string with \n line endings
-                    input = '\n'.join(map(six.text_type, input)) + '\n'
-                except TypeError:
-                    # so maybe we are a file or something ... and hope for the best
-                    pass
+            if input is not self._bound_input:   # already a string (see GromacsCommand.bind())
+                input = _input_string(input)
 
         cmd = self._commandline(*args, **kwargs)   # lots of magic happening here
                                                    # (cannot move out of method because filtering of stdin etc)
-        try:
-            p = PopenWithInput(cmd, stdin=stdin, stderr=stderr, stdout=stdout,
-                               universal_newlines=True, input=input, shell=use_shell)
-        except OSError as err:
-            logger.error(" ".join(cmd))            # log command line
-            if err.errno == errno.ENOENT:
-                errmsg = "Failed to find Gromacs command {0!r}, maybe its not on PATH or GMXRC must be sourced?".format(self.command_name)
-                logger.fatal(errmsg)
-                raise OSError(errmsg)
-            else:
-                logger.exception("Setting up Gromacs command {0!r} raised an exception.".format(self.command_name))
-                raise
-        logger.debug(p.command_string)
-        return p
+        return cmd, stdin, stdout, stderr, input, use_shell
 
     def transform_args(self, *args, **kwargs):
         """Transform arguments and return them as a list suitable for Popen."""
@@ -364,6 +925,10 @@ class Command(object):
                      returns the output as a string in the stderr return parameter
              ``None`` or ``True``
                      keeps it on stderr (and presumably on screen)
+          *timeout*
+             maximum run time in seconds; the process is terminated (and
+             killed after :data:`TERMINATE_GRACE` seconds) when it runs
+             longer [:attr:`timeout`]
 
         Depending on the value of the GromacsWrapper flag
         :data:`gromacs.environment.flags```['capture_output']`` the above
@@ -393,10 +958,24 @@ class Command(object):
            when requiring these special streams (and the special boolean
            switches ``True``/``False`` cannot do what you need.)
 
-           (TODO: example for chaining commands)
+           :meth:`pipe` and :class:`Pipeline` set up such chains of commands.
         """
         return self.run(*args, **kwargs)
 
+    def pipe(self, command, *args, **kwargs):
+        """Return a :class:`Pipeline` that feeds the output of this command into *command*.
+
+        *args* and *kwargs* are the arguments of *command*; this command runs
+        with its default arguments (e.g. from :meth:`GromacsCommand.bind`)::
+
+           Grep = type("Grep", (gromacs.core.Command,), {'command_name': 'grep'})
+           pipeline = gromacs.dump.bind(s="md.tpr").pipe(Grep(), "-c", "bonds", stdout=False)
+           (rc_dump, _, _), (rc_grep, nbonds, _) = pipeline.run()
+
+        .. versionadded:: 0.8.0
+        """
+        return Pipeline().add(self).pipe(command, *args, **kwargs)
+
 
 class GromacsCommand(Command):
     """Base class for wrapping a Gromacs tool.
@@ -432,6 +1011,12 @@ class GromacsCommand(Command):
     #: Available failure modes.
     failuremodes = ('raise', 'warn', None)
 
+    #: Keywords that are not Gromacs options (see :meth:`Command.__call__`).
+    run_keywords = Command.run_keywords + ('cache',)
+
+    _bound_options = {}
+    _argv_prefix = None
+
     def __init__(self, *args, **kwargs):
         """Set up the command with gromacs flags as keyword arguments.
 
@@ -511,13 +1096,53 @@ class GromacsCommand(Command):
            *doc* : string
               additional documentation (*ignored*) []
 
+           *timeout*
+              maximum run time in seconds of each invocation; a command
+              that runs longer is terminated (and killed if it does not
+              exit) and treated as failed [``None``]
+
+           *retries*
+              how often a failed invocation is run again if its failure
+              matches *retry_on*  [0]
+
+           *retry_on*
+              list of failures that are retried: return codes (integers),
+              regular expressions that are searched in the captured output
+              (e.g. ``"Cannot open file"``) and/or the string ``"timeout"``
+              for an invocation that timed out [``()``]
+
+           *backoff*
+              seconds to wait before the first retry; the wait is doubled
+              for every further retry [1.0]
+
+           *cache*
+              ``True`` re-uses the output of an earlier invocation with the
+              same command line and input files (see
+              :mod:`gromacs.resultcache`), ``False`` always runs the tool;
+              ``None`` uses the :mod:`gromacs.environment` flag
+              ``result_cache``; can also be given for a single call [``None``]
+
+        The failure handling can also be changed later through the attributes
+        :attr:`failuremode`, :attr:`timeout`, :attr:`retries`, :attr:`retry_on`
+        and :attr:`backoff`, e.g. ::
+
+           mdrun = gromacs.tools.Mdrun(timeout=24*3600, retries=2, retry_on=[
+                                       "timeout", "Cannot allocate memory", "CUDA error"])
+
         .. versionchanged:: 0.6.0
            The *doc* keyword is now ignored (because it was not worth the effort to
            make it work with the lazy-loading of docs).
+        .. versionchanged:: 0.8.0
+           Added the *timeout*, *retries*, *retry_on*, *backoff* and *cache* keywords.
         """
         doc = kwargs.pop('doc', None)  # ignored
         self.__failuremode = None
         self.failuremode = kwargs.pop('failure', 'raise')
+        self.timeout = kwargs.pop('timeout', None)
+        self.retries = kwargs.pop('retries', 0)
+        self.retry_on = kwargs.pop('retry_on', ())
+        self.backoff = kwargs.pop('backoff', 1.0)
+        self.cache = kwargs.pop('cache', None)
         self.gmxargs = self._combineargs(*args, **kwargs)
         self._doc_cache = None
 
@@ -543,12 +1168,61 @@ class GromacsCommand(Command):
         return locals()
     failuremode = property(**failuremode())
 
+    def run(self, *args, **kwargs):
+        """Run the command; args/kwargs are added or replace the ones given to the constructor.
+
+        With *cache* = ``True`` (see :meth:`__init__`) the result of an
+        earlier invocation with the same inputs is re-used.
+        """
+        _args, _kwargs = self._combine_arglist(args, kwargs)
+        cache = _kwargs.pop('cache', self.cache)
+        if cache is None:
+            cache = environment.flags['result_cache']
+        if cache:
+            from . import resultcache
+            return resultcache.run(self, _args, _kwargs)
+        results, p = self._run_command(*_args, **_kwargs)
+        return results
+
     def _combine_arglist(self, args, kwargs):
         """Combine the default values and the supplied values."""
         gmxargs = self.gmxargs.copy()
         gmxargs.update(self._combineargs(*args, **kwargs))
         return (), gmxargs    # Gromacs tools don't have positional args --> args = ()
 
+    def bind(self, *args, **kwargs):
+        """Return a copy of the command with fixed options compiled into its command line.
+
+        The arguments are the same as for :meth:`run`. They are turned
+        into the strings of the command line once, so that a later
+        invocation of the bound command only has to process its own
+        arguments. This matters in loops that run a tool many times::
+
+           dump = gromacs.trjconv.bind(s="md.tpr", f="md.xtc", input=["Protein"])
+           for t in range(0, 10000, 10):
+               dump(o="frame{0}.pdb".format(t), dump=t)
+
+        Options of the bound command can still be given again in a call
+        (the new value is used); *input* is joined into a single string
+        when the command is bound.
+
+        .. versionadded:: 0.8.0
+        """
+        _args, gmxargs = self._combine_arglist(args, kwargs)
+        bound = copy.copy(self)
+        bound.gmxargs = {}
+        bound._bound_options = self._bound_options.copy()
+        for name, value in gmxargs.items():
+            if name in self.run_keywords:
+                bound.gmxargs[name] = value
+            else:
+                bound._bound_options[name] = value
+        input = bound.gmxargs.get('input')
+        if input and input is not self._bound_input:
+            bound.gmxargs['input'] = bound._bound_input = _input_string(input)
+        bound._argv_prefix = self._build_arg_list(**bound._bound_options)
+        return bound
+
     def check_failure(self, result, msg='Gromacs tool failed', command_string=None):
         rc, out, err = result
         if command_string is not None:
@@ -607,15 +1281,50 @@ class GromacsCommand(Command):
 
     def _run_command(self,*args,**kwargs):
         """Execute the gromacs command; see the docs for __call__."""
-        result, p = super(GromacsCommand, self)._run_command(*args, **kwargs)
-        self.check_failure(result, command_string=p.command_string)
+        for attempt in itertools.count():
+            result, p = super(GromacsCommand, self)._run_command(*args, **kwargs)
+            if attempt < self.retries and self._retry(result, p):
+                delay = self.backoff * 2**attempt
+                logger.warning("Gromacs tool %r failed with return code %r; retry %d of %d in %g s.",
+                               self.command_name, result[0], attempt + 1, self.retries, delay)
+                time.sleep(delay)
+                continue
+            break
+        msg = 'Gromacs tool failed'
+        if p.timed_out:
+            msg = 'Gromacs tool timed out'
+        self.check_failure(result, msg=msg, command_string=p.command_string)
         return result, p
 
+    def _retry(self, result, p):
+        """Return ``True`` if the failure in *result* matches :attr:`retry_on`."""
+        rc, out, err = result
+        if rc == 0:
+            return False
+        for failure in self.retry_on:
+            if isinstance(failure, six.string_types):
+                if failure == "timeout":
+                    if p.timed_out:
+                        return True
+                elif any(re.search(failure, output) for output in (out, err) if output):
+                    return True
+            elif rc == failure:
+                return True
+        return False
+
     def _commandline(self, *args, **kwargs):
         """Returns the command line (without pipes) as a list. Inserts driver if present"""
+        if self._argv_prefix is None:
+            arglist = self.transform_args(*args, **kwargs)
+        elif six.viewkeys(self._bound_options).isdisjoint(kwargs):
+            arglist = self._argv_prefix + self.transform_args(*args, **kwargs)   # bound with bind()
+        else:
+            options = self._bound_options.copy()
+            options.update(kwargs)
+            arglist = self.transform_args(*args, **options)
         if(self.driver is not None):
-            return [self.driver, self.command_name] + self.transform_args(*args, **kwargs)
-        return [self.command_name] + self.transform_args(*args, **kwargs)
+            return [self.driver, self.command_name] + arglist
+        return [self.command_name] + arglist
 
 
     def transform_args(self,*args,**kwargs):
@@ -632,9 +1341,14 @@ class GromacsCommand(Command):
         if self._doc_cache is not None:
             return self._doc_cache
 
+        executable = self.driver or self.command_name
+        self._doc_cache = toolcache.get(executable, self.command_name)
+        if self._doc_cache is not None:
+            return self._doc_cache
+
         try:
             logging.disable(logging.CRITICAL)
-            rc, header, docs = self.run('h', stdout=PIPE, stderr=PIPE, use_input=False)
+            rc, header, docs = self.run('h', stdout=PIPE, stderr=PIPE, use_input=False, cache=False)
         except:
             logging.critical("Invoking command {0} failed when determining its doc string. Proceed with caution".format(self.command_name))
             self._doc_cache = "(No Gromacs documentation available)"
@@ -654,9 +1368,228 @@ class GromacsCommand(Command):
                 return self._doc_cache
 
         self._doc_cache = m.group('DOCS')
+        toolcache.put(executable, self.command_name, self._doc_cache)
         return self._doc_cache
 
 
+class Pipeline(object):
+    """Commands that run at the same time and pass data without intermediate files.
+
+    A stage that is added with :meth:`pipe` reads the output of the previous
+    stage on its standard input. Gromacs tools mostly read files, which can
+    be named pipes (FIFOs) that are made with :meth:`fifo`: the stages run
+    concurrently, one writing and the other reading the FIFO, so that
+    large intermediate trajectories never hit the disk::
+
+       with gromacs.core.Pipeline() as pipeline:
+           xtc = pipeline.fifo(".xtc")
+           pipeline.add(gromacs.trjconv, s="md.tpr", f="md.xtc", o=xtc, input=["Protein"])
+           pipeline.add(gromacs.rms, s="md.tpr", f=xtc, o="rmsd.xvg",
+                        input=["Backbone", "Backbone"])
+           results = pipeline.run()
+
+    Only formats that Gromacs reads and writes sequentially (such as
+    XTC, TRR or GRO) can go through a FIFO.
+
+    :meth:`run` returns the *results* tuples ``(rc, stdout, stderr)`` of
+    all stages. When a stage fails then the remaining stages are
+    terminated (a reader of a FIFO would otherwise wait for ever) and
+    the failures are handled as for the individual commands (see
+    :meth:`GromacsCommand.check_failure`).
+
+    The stages do not support the *stream* keyword of :meth:`Command.run`,
+    and the results of Gromacs tools are not cached (*cache* is ignored).
+
+    .. versionadded:: 0.8.0
+    """
+
+    def __init__(self, commands=(), fifodir=None):
+        """Set up the pipeline.
+
+        :Arguments:
+           *commands*
+               list of commands that are connected like a shell pipe
+               (see :meth:`pipe`), each with its default arguments [``()``]
+           *fifodir*
+               directory in which the temporary directory for the FIFOs
+               of :meth:`fifo` is created [``None``: system default]
+        """
+        self.stages = []
+        self.fifos = []
+        self.fifodir = fifodir
+        self._tmpdir = None
+        for command in commands:
+            if self.stages:
+                self.pipe(command)
+            else:
+                self.add(command)
+
+    def add(self, command, *args, **kwargs):
+        """Add a stage that runs *command* with *args* and *kwargs*.
+
+        :Returns: the pipeline itself
+        """
+        if kwargs.get('stream') is not None:
+            raise ValueError("A stage of a pipeline cannot stream its output.")
+        self.stages.append((command, args, kwargs, False))
+        return self
+
+    def pipe(self, command, *args, **kwargs):
+        """Add a stage that reads the output of the previous stage.
+
+        :Returns: the pipeline itself
+        """
+        if not self.stages:
+            raise ValueError("The first stage of a pipeline cannot read from a pipe.")
+        if kwargs.get('input') or kwargs.get('stdin') is not None:
+            raise ValueError("A piped stage cannot have input or stdin.")
+        if kwargs.get('stream') is not None:
+            raise ValueError("A stage of a pipeline cannot stream its output.")
+        self.stages.append((command, args, kwargs, True))
+        return self
+
+    def fifo(self, suffix=""):
+        """Create a named pipe (FIFO) and return its path.
+
+        *suffix* is the file name extension such as ``".xtc"`` that tells
+        Gromacs the file format. FIFOs are removed by :meth:`close`.
+        """
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="gw_pipeline_", dir=self.fifodir)
+        path = os.path.join(self._tmpdir, "fifo{0}{1}".format(len(self.fifos), suffix))
+        os.mkfifo(path)
+        self.fifos.append(path)
+        return path
+
+    def close(self):
+        """Remove the FIFOs."""
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+            self.fifos = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self):
+        """Run all stages at the same time and wait until they finished.
+
+        :Returns: list with the *results* tuple ``(rc, stdout, stderr)`` of
+                  each stage
+        """
+        processes, capturefiles, timers = [], [], []
+        try:
+            for i, (command, args, kwargs, piped) in enumerate(self.stages):
+                _args, _kwargs = command._combine_arglist(args, kwargs)
+                use_input = _kwargs.pop('use_input', True)
+                timeout = _kwargs.pop('timeout', command.timeout)
+                if i + 1 < len(self.stages) and self.stages[i + 1][3]:
+                    _kwargs['stdout'] = PIPE
+                if piped:
+                    if _kwargs.get('input'):
+                        raise ValueError("A piped stage cannot have input.")
+                    _kwargs['stdin'] = processes[-1].stdout
+                capturefiles.append(command._setup_capture(_kwargs))
+                p = command.Popen(*_args, **_kwargs)
+                p.use_input = use_input
+                processes.append(p)
+                timers.append(_start_timeout(p, timeout))
+            for i, (command, args, kwargs, piped) in enumerate(self.stages):
+                if piped:
+                    # only the stages hold the pipe so that they see when the other end exits
+                    processes[i - 1].stdout.close()
+                    processes[i - 1].stdout = None
+
+            results = [None] * len(processes)
+            finished = []
+            lock = threading.Lock()
+
+            def communicate(i, p):
+                out, err = p.communicate(use_input=p.use_input)
+                results[i] = (p.returncode, out, err)
+                with lock:
+                    finished.append(i)
+                    if p.returncode != 0:
+                        for other in processes:
+                            if other.returncode is None:
+                                try:
+                                    other.terminate()
+                                except OSError:
+                                    pass
+
+            threads = [threading.Thread(target=communicate, args=(i, p))
+                       for i, p in enumerate(processes)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        except:
+            for p in processes:
+                if p.returncode is None:
+                    p.kill()
+                    p.wait()
+            raise
+        finally:
+            for timer in timers:
+                if timer is not None:
+                    timer.cancel()
+            for capturefile in capturefiles:
+                if capturefile is not None:
+                    capturefile.close()
+
+        for i in finished:
+            command, p = self.stages[i][0], processes[i]
+            if _instrumenting():
+                out, err = results[i][1:]
+                _record_timing(command, p.command, p.timing, p.returncode, _size(out), _size(err))
+            if hasattr(command, 'check_failure'):
+                msg = 'Gromacs tool in pipeline failed'
+                if p.timed_out:
+                    msg = 'Gromacs tool in pipeline timed out'
+                command.check_failure(results[i], msg=msg, command_string=p.command_string)
+        return results
+
+    __call__ = run
+
+
+def _input_string(input):
+    """Return *input* as a simple string with \\n line endings (if possible)."""
+    if isinstance(input, six.string_types) and not input.endswith('\n'):
+        return six.text_type(input) + '\n'
+    try:
+        return '\n'.join(map(six.text_type, input)) + '\n'
+    except TypeError:
+        # so maybe we are a file or something ... and hope for the best
+        return input
+
+
+def _write_input(stdin, input):
+    try:
+        if input:
+            stdin.write(input)
+    except (IOError, OSError):
+        pass                    # process exited without reading all input
+    finally:
+        try:
+            stdin.close()
+        except (IOError, OSError):
+            pass
+
+
+def _command_string(cmd, input=None):
+    """Return the command line *cmd* (a list) as a shell command, showing its *input*."""
+    try:
+        input_string = 'printf "' + \
+            input.replace('\n','\\n') + '" | '  # display newlines
+    except (TypeError, AttributeError):
+        input_string = ""
+    return input_string + " ".join(cmd)
+
+
 class PopenWithInput(subprocess.Popen):
     """Popen class that knows its input.
 
@@ -676,6 +1609,8 @@ class PopenWithInput(subprocess.Popen):
 
     .. _issue 5179: http://bugs.python.org/issue5179
     """
+    #: ``True`` if the process was terminated because it exceeded its *timeout*.
+    timed_out = False
 
     def __init__(self, *args, **kwargs):
         """Initialize with the standard :class:`subprocess.Popen` arguments.
@@ -691,12 +1626,7 @@ class PopenWithInput(subprocess.Popen):
             # in Python 2, subprocess.Popen uses os.write(chunk) with default ASCII encoding
             self.input = self.input.encode('utf-8')
         self.command = args[0]
-        try:
-            input_string = 'printf "' + \
-                self.input.replace('\n','\\n') + '" | '  # display newlines
-        except (TypeError, AttributeError):
-            input_string = ""
-        self.command_string = input_string + " ".join(self.command)
+        self.command_string = _command_string(self.command, self.input)
         super(PopenWithInput,self).__init__(*args, **kwargs)
 
     def communicate(self, use_input=True):
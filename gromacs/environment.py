@@ -170,6 +170,8 @@ _flags = [
           {True: True,
            False: False,
            'file': 'file',
+           'stream': 'stream',
+           'rotate': 'rotate',
            },
           """
             Select if Gromacs command output is *always* captured.
@@ -201,9 +203,41 @@ _flags = [
             STDOUT, which does not necessarily reflect the order of
             output one would see on the screen.
 
+            With ``"rotate"`` every command writes to a new file that
+            is named after ``flags['capture_output_filename']``, which
+            is safe for commands that run at the same time; only the
+            newest ``flags['capture_output_keep']`` files are kept.
+
+            With ``"stream"`` the output is read line by line while
+            the command runs and only the last
+            ``flags['capture_output_lines']`` lines are kept (see
+            :mod:`gromacs.core`).
+
             The default is %(default)r.
           """
           ),
+    _Flag('capture_output_keep',
+          100,
+          doc="""
+            Number of capture files that are kept for ``flags['capture_output'] = "rotate"``
+
+            >>> flags['%(name)s'] = %(value)r
+
+            The oldest capture files of the current process are removed.
+            The default is %(default)r.
+          """),
+    _Flag('capture_output_lines',
+          1000,
+          doc="""
+            Number of lines of streamed output that are kept for diagnosis
+
+            >>> flags['%(name)s'] = %(value)r
+
+            Streamed output (``flags['capture_output'] = "stream"`` or the
+            *stream* keyword of a command) is not stored; only the last
+            lines are returned and searched for Gromacs error messages.
+            The default is %(default)r.
+          """),
     _Flag('capture_output_filename',
           'gromacs_captured_output.txt',
           doc="""
@@ -213,6 +247,112 @@ _flags = [
 
             This is an *experimental* feature. The default is %(default)r.
           """),
+    _Flag('grompp_cache',
+          False,
+          {True: True,
+           False: False,
+           },
+          """
+            Re-use results of :program:`grompp` when its inputs did not change.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            If set to ``True`` then :func:`gromacs.cbook.grompp_cached`
+            (and thus :func:`gromacs.cbook.grompp_qtot` and the
+            :mod:`gromacs.setup` functions) only run :program:`grompp`
+            if the command line, the mdp file, the structure, the
+            topology, or any of the files included by the topology
+            changed since the run input file was last produced.
+
+            The default is %(default)r.
+          """),
+    _Flag('tool_cache',
+          True,
+          {True: True,
+           False: False,
+           },
+          """
+            Cache the lists of Gromacs tools and their documentation on disk.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            If set to ``True`` then the tools that a Gromacs driver
+            provides and the documentation of each tool are stored in
+            the configuration directory (see :mod:`gromacs.toolcache`)
+            and new Python processes do not have to run Gromacs to
+            find them again.
+
+            The default is %(default)r.
+          """),
+    _Flag('instrumentation',
+          False,
+          {True: True,
+           False: False,
+           },
+          """
+            Record the timings of every command that is run.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            If set to ``True`` then the time to build the command line,
+            to start the process and to run it, the size of the captured
+            output and the return code of every
+            :class:`~gromacs.core.Command` are recorded in the table of
+            :func:`gromacs.core.timings` (and written to
+            ``flags['instrumentation_log']``). See also
+            :func:`gromacs.core.profile`.
+
+            The default is %(default)r.
+          """),
+    _Flag('instrumentation_log',
+          None,
+          doc="""
+            Name of a file to which the timings of commands are appended.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            If set then every record of ``flags['instrumentation']``
+            (and of :func:`gromacs.core.profile`) is appended to this
+            file as one line of JSON. The default is %(default)r.
+          """),
+    _Flag('result_cache',
+          False,
+          {True: True,
+           False: False,
+           },
+          """
+            Re-use the results of Gromacs tools that ran on the same inputs.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            If set to ``True`` then the output files and captured
+            output of every successful :class:`~gromacs.core.GromacsCommand`
+            are stored in ``flags['result_cache_dir']`` and restored
+            instead of running the tool again with the same command
+            line and unchanged input files (see :mod:`gromacs.resultcache`).
+
+            The default is %(default)r.
+          """),
+    _Flag('result_cache_dir',
+          None,
+          doc="""
+            Directory of the cache of ``flags['result_cache']``.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            ``None`` uses ``results`` in the configuration directory
+            (``~/.gromacswrapper/results``). The default is %(default)r.
+          """),
+    _Flag('result_cache_size',
+          2**30,
+          doc="""
+            Maximum size in bytes of the cache of ``flags['result_cache']``.
+
+            >>> flags['%(name)s'] = %(value)r
+
+            The least recently used results are removed when the cache
+            grows larger. The default is %(default)r.
+          """),
     ]
 
 #: Global flag registry for :mod:`gromacs.environment`.
@@ -48,6 +48,27 @@ Classes
 .. autoclass:: Exclusion
     :members:
 
+.. autoclass:: GromacsParameters
+.. autoclass:: ParamDict
+.. autoclass:: ParamList
+.. autoclass:: SharedParameters
+
+.. autoclass:: TypeIndex
+    :members:
+
+Compact storage
+---------------
+
+The atoms and bonded terms of the molecules of a :class:`~gromacs.fileformats.top.TOP`
+are stored in structured numpy arrays. The usual :class:`Atom` and
+:class:`Param` instances are only created when they are accessed.
+
+.. autoclass:: AtomArray
+    :members:
+.. autoclass:: AtomView
+.. autoclass:: ParamArray
+    :members:
+
 History
 -------
 
@@ -55,8 +76,28 @@ Sources adapted from code by Reza Salari https://github.com/resal81/PyTopol
 
 """
 
+import copy
 import logging
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+import numpy as np
+from six.moves import intern
+
+class _NoFunc(object):
+    __slots__ = ()
+
+    def __reduce__(self):
+        # the same sentinel after pickling and copying
+        return '_NOFUNC'
+
+#: marks :attr:`Param.gromacs` parameters without a 'func' entry
+_NOFUNC = _NoFunc()
+
 class System(object):
     """Top-level class containing molecule topology.
 
@@ -117,11 +158,17 @@ class Molecule(object):
 
 
     """
+    #: Sections of bonded terms that can be stored compactly as a :class:`ParamArray`.
+    param_sections = ('pairs', 'bonds', 'angles', 'dihedrals', 'impropers', 'cmaps',
+                      'constraints')
+
     def __init__(self):
         self.chains    = []
         self.atoms     = []
         self.residues  = []
 
+        self._params   = {}         # section: list of Param or ParamArray
+
         self.bonds     = []
         self.angles    = []
         self.dihedrals = []
@@ -142,6 +189,39 @@ class Molecule(object):
         self._anumb_to_atom = {}
 
 
+    def _param_section(section):
+        def fget(self):
+            terms = self._params[section]
+            if isinstance(terms, ParamArray):
+                # create Param instances on first access
+                terms = self._params[section] = terms.materialize(self.atoms)
+                if section in self.information:
+                    self.information[section] = terms
+            return terms
+        def fset(self, terms):
+            self._params[section] = terms
+        doc = "List of the {0} of the molecule.".format(section)
+        return property(fget, fset, doc=doc)
+
+    pairs = _param_section('pairs')
+    bonds = _param_section('bonds')
+    angles = _param_section('angles')
+    dihedrals = _param_section('dihedrals')
+    impropers = _param_section('impropers')
+    cmaps = _param_section('cmaps')
+    constraints = _param_section('constraints')
+    del _param_section
+
+    def param_array(self, section):
+        """Return the :class:`ParamArray` that holds the terms of *section*.
+
+        Returns ``None`` if the terms of *section* are not (or no longer)
+        stored compactly, e.g., because the list of :class:`Param`
+        instances for the section was accessed.
+        """
+        terms = self._params.get(section)
+        return terms if isinstance(terms, ParamArray) else None
+
     def anumb_to_atom(self, anumb):
         '''Returns the atom object corresponding to an atom number'''
 
@@ -222,6 +302,9 @@ class Atom(object):
         resnumb = int,
         altloc  = str,         # per atoms
     """
+    __slots__ = ('coords', 'altlocs', 'name', 'number', 'flag', 'residue', 'occup',
+                 'bfactor', 'atomtype', 'radius', 'charge', 'mass', 'chain', 'resname',
+                 'resnumb', 'altloc', 'cgnr')
 
     def __init__(self):
 
@@ -255,7 +338,25 @@ class Param(object):
     GROMACS and CHARMM notation: change kJ/mol into kcal/mol and nm into Angstrom.
 
     :attr:`disabled` for supressing output when writing-out to a file.
+
+    :attr:`line` is the line number of the parameter in the file it was
+    read from and :attr:`source` the real path of that file (``None`` if
+    the parameter was not read from a file).
+
+    Instances use ``__slots__``. The GROMACS parameters are kept in flat
+    fields and :attr:`gromacs` returns a :class:`GromacsParameters` dict
+    of them (the same one on every access); the parameter dicts (and the
+    :attr:`charmm` parameters) are only allocated when they are accessed.
+
+    :meth:`copy` creates copies that share the parameters with the
+    original until either of them modifies them (copy-on-write).
     """
+    __slots__ = ('format', 'comment', 'line', 'source', 'disabled',
+                 '_charmm', '_param', '_func', '_extra', '_cow', '_share', '_gromacs')
+
+    #: :attr:`charmm` and :attr:`gromacs` parameters of a new instance
+    _charmm_template = None
+    _gromacs_template = None
 
     def __init__(self, format):
         assert format in ('charmm', 'gromacs')
@@ -263,9 +364,170 @@ class Param(object):
 
         self.comment = None
         self.line  = None
+        self.source = None
         self.disabled = False
-        self.charmm = None
-        self.gromacs = None
+
+        self._charmm = None
+        self._param = None      # created from the template on first access
+        self._func = _NOFUNC if self._gromacs_template is None else \
+                     self._gromacs_template.get('func', _NOFUNC)
+        self._extra = None      # any other entries of gromacs
+        self._cow = False       # True if the 'param' entry is borrowed from _share
+        self._share = None      # _SharedValue of the borrowed or lent 'param' entry
+        self._gromacs = None    # GromacsParameters instance of gromacs
+
+    def copy(self, param=None):
+        """Return a copy that shares the parameters with this instance.
+
+        The ``gromacs['param']`` entry is only duplicated when the copy or
+        the original modifies it (copy-on-write), so that many copies of a
+        parameter type cost little more than their atoms and atom types.
+        This includes modifications through dicts or lists of the
+        parameters that were obtained before the copy was made. The other
+        (small) entries and the :attr:`charmm` parameters are copied.
+
+        :Keywords:
+          *param*
+              use *param* as the ``gromacs['param']`` entry of the copy; it
+              is shared in the same way and must not be modified directly
+              afterwards
+
+        .. versionadded:: 0.8.0
+        """
+        clone = copy.copy(self)
+        clone._charmm = _copy_parameters(self._charmm)
+        clone._extra = _copy_parameters(self._extra)
+        clone._param, clone._share, clone._cow = None, None, False
+        clone._gromacs = None
+        if param is not None:
+            clone._borrow(_SharedValue(param))
+        elif self._cow:
+            clone._borrow(self._share)
+        elif self._param is not None:
+            if self._share is None or self._share.value is not self._param:
+                self._share = _SharedValue(self._param)
+            clone._borrow(self._share)
+        return clone
+
+    def _borrow(self, share):
+        self._param = None
+        self._share = share
+        self._cow = True
+
+    def _detach(self):
+        # called before the parameters are modified in place: copies that
+        # borrowed them get a copy of the unmodified parameters
+        share = self._share
+        if share is not None and not self._cow:
+            if share.value is self._param:
+                share.value = _copy_parameters(share.value)
+            self._share = None
+
+    def _unshare(self):
+        # private copy of borrowed parameters, before they are modified
+        self._param = _own(self._share.value, self)
+        self._share = None
+        self._cow = False
+        self._refresh_gromacs()
+
+    def _set_param(self, param):
+        if param is not None and param is self._param:
+            return
+        self._detach()
+        self._param = None if param is None else _own(param, self)
+        self._share = None
+        self._cow = False
+        self._refresh_gromacs()
+
+    @property
+    def charmm(self):
+        """CHARMM parameters ``{'param': ...}``"""
+        charmm = self._charmm
+        if charmm is None:
+            if self._charmm_template is None:
+                return None
+            charmm = self._charmm_template
+        if not _owned(charmm, self):
+            charmm = self._charmm = _own(charmm, self)
+        return charmm
+
+    @charmm.setter
+    def charmm(self, value):
+        self._charmm = None if value is None else _own(value, self)
+
+    def _charmm_value(self):
+        # the charmm parameters without allocating the default ones
+        return self._charmm_template if self._charmm is None else self._charmm
+
+    def _has_gromacs(self):
+        return not (self._gromacs_template is None and self._param is None and
+                    not self._cow and self._func is _NOFUNC and not self._extra)
+
+    @property
+    def gromacs(self):
+        """GROMACS parameters ``{'param': ..., 'func': ...}`` as :class:`GromacsParameters`"""
+        if not self._has_gromacs():
+            return None
+        gromacs = self._gromacs_dict()
+        if gromacs is None:
+            gromacs = self._gromacs = GromacsParameters(self)
+        return gromacs
+
+    @gromacs.setter
+    def gromacs(self, value):
+        value = dict(value) if value is not None else {}
+        self._set_param(value.pop('param', None))
+        self._func = value.pop('func', _NOFUNC)
+        self._extra = value or None
+        self._refresh_gromacs()
+
+    def _gromacs_dict(self):
+        # the GromacsParameters of this instance; copies and pickles have a dict
+        # or the GromacsParameters of the original in _gromacs
+        gromacs = self._gromacs
+        if isinstance(gromacs, GromacsParameters) and gromacs._owner is self:
+            return gromacs
+        return None
+
+    def _refresh_gromacs(self):
+        gromacs = self._gromacs_dict()
+        if gromacs is not None:
+            gromacs._refresh()
+
+    def _gromacs_value(self):
+        # the gromacs parameters as a plain dict without allocating the default ones
+        if not self._has_gromacs():
+            return None
+        value = {}
+        param = self._param_value()
+        if param is not None:
+            value['param'] = param
+        if self._func is not _NOFUNC:
+            value['func'] = self._func
+        if self._extra:
+            value.update(self._extra)
+        return value
+
+    def _param_value(self):
+        # the 'param' entry for reading
+        if self._cow:
+            return self._share.value
+        if self._param is None and self._gromacs_template is not None:
+            return self._gromacs_template['param']
+        return self._param
+
+    def _gromacs_param(self):
+        # the 'param' entry of gromacs that may be modified in place
+        if self._cow:
+            return _shared_view(self)
+        param = self._param
+        if param is None:
+            if self._gromacs_template is None:
+                return None
+            param = self._gromacs_template['param']
+        if not _owned(param, self):
+            param = self._param = _own(param, self)
+        return param
 
     def convert(self, reqformat):
         assert reqformat in ('charmm', 'gromacs')
@@ -383,6 +645,11 @@ class Param(object):
 
 
 class AtomType(Param):
+    __slots__ = ('atype', 'atnum', 'mass', 'charge', 'bond_type')
+
+    _charmm_template = {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None} }
+    _gromacs_template= {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None} }
+
     def __init__(self, format):
 
         super(AtomType,self).__init__(format)
@@ -393,9 +660,6 @@ class AtomType(Param):
         self.charge = None
         self.bond_type = None
 
-        self.charmm = {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None} }
-        self.gromacs= {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None} }
-
     def __eq__(self, other):
         return \
             self.atype == other.atype and \
@@ -403,7 +667,7 @@ class AtomType(Param):
             self.mass == other.mass and \
             self.charge == other.charge and \
             self.bond_type == other.bond_type and \
-            self.charmm == other.charmm
+            self._charmm_value() == other._charmm_value()
 
     def __repr__(self):
         return '<{0!s} {1!s} m={2:g} q={3:g} (gromacs:{4!s})>'.format(
@@ -411,6 +675,11 @@ class AtomType(Param):
 
 
 class BondType(Param):
+    __slots__ = ('atom1', 'atom2', 'atype1', 'atype2')
+
+    _charmm_template = {'param': {'kb':None, 'b0':None} }
+    _gromacs_template= {'param': {'kb':None, 'b0':None}, 'func':None}
+
     def __init__(self, format):
 
         super(BondType,self).__init__(format)
@@ -421,18 +690,20 @@ class BondType(Param):
         self.atype1 = None
         self.atype2 = None
 
-        self.charmm = {'param': {'kb':None, 'b0':None} }
-        self.gromacs= {'param': {'kb':None, 'b0':None}, 'func':None}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 
 class AngleType(Param):
+    __slots__ = ('atom1', 'atom2', 'atom3', 'atype1', 'atype2', 'atype3')
+
+    _charmm_template = {'param':{'ktetha':None, 'tetha0':None, 'kub':None, 's0':None} }
+    _gromacs_template= {'param':{'ktetha':None, 'tetha0':None, 'kub':None, 's0':None}, 'func':None}
+
     def __init__(self, format):
 
         super(AngleType,self).__init__(format)
@@ -445,18 +716,20 @@ class AngleType(Param):
         self.atype2 = None
         self.atype3 = None
 
-        self.charmm = {'param':{'ktetha':None, 'tetha0':None, 'kub':None, 's0':None} }
-        self.gromacs= {'param':{'ktetha':None, 'tetha0':None, 'kub':None, 's0':None}, 'func':None}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
             self.atype3 == other.atype3 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 class DihedralType(Param):
+    __slots__ = ('atom1', 'atom2', 'atom3', 'atom4', 'atype1', 'atype2', 'atype3', 'atype4')
+
+    _charmm_template = {'param':[]}  # {kchi, n, delta}
+    _gromacs_template= {'param':[]}
+
     def __init__(self, format):
 
         super(DihedralType,self).__init__(format)
@@ -471,41 +744,51 @@ class DihedralType(Param):
         self.atype3 = None
         self.atype4 = None
 
-        self.charmm = {'param':[]}  # {kchi, n, delta}
-        self.gromacs= {'param':[]}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
             self.atype3 == other.atype3 and \
             self.atype4 == other.atype4 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 class ImproperType(Param):
+    __slots__ = ('atom1', 'atom2', 'atom3', 'atom4', 'atype1', 'atype2', 'atype3', 'atype4')
+
+    _charmm_template = {'param':[]}
+    _gromacs_template= {'param':[], 'func': None}  # {'kpsi': None, 'psi0':None}
+
     def __init__(self, format):
 
         super(ImproperType,self).__init__(format)
 
+        self.atom1 = None
+        self.atom2 = None
+        self.atom3 = None
+        self.atom4 = None
+
         self.atype1 = None
         self.atype2 = None
         self.atype3 = None
         self.atype4 = None
 
-        self.charmm = {'param':[]}
-        self.gromacs= {'param':[], 'func': None}  # {'kpsi': None, 'psi0':None}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
             self.atype3 == other.atype3 and \
             self.atype4 == other.atype4 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 class CMapType(Param):
+    __slots__ = ('atom1', 'atom2', 'atom3', 'atom4', 'atom5', 'atom6', 'atom7', 'atom8',
+                 'atype1', 'atype2', 'atype3', 'atype4', 'atype5', 'atype6', 'atype7', 'atype8')
+
+    _charmm_template = {'param': []}
+    _gromacs_template= {'param': []}
+
     def __init__(self, format):
 
         super(CMapType,self).__init__(format)
@@ -528,9 +811,6 @@ class CMapType(Param):
         self.atype7 = None
         self.atype8 = None
 
-        self.charmm = {'param': []}
-        self.gromacs= {'param': []}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
@@ -541,10 +821,15 @@ class CMapType(Param):
             self.atype6 == other.atype6 and \
             self.atype7 == other.atype7 and \
             self.atype8 == other.atype8 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 class InteractionType(Param):
+    __slots__ = ('atom1', 'atom2', 'atype1', 'atype2')
+
+    _charmm_template = {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None} }
+    _gromacs_template= {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None}, 'func':None }
+
     def __init__(self, format):
 
         super(InteractionType,self).__init__(format)
@@ -555,15 +840,12 @@ class InteractionType(Param):
         self.atype1 = None
         self.atype2 = None
 
-        self.charmm = {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None} }
-        self.gromacs= {'param': {'lje':None, 'ljl':None, 'lje14':None, 'ljl14':None}, 'func':None }
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
     def __repr__(self):
         return '<{0!s} {1!s} {2!s} (gromacs:{3!s})>'.format(
@@ -571,6 +853,8 @@ class InteractionType(Param):
 
 
 class SettleType(Param):
+    __slots__ = ('atom', 'dOH', 'dHH')
+
     def __init__(self, format):
         assert format in ('gromacs',)
         super(SettleType,self).__init__(format)
@@ -581,6 +865,10 @@ class SettleType(Param):
 
 
 class ConstraintType(Param):
+    __slots__ = ('atom1', 'atom2', 'atype1', 'atype2')
+
+    _gromacs_template= {'param': {'b0':None}, 'func':None}
+
     def __init__(self, format):
         assert format in ('gromacs',)
         super(ConstraintType,self).__init__(format)
@@ -591,17 +879,19 @@ class ConstraintType(Param):
         self.atype1 = None
         self.atype2 = None
 
-        self.gromacs= {'param': {'b0':None}, 'func':None}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 
 class NonbondedParamType(Param):
+    __slots__ = ('atype1', 'atype2')
+
+    _gromacs_template= {'param': {'eps':None, 'sig':None}, 'func':None}
+
     def __init__(self, format):
         assert format in ('gromacs',)
         super(NonbondedParamType,self).__init__(format)
@@ -609,17 +899,19 @@ class NonbondedParamType(Param):
         self.atype1 = None
         self.atype2 = None
 
-        self.gromacs= {'param': {'eps':None, 'sig':None}, 'func':None}
-
     def __eq__(self, other):
         return \
             self.atype1 == other.atype1 and \
             self.atype2 == other.atype2 and \
-            self.gromacs == other.gromacs and \
-            self.charmm == other.charmm
+            self._gromacs_value() == other._gromacs_value() and \
+            self._charmm_value() == other._charmm_value()
 
 
 class VirtualSites3Type(Param):
+    __slots__ = ('atom1', 'atom2', 'atom3', 'atom4')
+
+    _gromacs_template= {'param': {'a':None, 'b': None}, 'func':None}
+
     def __init__(self, format):
         assert format in ('gromacs',)
         super(VirtualSites3Type,self).__init__(format)
@@ -629,7 +921,541 @@ class VirtualSites3Type(Param):
         self.atom3 = None
         self.atom4 = None
 
-        self.gromacs= {'param': {'a':None, 'b': None}, 'func':None}
+
+class GromacsParameters(dict):
+    """Dict of the GROMACS parameters of a :class:`Param`.
+
+    The dict ``{'param': ..., 'func': ...}`` is what older versions stored
+    in :attr:`Param.gromacs`; it is now created from the flat fields of the
+    :class:`Param` when :attr:`Param.gromacs` is first accessed, and setting
+    or deleting an entry changes the parameters of the :class:`Param`.
+    """
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner):
+        dict.__init__(self)
+        self._owner = owner
+        self._refresh()
+
+    def _keys(self):
+        owner = self._owner
+        keys = []
+        if owner._param_value() is not None:
+            keys.append('param')
+        if owner._func is not _NOFUNC:
+            keys.append('func')
+        if owner._extra:
+            keys.extend(owner._extra)
+        return keys
+
+    def _asdict(self):
+        # plain dict of the entries; default parameters are not stored in the owner
+        return self._owner._gromacs_value() or {}
+
+    def _refresh(self):
+        # the dict itself holds the current entries for code that reads it directly
+        items = [(key, self[key]) for key in self._keys()]
+        dict.clear(self)
+        dict.update(self, items)
+
+    def __getitem__(self, key):
+        owner = self._owner
+        if key == 'param':
+            param = dict.get(self, key)
+            if not (owner._cow and isinstance(param, SharedParameters)):
+                param = owner._gromacs_param()
+            if param is not None:
+                dict.__setitem__(self, key, param)
+                return param
+        elif key == 'func':
+            if owner._func is not _NOFUNC:
+                return owner._func
+        elif owner._extra and key in owner._extra:
+            return owner._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._keys()
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def keys(self):
+        return self._keys()
+
+    def values(self):
+        return [self[key] for key in self._keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self._keys()]
+
+    def __setitem__(self, key, value):
+        owner = self._owner
+        if key == 'param':
+            owner._set_param(value)
+        elif key == 'func':
+            owner._func = value
+        else:
+            if owner._extra is None:
+                owner._extra = {}
+            owner._extra[key] = value
+        self._refresh()
+
+    def __delitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        owner = self._owner
+        if key == 'param':
+            owner._set_param(None)
+        elif key == 'func':
+            owner._func = _NOFUNC
+        else:
+            del owner._extra[key]
+        self._refresh()
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    _marker = object()
+
+    def pop(self, key, default=_marker):
+        try:
+            value = self[key]
+        except KeyError:
+            if default is self._marker:
+                raise
+            return default
+        del self[key]
+        return value
+
+    def popitem(self):
+        keys = self._keys()
+        if not keys:
+            raise KeyError('popitem(): dictionary is empty')
+        return keys[-1], self.pop(keys[-1])
+
+    def clear(self):
+        for key in self._keys():
+            del self[key]
+
+    def __eq__(self, other):
+        if isinstance(other, GromacsParameters):
+            other = other._asdict()
+        elif not isinstance(other, Mapping):
+            return NotImplemented
+        return self._asdict() == dict(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._asdict())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._asdict(), memo)
+
+    def __reduce__(self):
+        return (dict, (self._asdict(),))
+
+
+def _copy_parameters(value):
+    # plain copy of nested parameter dicts and lists (much faster than deepcopy)
+    if isinstance(value, dict):
+        return dict((k, _copy_parameters(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [_copy_parameters(v) for v in value]
+    return value
+
+
+def _own(value, owner):
+    # copy of nested parameter dicts and lists that belongs to the Param *owner*
+    if isinstance(value, dict):
+        return ParamDict(owner, [(k, _own(v, owner)) for k, v in value.items()])
+    elif isinstance(value, list):
+        return ParamList(owner, [_own(v, owner) for v in value])
+    return value
+
+
+def _owned(value, owner):
+    return isinstance(value, (ParamDict, ParamList)) and value._owner is owner
+
+
+class _SharedValue(object):
+    # the 'param' entry that copies of a Param share (see Param.copy())
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __reduce__(self):
+        return (_SharedValue, (self.value,))
+
+
+class ParamDict(dict):
+    """Dict of parameters of a :class:`Param`.
+
+    Before the dict is modified, copies of the :class:`Param` that still
+    share its parameters (see :meth:`Param.copy`) get their own copy of
+    them. Dicts and lists that are added become :class:`ParamDict` and
+    :class:`ParamList` instances. Copies and pickles are plain dicts.
+    """
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner, items=()):
+        dict.__init__(self, items)
+        self._owner = owner
+
+    def __setitem__(self, key, value):
+        self._owner._detach()
+        dict.__setitem__(self, key, _own(value, self._owner))
+
+    def __delitem__(self, key):
+        self._owner._detach()
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def pop(self, *args):
+        self._owner._detach()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._owner._detach()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._owner._detach()
+        dict.clear(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class ParamList(list):
+    """List of parameters of a :class:`Param`.
+
+    Like :class:`ParamDict`, the list makes sure that copies of the
+    :class:`Param` that share it are not modified.
+    """
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner, items=()):
+        list.__init__(self, items)
+        self._owner = owner
+
+    def __setitem__(self, index, value):
+        self._owner._detach()
+        if isinstance(index, slice):
+            value = [_own(v, self._owner) for v in value]
+        else:
+            value = _own(value, self._owner)
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        self._owner._detach()
+        list.__delitem__(self, index)
+
+    def __setslice__(self, i, j, values):
+        # Python 2
+        self[max(0, i):max(0, j)] = values
+
+    def __delslice__(self, i, j):
+        # Python 2
+        del self[max(0, i):max(0, j)]
+
+    def append(self, value):
+        self._owner._detach()
+        list.append(self, _own(value, self._owner))
+
+    def extend(self, values):
+        self._owner._detach()
+        list.extend(self, [_own(v, self._owner) for v in values])
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        self._owner._detach()
+        return list.__imul__(self, n)
+
+    def insert(self, index, value):
+        self._owner._detach()
+        list.insert(self, index, _own(value, self._owner))
+
+    def pop(self, *args):
+        self._owner._detach()
+        return list.pop(self, *args)
+
+    def remove(self, value):
+        self._owner._detach()
+        list.remove(self, value)
+
+    def reverse(self):
+        self._owner._detach()
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self._owner._detach()
+        list.sort(self, *args, **kwargs)
+
+    def clear(self):
+        del self[:]
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self), memo)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def _shared_target(owner, path):
+    value = owner._share.value if owner._cow else owner._param
+    for key in path:
+        value = value[key]
+    return value
+
+
+def _shared_view(owner, path=()):
+    # SharedParameters view of a dict or list of borrowed parameters
+    target = _shared_target(owner, path)
+    if isinstance(target, dict):
+        return SharedDict(owner, path)
+    elif isinstance(target, list):
+        return SharedList(owner, path)
+    return target
+
+
+class SharedParameters(object):
+    """Copy-on-write view of parameters that a :class:`Param` shares with copies.
+
+    A copy made with :meth:`Param.copy` gets the view instead of the
+    ``gromacs['param']`` entry. The view is a dict (:class:`SharedDict`)
+    or a list (:class:`SharedList`) of the parameters that it represents.
+    Reading does not copy anything; before the first modification, the
+    :class:`Param` makes a private copy of its parameters, which is then
+    modified.
+    """
+    __slots__ = ()
+
+    def __init__(self, owner, path=()):
+        self._owner = owner
+        self._path = path
+
+    def _target(self):
+        return _shared_target(self._owner, self._path)
+
+    def _writable(self):
+        if self._owner._cow:
+            self._owner._unshare()
+        return self._target()
+
+    def _wrap(self, key, value):
+        if isinstance(value, (dict, list)):
+            return _shared_view(self._owner, self._path + (key,))
+        return value
+
+    def _refresh(self):
+        pass
+
+    def _modify(self, method, *args):
+        result = getattr(self._writable(), method)(*args)
+        self._refresh()
+        return result
+
+    # reading
+
+    def __getitem__(self, key):
+        value = self._target()[key]
+        if isinstance(key, slice):
+            return _copy_parameters(value)
+        return self._wrap(key, value)
+
+    def get(self, key, default=None):
+        target = self._target()
+        return self._wrap(key, target[key]) if key in target else default
+
+    def __iter__(self):
+        target = self._target()
+        if isinstance(target, dict):
+            return iter(list(target))
+        return iter([self._wrap(i, v) for i, v in enumerate(target)])
+
+    def keys(self):
+        return list(self._target().keys())
+
+    def values(self):
+        return [self._wrap(k, v) for k, v in self._target().items()]
+
+    def items(self):
+        return [(k, self._wrap(k, v)) for k, v in self._target().items()]
+
+    def __len__(self):
+        return len(self._target())
+
+    def __contains__(self, item):
+        return item in self._target()
+
+    def __eq__(self, other):
+        if isinstance(other, SharedParameters):
+            other = other._target()
+        return self._target() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._target())
+
+    def copy(self):
+        return copy.copy(self._target())
+
+    def __copy__(self):
+        return copy.copy(self._target())
+
+    def __deepcopy__(self, memo):
+        return _copy_parameters(self._target())
+
+    def __reduce__(self):
+        return (_copy_parameters, (self._target(),))
+
+    # writing
+
+    def __setitem__(self, key, value):
+        return self._modify('__setitem__', key, value)
+
+    def __delitem__(self, key):
+        return self._modify('__delitem__', key)
+
+    def __iadd__(self, other):
+        self._modify('__iadd__', other)
+        return self
+
+    def pop(self, *args):
+        return self._modify('pop', *args)
+
+    def clear(self):
+        if isinstance(self._target(), dict):
+            return self._modify('clear')
+        del self[:]
+
+
+class SharedDict(SharedParameters, dict):
+    """:class:`SharedParameters` view of a dict.
+
+    The dict contains the (shared) parameters as of the time when it was
+    accessed, so that it can be used wherever a dict is expected.
+    """
+    __slots__ = ('_owner', '_path')
+
+    def __init__(self, owner, path=()):
+        SharedParameters.__init__(self, owner, path)
+        dict.__init__(self, self._snapshot())
+
+    def _snapshot(self):
+        return [(k, self._wrap(k, v)) for k, v in self._target().items()]
+
+    def _refresh(self):
+        dict.clear(self)
+        dict.update(self, self._snapshot())
+
+    def update(self, *args, **kwargs):
+        return self._modify('update', dict(*args, **kwargs))
+
+    def setdefault(self, *args):
+        self._modify('setdefault', *args)
+        return self[args[0]]
+
+    def popitem(self):
+        return self._modify('popitem')
+
+
+class SharedList(SharedParameters, list):
+    """:class:`SharedParameters` view of a list.
+
+    The list contains the (shared) parameters as of the time when it was
+    accessed, so that it can be used wherever a list is expected.
+    """
+    __slots__ = ('_owner', '_path')
+
+    def __init__(self, owner, path=()):
+        SharedParameters.__init__(self, owner, path)
+        list.__init__(self, self._snapshot())
+
+    def _snapshot(self):
+        return [self._wrap(i, v) for i, v in enumerate(self._target())]
+
+    def _refresh(self):
+        list.__setitem__(self, slice(None), self._snapshot())
+
+    def append(self, value):
+        return self._modify('append', value)
+
+    def extend(self, values):
+        return self._modify('extend', values)
+
+    def insert(self, index, value):
+        return self._modify('insert', index, value)
+
+    def remove(self, value):
+        return self._modify('remove', value)
+
+    def reverse(self):
+        return self._modify('reverse')
+
+    def sort(self, *args, **kwargs):
+        self._writable().sort(*args, **kwargs)
+        self._refresh()
+
+    def __imul__(self, n):
+        self._modify('__imul__', n)
+        return self
 
 
 class Exclusion(object):
@@ -643,3 +1469,464 @@ class Exclusion(object):
     def __init__(self):
         self.main_atom  = None
         self.other_atoms = []
+
+
+class TypeIndex(object):
+    """Index of bonded parameter types by the atom types they apply to.
+
+    A lookup resolves a tuple of atom types (and a function type) to the
+    list of parameter types that GROMACS would use for it:
+
+    * the atom types are matched in forward and in reverse order;
+    * if *wildcard* is set, any atom type can be matched by the wildcard
+      type (``X``), which is how GROMACS assigns generic dihedral types.
+
+    All candidate keys are tried in the order used by
+    :func:`gromacs.scaling.scale_dihedrals` and the first key that is
+    present wins. The wildcard patterns are counted up in binary, where bit
+    *k* of the counter replaces the *k*-th atom type by the wildcard, and
+    each pattern is tried with the forward and then with the reversed atom
+    types: ``A-B-C-D``, ``D-C-B-A``, ``X-B-C-D``, ``X-C-B-A``, ``A-X-C-D``,
+    ``D-X-B-A``, ``X-X-C-D``, ``X-X-B-A``, ``A-B-X-D``, ... Note that this
+    is not ordered by the number of wildcards (``X-X-C-D`` comes before
+    ``A-B-X-D``). Each distinct tuple is only resolved once; later lookups
+    are a single dictionary access.
+
+    :class:`~gromacs.fileformats.top.TOP` builds indices with
+    :meth:`~gromacs.fileformats.top.TOP.type_index`.
+
+    .. versionadded:: 0.8.0
+    """
+    def __init__(self, types, atype_attrs, reversible=True, wildcard=None):
+        """Index *types*
+
+        :Arguments:
+          *types*
+              list of :class:`Param` instances such as :class:`DihedralType`
+          *atype_attrs*
+              names of the attributes that contain the atom types, e.g.,
+              ``('atype1', 'atype2')``
+          *reversible*
+              match atom types in reverse order, too [``True``]
+          *wildcard*
+              atom type that matches any atom type, e.g., ``'X'``, or
+              ``None`` for no wildcard matching [``None``]
+        """
+        self.atype_attrs = tuple(atype_attrs)
+        self.reversible = reversible
+        self.wildcard = wildcard
+
+        self._types = {}    # (atype1, ..., func): [types]
+        for t in types:
+            key = tuple(getattr(t, attr) for attr in self.atype_attrs) + (self._func(t),)
+            self._types.setdefault(key, []).append(t)
+        self._resolved = {}
+
+    @staticmethod
+    def _func(t):
+        gromacs = t.gromacs
+        return gromacs.get('func') if gromacs is not None else None
+
+    def _candidates(self, atypes):
+        """Keys in order of precedence (without the function type)"""
+        natoms = len(atypes)
+        nswitch = 2 if self.reversible else 1
+        if self.wildcard is not None:
+            nswitch *= 2**natoms
+        step = 2 if self.reversible else 1
+        for iswitch in range(nswitch):
+            candidate = list(reversed(atypes)) if self.reversible and iswitch % 2 else list(atypes)
+            for k in range(natoms):
+                if (iswitch // step // 2**k) % 2 == 1:
+                    candidate[k] = self.wildcard
+            yield tuple(candidate)
+
+    def resolve(self, atypes, func=None):
+        """Return the key ``(atype1, ..., func)`` that matches *atypes* or ``None``"""
+        atypes = tuple(atypes)
+        query = atypes + (func,)
+        try:
+            return self._resolved[query]
+        except KeyError:
+            pass
+        key = None
+        for candidate in self._candidates(atypes):
+            if candidate + (func,) in self._types:
+                key = candidate + (func,)
+                break
+        self._resolved[query] = key
+        return key
+
+    def lookup(self, atypes, func=None):
+        """Return the list of types for the atom types *atypes* and function *func*
+
+        An empty list is returned if no type matches.
+        """
+        key = self.resolve(atypes, func)
+        return self._types[key] if key is not None else []
+
+    def __getitem__(self, key):
+        """``index[atypes]`` or ``index[atypes, func]``; raises :exc:`KeyError` if nothing matches"""
+        atypes, func = key if (len(key) == 2 and isinstance(key[0], tuple)) else (key, None)
+        types = self.lookup(atypes, func)
+        if not types:
+            raise KeyError(key)
+        return types
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        """Number of distinct type keys"""
+        return len(self._types)
+
+
+# Compact storage
+# ---------------
+#
+# Large topologies contain millions of atoms and bonded terms. Instead of one
+# Python object per line, the parser stores them in structured numpy arrays;
+# Atom and Param instances are only created when they are accessed.
+
+class AtomView(Atom):
+    """An :class:`Atom` whose attributes live in a row of an :class:`AtomArray`.
+
+    Reading or setting an attribute reads or modifies the underlying
+    array. An atom without a mass does not have the :attr:`mass`
+    attribute, just like an :class:`Atom` that was read from an
+    ``[ atoms ]`` line without a mass column.
+    """
+
+    __slots__ = ('_atomarray', '_index')
+
+    def __init__(self, atomarray, index):
+        # no call to Atom.__init__(): all attributes are provided by the array
+        self._atomarray = atomarray
+        self._index = index
+
+    def _getter(field):
+        def fget(self):
+            value = self._atomarray.array[field][self._index]
+            return value.item() if isinstance(value, np.generic) else value
+        def fset(self, value):
+            self._atomarray.array[field][self._index] = value
+        return property(fget, fset)
+
+    name = _getter('name')
+    atomtype = _getter('atomtype')
+    number = _getter('number')
+    resname = _getter('resname')
+    resnumb = _getter('resnumb')
+    cgnr = _getter('cgnr')
+    charge = _getter('charge')
+    del _getter
+
+    @property
+    def mass(self):
+        mass = self._atomarray.array['mass'][self._index].item()
+        if mass != mass:     # NaN: no mass was given
+            raise AttributeError("atom {0} has no mass".format(self.number))
+        return mass
+
+    @mass.setter
+    def mass(self, value):
+        self._atomarray.array['mass'][self._index] = value
+
+    @property
+    def coords(self):
+        return []
+
+    @property
+    def altlocs(self):
+        return []
+
+    def _to_atom(self):
+        atom = Atom()
+        for attr in ('name', 'atomtype', 'number', 'resname', 'resnumb', 'cgnr', 'charge'):
+            setattr(atom, attr, getattr(self, attr))
+        if hasattr(self, 'mass'):
+            atom.mass = self.mass
+        return atom
+
+    def __copy__(self):
+        # a copy is a standalone Atom and does not copy the whole AtomArray
+        return self._to_atom()
+
+    def __deepcopy__(self, memo):
+        return self._to_atom()
+
+    def __reduce__(self):
+        # pickled as a reference to the row of the (pickled) AtomArray
+        return (AtomView, (self._atomarray, self._index))
+
+    def __eq__(self, other):
+        return isinstance(other, AtomView) and \
+            self._atomarray is other._atomarray and self._index == other._index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._atomarray), self._index))
+
+    def __repr__(self):
+        return '<{0!s} {1!s} {2!s} {3!s}{4!s}>'.format(
+            self.__class__.__name__, self.number, self.name, self.resname, self.resnumb)
+
+
+class AtomArray(object):
+    """Sequence of the atoms of a :class:`Molecule` in a structured array.
+
+    Items are :class:`AtomView` instances that are created on first access. The
+    data are available as the structured numpy array :attr:`array` with the
+    fields *number*, *atomtype*, *resnumb*, *resname*, *name*, *cgnr*,
+    *charge*, and *mass* (``NaN`` if no mass was given).
+
+    Unlike a list, the atoms can only be added at the end (with
+    :meth:`append` or :meth:`extend`); to insert, remove or reorder atoms,
+    replace the array of the molecule by a list, ``mol.atoms = list(mol.atoms)``.
+    """
+    dtype = np.dtype([('number', np.int32), ('atomtype', object),
+                      ('resnumb', np.int32), ('resname', object),
+                      ('name', object), ('cgnr', np.int32),
+                      ('charge', np.float64), ('mass', np.float64)])
+
+    def __init__(self, records=()):
+        """Create the array from a sequence of tuples in the order of :attr:`dtype`."""
+        self.array = np.array(list(records), dtype=self.dtype)
+        self._views = [None] * len(self.array)
+        self._buffer = None     # array with spare rows for append()
+
+    def __len__(self):
+        return len(self.array)
+
+    def _view(self, index):
+        view = self._views[index]
+        if view is None:
+            view = self._views[index] = AtomView(self, index)
+        return view
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._view(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("atom index {0} out of range".format(index))
+        return self._view(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._view(i)
+
+    def __getstate__(self):
+        # pickle the string columns as codes into their distinct values,
+        # which is smaller and faster to load than object arrays
+        columns = []
+        for field in self.dtype.names:
+            column = self.array[field]
+            if column.dtype == object:
+                values = {}
+                codes = np.fromiter((values.setdefault(v, len(values)) for v in column.tolist()),
+                                    dtype=np.int32, count=len(column))
+                column = (sorted(values, key=values.get), codes)
+            columns.append((field, column))
+        return {'columns': columns, '_views': self._views}
+
+    def __setstate__(self, state):
+        columns = state['columns']
+        self.array = np.zeros(len(state['_views']), dtype=self.dtype)
+        for field, column in columns:
+            if isinstance(column, tuple):
+                values, codes = column
+                values = np.array([intern(v) if isinstance(v, str) else v for v in values] +
+                                  [None], dtype=object)[:-1]
+                column = values[codes]
+            self.array[field] = column
+        self._views = state['_views']
+        self._buffer = None
+
+    def append(self, atom):
+        """Append an :class:`Atom` (copies its attributes into the array)."""
+        record = (atom.number, atom.atomtype, atom.resnumb, atom.resname, atom.name,
+                  getattr(atom, 'cgnr', atom.number), atom.charge,
+                  getattr(atom, 'mass', np.nan))
+        n = len(self.array)
+        if self._buffer is None or self.array.base is not self._buffer or n == len(self._buffer):
+            # grow geometrically so that appending atom by atom is not quadratic
+            buffer = np.zeros(max(16, 2 * n), dtype=self.dtype)
+            buffer[:n] = self.array
+            self._buffer = buffer
+        self._buffer[n] = record
+        self.array = self._buffer[:n + 1]
+        self._views.append(None)
+
+    def extend(self, atoms):
+        """Append all :class:`Atom` instances of *atoms*."""
+        for atom in atoms:
+            self.append(atom)
+
+
+class ParamArray(object):
+    """Compact storage of the bonded terms of one section of a :class:`Molecule`.
+
+    Each term is a row in the structured array :attr:`array`; atoms are
+    stored as 0-based indices into the atoms of the molecule and missing
+    parameters as ``NaN``. :meth:`materialize` creates the equivalent list
+    of :class:`Param` instances.
+
+    :class:`ParamArray` itself is not used directly; derived classes such as
+    :class:`BondArray` define :attr:`dtype` and override :meth:`_make`.
+    """
+    dtype = None
+    #: names of the fields that contain atom indices
+    atom_fields = ()
+
+    def __init__(self, records=(), comments=None):
+        """Create the array from a sequence of tuples in the order of :attr:`dtype`.
+
+        *comments* is an optional sequence with the :attr:`Param.comment`
+        of each term (an empty string for terms without a comment).
+        """
+        self.array = np.array(list(records), dtype=self.dtype)
+        self.comments = None if comments is None else np.array(list(comments), dtype=object)
+
+    def __len__(self):
+        return len(self.array)
+
+    def materialize(self, atoms):
+        """Return the terms as a list of :class:`Param` instances that refer to *atoms*."""
+        terms = [self._make(atoms, row) for row in self.array.tolist()]
+        if self.comments is not None:
+            for term, comment in zip(terms, self.comments.tolist()):
+                if comment:
+                    term.comment = comment
+        return terms
+
+    def _make(self, atoms, row):
+        """Return the :class:`Param` instance for *row*; derived classes must override it.
+
+        *row* is a tuple with the fields of :attr:`dtype` and *atoms* the
+        atoms of the molecule that the atom indices of the row refer to.
+        """
+        raise NotImplementedError("{0} does not define _make()".format(self.__class__.__name__))
+
+
+class PairArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('func', np.int8)])
+    atom_fields = ('ai', 'aj')
+
+    def _make(self, atoms, row):
+        ai, aj, fu = row
+        pair = InteractionType('gromacs')
+        pair.atom1 = atoms[ai]
+        pair.atom2 = atoms[aj]
+        pair._func = fu
+        return pair
+
+
+class BondArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('func', np.int8),
+                      ('b0', np.float64), ('kb', np.float64)])
+    atom_fields = ('ai', 'aj')
+
+    def _make(self, atoms, row):
+        ai, aj, fu, b0, kb = row
+        bond = BondType('gromacs')
+        bond.atom1 = atoms[ai]
+        bond.atom2 = atoms[aj]
+        bond._func = fu
+        if kb == kb:
+            bond._param = {'kb': kb, 'b0': b0}
+        return bond
+
+
+class AngleArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('ak', np.int32),
+                      ('func', np.int8), ('tetha0', np.float64), ('ktetha', np.float64)])
+    atom_fields = ('ai', 'aj', 'ak')
+
+    def _make(self, atoms, row):
+        ai, aj, ak, fu, tetha0, ktetha = row
+        ang = AngleType('gromacs')
+        ang.atom1 = atoms[ai]
+        ang.atom2 = atoms[aj]
+        ang.atom3 = atoms[ak]
+        ang._func = fu
+        if ktetha == ktetha:
+            ang._param = {'ktetha': ktetha, 'tetha0': tetha0, 'kub': None, 's0': None}
+        return ang
+
+
+class DihedralArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('ak', np.int32), ('al', np.int32),
+                      ('func', np.int8), ('delta', np.float64), ('kchi', np.float64),
+                      ('n', np.int32), ('line', np.int32)])
+    atom_fields = ('ai', 'aj', 'ak', 'al')
+
+    def _make(self, atoms, row):
+        ai, aj, ak, al, fu, delta, kchi, n, line = row
+        dih = DihedralType('gromacs')
+        dih.atom1 = atoms[ai]
+        dih.atom2 = atoms[aj]
+        dih.atom3 = atoms[ak]
+        dih.atom4 = atoms[al]
+        dih._func = fu
+        dih.line = line
+        if kchi == kchi:
+            dih._param = [{'kchi': kchi, 'n': n, 'delta': delta}]
+        return dih
+
+
+class ImproperArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('ak', np.int32), ('al', np.int32),
+                      ('func', np.int8), ('psi0', np.float64), ('kpsi', np.float64),
+                      ('n', np.int32), ('line', np.int32)])
+    atom_fields = ('ai', 'aj', 'ak', 'al')
+
+    def _make(self, atoms, row):
+        ai, aj, ak, al, fu, psi0, kpsi, n, line = row
+        imp = ImproperType('gromacs')
+        imp.atom1 = atoms[ai]
+        imp.atom2 = atoms[aj]
+        imp.atom3 = atoms[ak]
+        imp.atom4 = atoms[al]
+        imp._func = fu
+        imp.line = line
+        if kpsi == kpsi:
+            imp._param = [{'kpsi': kpsi, 'psi0': psi0, 'n': n}]
+        return imp
+
+
+class CMapArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('ak', np.int32), ('al', np.int32),
+                      ('am', np.int32), ('func', np.int8)])
+    atom_fields = ('ai', 'aj', 'ak', 'al', 'am')
+
+    def _make(self, atoms, row):
+        ai, aj, ak, al, am, fu = row
+        cmap = CMapType('gromacs')
+        cmap.atom1 = atoms[ai]
+        cmap.atom2 = atoms[aj]
+        cmap.atom3 = atoms[ak]
+        cmap.atom4 = atoms[al]
+        cmap.atom8 = atoms[am]
+        cmap._func = fu
+        return cmap
+
+
+class ConstraintArray(ParamArray):
+    dtype = np.dtype([('ai', np.int32), ('aj', np.int32), ('func', np.int8)])
+    atom_fields = ('ai', 'aj')
+
+    def _make(self, atoms, row):
+        ai, aj, fu = row
+        cons = ConstraintType('gromacs')
+        cons.atom1 = atoms[ai]
+        cons.atom2 = atoms[aj]
+        cons._func = fu
+        return cons
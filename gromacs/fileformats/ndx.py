@@ -121,14 +121,21 @@ class NDX(odict, utilities.FileUtils):
     def write(self, filename=None, ncol=ncol, format=format):
         """Write index file to *filename* (or overwrite the file that the index was read from)"""
         with open(self.filename(filename, ext='ndx'), 'w') as ndx:
-            for name in self:
-                atomnumbers = self._getarray(name)  # allows overriding
-                ndx.write('[ {0!s} ]\n'.format(name))
-                for k in xrange(0, len(atomnumbers), ncol):
-                    line = atomnumbers[k:k+ncol].astype(int)   # nice formatting in ncol-blocks
-                    n = len(line)
-                    ndx.write((" ".join(n*[format])+'\n') % tuple(line))
-                ndx.write('\n')
+            self.dump(ndx, ncol=ncol, format=format)
+
+    def dump(self, stream, ncol=ncol, format=format):
+        """Write all index groups to the open file *stream*.
+
+        .. versionadded:: 0.8.0
+        """
+        for name in self:
+            atomnumbers = self._getarray(name)  # allows overriding
+            stream.write('[ {0!s} ]\n'.format(name))
+            for k in range(0, len(atomnumbers), ncol):
+                line = atomnumbers[k:k+ncol].astype(int)   # nice formatting in ncol-blocks
+                n = len(line)
+                stream.write((" ".join(n*[format])+'\n') % tuple(line))
+            stream.write('\n')
 
     def get(self, name):
         """Return index array for index group *name*."""
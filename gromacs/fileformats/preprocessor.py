@@ -0,0 +1,239 @@
+# GromacsWrapper: preprocessor.py
+# Copyright (c) 2009-2011 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+"""
+Gromacs topology preprocessor
+=============================
+
+:program:`grompp` runs topology files through a C-preprocessor before
+it reads them. :class:`TopologyPreprocessor` implements the subset of
+the preprocessor directives that appear in Gromacs topologies and force
+fields so that a ``topol.top`` can be read directly, without first
+producing a ``processed.top`` with ``grompp -pp``:
+
+``#include "file"`` or ``#include <file>``
+    Included files are looked up relative to the including file and
+    then along :func:`search_path`, i.e. in the *include_dirs*, the
+    directories in :envvar:`GMXLIB` and the ``top`` directory of the
+    Gromacs installation.
+
+``#define NAME [value]``, ``#undef NAME``
+    Defined names in data lines are replaced by their value (which may
+    be empty), e.g. the ``gb_1`` parameter macros of the GROMOS force
+    fields.
+
+``#ifdef NAME``, ``#ifndef NAME``, ``#else``, ``#endif``
+    Lines in inactive blocks are dropped.
+
+Any other directive (such as ``#if`` or ``#error``) raises a
+:exc:`ValueError`.
+
+.. autoclass:: TopologyPreprocessor
+   :members:
+
+.. autofunction:: search_path
+
+.. autofunction:: find_include
+
+.. versionadded:: 0.8.0
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import errno
+
+from ..utilities import asiterable
+
+_token = re.compile(r'\S+')
+
+
+def search_path(include_dirs=None):
+    """Return the directories that :program:`grompp` searches for ``#include`` files.
+
+    The search path consists of *include_dirs* (typically from the mdp
+    ``include = -I...`` line) followed by all directories in
+    :envvar:`GMXLIB` and the ``top`` directory of the Gromacs
+    installation (from :envvar:`GMXDATA`).
+    """
+    dirs = [os.path.expanduser(d) for d in asiterable(include_dirs or [])]
+    dirs.extend([d for d in os.environ.get('GMXLIB', '').split(os.pathsep) if d])
+    gmxdata = os.environ.get('GMXDATA')
+    if gmxdata:
+        # Gromacs 5.x and later: GMXDATA=share/gromacs, Gromacs 4.x: GMXDATA=share
+        dirs.append(os.path.join(gmxdata, 'top'))
+        dirs.append(os.path.join(gmxdata, 'gromacs', 'top'))
+    return dirs
+
+
+def find_include(filename, curdir, searchpath):
+    """Return the real path of the include file *filename* or ``None``.
+
+    *filename* is looked up in *curdir* (the directory of the including
+    file) and then in the directories of *searchpath*.
+    """
+    for d in [curdir] + list(searchpath):
+        path = os.path.join(d, filename)
+        if os.path.isfile(path):
+            return os.path.realpath(path)
+    return None
+
+
+class TopologyPreprocessor(object):
+    """Resolve ``#include``, ``#define`` and ``#ifdef`` directives of a topology.
+
+    Example::
+
+       pp = TopologyPreprocessor(defines=['POSRES'])
+       with open('flat.top', 'w') as out:
+           for line in pp.lines('topol.top'):
+               out.write(line)
+
+    :meth:`events` additionally reports where included files start and
+    end, which allows a reader to skip files that it already knows
+    (see :meth:`skip_include`).
+    """
+
+    def __init__(self, include_dirs=None, defines=None):
+        """Set up the preprocessor.
+
+        :Keywords:
+          *include_dirs*
+              list of additional directories to search for included files
+              before the :envvar:`GMXLIB` directories
+          *defines*
+              dict of names to values, or list of names (``"NAME"`` or
+              ``"NAME=value"``, optionally with a leading ``-D`` as in the
+              mdp ``define`` line) that are defined at the start
+        """
+        self.searchpath = search_path(include_dirs)
+        self.defines = {}
+        if isinstance(defines, dict):
+            self.defines.update(defines)
+        else:
+            for define in asiterable(defines or []):
+                if define.startswith('-D'):
+                    define = define[2:]
+                name, _, value = define.partition('=')
+                self.defines[name] = value
+        self._skip = False
+
+    def skip_include(self):
+        """Do not read the included file that :meth:`events` just announced with ``'begin'``."""
+        self._skip = True
+
+    def lines(self, filename):
+        """Iterate over the lines of *filename* with all directives resolved."""
+        for event in self.events(filename):
+            if event[0] == 'line':
+                yield event[1]
+
+    def events(self, filename):
+        """Iterate over the preprocessed content of *filename*.
+
+        The generator yields the tuples
+
+        ``('line', line, path, lineno)``
+            for every line outside of inactive ``#ifdef`` blocks that is not
+            a directive; *lineno* counts the lines of the file *path*,
+            starting with 1
+
+        ``('begin', path)`` and ``('end', path)``
+            at the start and end of *filename* and every included file;
+            calling :meth:`skip_include` right after ``'begin'`` skips the
+            file and no ``'end'`` follows
+
+        :Raises: :exc:`IOError` if an included file cannot be found and
+                 :exc:`ValueError` for unsupported or unbalanced directives
+        """
+        path = os.path.realpath(filename)
+        stack = []      # [path, file, lineno, conditions] of open files
+        self._skip = False
+        yield ('begin', path)
+        if self._skip:
+            self._skip = False
+            return
+        stack.append([path, open(path), 0, []])
+        try:
+            while stack:
+                current = stack[-1]
+                path, f, conditions = current[0], current[1], current[3]
+                included = None
+                for line in f:
+                    current[2] += 1
+                    stripped = line.lstrip()
+                    if stripped[:1] == '#':
+                        included = self._directive(stripped, conditions, current)
+                        if included is not None:
+                            break
+                    elif all(conditions):
+                        if self.defines:
+                            line = self._substitute(line)
+                        yield ('line', line, path, current[2])
+                if included is not None:
+                    if any(included == frame[0] for frame in stack):
+                        raise ValueError("{0}:{1}: recursive #include of {2}".format(
+                            path, current[2], included))
+                    yield ('begin', included)
+                    if self._skip:
+                        self._skip = False
+                    else:
+                        stack.append([included, open(included), 0, []])
+                    continue
+                if conditions:
+                    raise ValueError("{0}: #ifdef/#ifndef without #endif".format(path))
+                f.close()
+                stack.pop()
+                yield ('end', path)
+        finally:
+            for frame in stack:
+                frame[1].close()
+
+    def _directive(self, line, conditions, current):
+        """Process a directive; return the path of a file to include or ``None``"""
+        fields = line[1:].split(';', 1)[0].split(None, 1)
+        directive = fields[0] if fields else ''
+        argument = fields[1].strip() if len(fields) > 1 else ''
+        if directive in ('ifdef', 'ifndef'):
+            defined = argument.split()[0] in self.defines if argument else False
+            conditions.append(defined if directive == 'ifdef' else not defined)
+        elif directive == 'else':
+            if not conditions:
+                raise ValueError("{0}:{1}: #else without #ifdef".format(current[0], current[2]))
+            conditions[-1] = not conditions[-1]
+        elif directive == 'endif':
+            if not conditions:
+                raise ValueError("{0}:{1}: #endif without #ifdef".format(current[0], current[2]))
+            conditions.pop()
+        elif not all(conditions):
+            pass
+        elif directive == 'include':
+            filename = argument.strip('"<>')
+            path = find_include(filename, os.path.dirname(current[0]), self.searchpath)
+            if path is None:
+                raise IOError(errno.ENOENT, "{0}:{1}: included file {2} not found in {3}".format(
+                    current[0], current[2], filename, [os.path.dirname(current[0])] +
+                    self.searchpath), filename)
+            return path
+        elif directive == 'define':
+            fields = argument.split(None, 1)
+            if not fields:
+                raise ValueError("{0}:{1}: #define without a name".format(current[0], current[2]))
+            self.defines[fields[0]] = fields[1].strip() if len(fields) > 1 else ''
+        elif directive == 'undef':
+            self.defines.pop(argument, None)
+        else:
+            raise ValueError("{0}:{1}: unsupported preprocessor directive #{2}".format(
+                current[0], current[2], directive))
+        return None
+
+    def _substitute(self, line):
+        # replace defined names in the data part of the line
+        data, sep, comment = line.partition(';')
+        defines = self.defines
+        if not any(field in defines for field in data.split()):
+            return line
+        data = _token.sub(lambda m: defines.get(m.group(0), m.group(0)), data)
+        return data + sep + comment
@@ -23,17 +23,19 @@ History
 Sources adapted from code by Reza Salari https://github.com/resal81/PyTopol
 
 
-Example: Read a processed.top file and scale charges
-----------------------------------------------------
+Example: Read a topology file and scale charges
+-----------------------------------------------
 
-Run ``grompp -pp`` to produce a processed.top from conf.gro, grompp.mdp and topol.top files::
-
-  $ grompp -pp
-
-This file now containts all the force-field information::
+Read a topol.top; included force field files are found in the
+directories in :envvar:`GMXLIB` and in the Gromacs installation, and
+the names listed in *defines* are set as with the mdp ``define``
+option::
 
   from gromacs.fileformats import TOP
-  top = TOP("processed.top")
+  top = TOP("topol.top", defines=["-DPOSRES"])
+
+A processed.top produced with ``grompp -pp`` already contains all the
+force-field information and can be read in the same way.
 
 Scale the LJ epsilon by an arbitrary number, here 0.9 ::
 
@@ -53,32 +55,62 @@ Write out the scaled down topology::
 """
 from __future__ import absolute_import
 
+import os
+import sys
+import re
 import textwrap
 import logging
+import itertools
 from collections import OrderedDict as odict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import six
+from six.moves import intern, zip
+from six.moves import cPickle as pickle
 
+from ..exceptions import ParseError
 from . import blocks
+from . import preprocessor
+
+NaN = float('nan')
 
 class TOP(blocks.System):
-    """Class to make a TOP object from a GROMACS processed.top file
+    """Class to make a TOP object from a GROMACS topology file
 
     The force-field and molecules data is exposed as python object.
 
-    .. Note::
+    ``#include``, ``#define`` and ``#ifdef`` directives are resolved with
+    a :class:`~gromacs.fileformats.preprocessor.TopologyPreprocessor` so
+    that a topol.top can be read directly; a processed.top generated by
+    GROMACS 'grompp -pp' works as well.
 
-       Only processed.top files generated by GROMACS 'grompp -pp'
-       are supported - the usual topol.top files are not supported (yet!)
+    Included force field files that only contain parameter types (such as
+    ``ffnonbonded.itp`` and ``ffbonded.itp``) are parsed once and kept in
+    a cache that is shared by all :class:`TOP` instances (see
+    :meth:`clear_cache`).
 
     """
     default_extension = "top"
     logger = logging.getLogger('gromacs.fileformats.TOP')
 
-    def __init__(self, fname):
+    def __init__(self, fname, include_dirs=None, defines=None):
         """Initialize the TOP structure.
 
         :Arguments:
           *fname*
-              name of the processed.top file
+              name of the topology file
+          *include_dirs*
+              directories that are searched for ``#include`` files before
+              the :envvar:`GMXLIB` directories (like ``grompp -I``)
+          *defines*
+              names that are defined for the preprocessor, e.g.
+              ``['POSRES']`` or the value of the mdp ``define`` option
+              ``"-DPOSRES -DFLEXIBLE"``
+
+        .. versionchanged:: 0.8.0
+           Topologies with ``#include`` statements can be read; added
+           keywords *include_dirs* and *defines*.
         """
         super(TOP, self).__init__()
 
@@ -92,14 +124,143 @@ class TOP(blocks.System):
         self.found_sections   = []
         self.forcefield       = 'gromacs'
 
+        if isinstance(defines, six.string_types):
+            defines = defines.split()
         self.molecules = []
-        self._parse(fname)
+        self._type_indices = {}           # section: (signature, blocks.TypeIndex)
+        self._parse(fname, include_dirs=include_dirs, defines=defines)
         self.molecules = tuple(self.molecules)
 
     def write(self, filename):
         """Write the TOP object to a file"""
         SystemToGroTop(self, filename)
 
+    #: Version of the :meth:`save_snapshot` file format; snapshots with a
+    #: different version cannot be loaded.
+    SNAPSHOT_VERSION = 2
+    _snapshot_magic = b'GromacsWrapper TOP snapshot\n'
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_type_indices'] = {}
+        return state
+
+    def save_snapshot(self, filename):
+        """Save the parsed topology as a binary snapshot in *filename*.
+
+        The snapshot contains the parameter types and the molecules
+        (including any modifications) and is read back with
+        :meth:`load_snapshot` much faster than the topology file is
+        parsed. The real paths, modification times and sizes of the
+        topology file and of all included files are stored so that a
+        stale snapshot is detected.
+
+        Snapshots are pickles: only load snapshots from trusted sources,
+        and with the Python major version that wrote them.
+
+        .. versionadded:: 0.8.0
+        """
+        header = {'version': self.SNAPSHOT_VERSION,
+                  'python': sys.version_info[0],
+                  'sources': list(self._sources.items()),
+                  }
+        with open(filename, 'wb') as f:
+            f.write(self._snapshot_magic)
+            pickle.dump(header, f, 2)
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        self.logger.debug("saved snapshot of %s in %r", self.fname, filename)
+
+    @classmethod
+    def load_snapshot(cls, filename, validate=True):
+        """Return the :class:`TOP` that was saved with :meth:`save_snapshot`.
+
+        :Arguments:
+          *filename*
+              name of the snapshot file
+          *validate*
+              check that the topology file and the files that it included
+              did not change since the snapshot was saved [``True``]
+
+        :Raises: :exc:`~gromacs.exceptions.ParseError` if *filename* is not
+                 a snapshot, has a different :attr:`SNAPSHOT_VERSION` or
+                 (with *validate*) is out of date
+
+        .. versionadded:: 0.8.0
+        """
+        with open(filename, 'rb') as f:
+            if f.read(len(cls._snapshot_magic)) != cls._snapshot_magic:
+                raise ParseError("{0!r} is not a TOP snapshot".format(filename))
+            header = pickle.load(f)
+            if header['version'] != cls.SNAPSHOT_VERSION or \
+                    header['python'] != sys.version_info[0]:
+                raise ParseError("snapshot {0!r} has version {1} (Python {2}) but version {3} "
+                                 "(Python {4}) is required".format(
+                                     filename, header['version'], header['python'],
+                                     cls.SNAPSHOT_VERSION, sys.version_info[0]))
+            if validate:
+                for path, signature in header['sources']:
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        raise ParseError("snapshot {0!r} is out of date: {1} does not "
+                                         "exist".format(filename, path))
+                    if (stat.st_mtime, stat.st_size) != tuple(signature):
+                        raise ParseError("snapshot {0!r} is out of date: {1} changed".format(
+                            filename, path))
+            top = pickle.load(f)
+        if not isinstance(top, cls):
+            raise ParseError("snapshot {0!r} does not contain a {1}".format(
+                filename, cls.__name__))
+        return top
+
+    #: Atom type attributes, reverse matching and wildcard of the sections
+    #: that :meth:`type_index` can index.
+    _type_index_sections = {
+        'pairtypes':       (('atype1', 'atype2'), True, None),
+        'bondtypes':       (('atype1', 'atype2'), True, None),
+        'constrainttypes': (('atype1', 'atype2'), True, None),
+        'angletypes':      (('atype1', 'atype2', 'atype3'), True, None),
+        'dihedraltypes':   (('atype1', 'atype2', 'atype3', 'atype4'), True, 'X'),
+        'impropertypes':   (('atype1', 'atype2', 'atype3', 'atype4'), True, 'X'),
+        'cmaptypes':       (('atype1', 'atype2', 'atype3', 'atype4', 'atype8'), False, None),
+    }
+
+    def type_index(self, section, rebuild=False):
+        """Return a :class:`~gromacs.fileformats.blocks.TypeIndex` for the types of *section*.
+
+        The index is built on first use and kept until the list of types
+        of *section* is replaced or changes its length.
+
+        Example::
+
+           index = top.type_index('dihedraltypes')
+           types = index.lookup(('CT1', 'C', 'NH1', 'CT1'), 9)
+
+        :Arguments:
+          *section*
+              one of "pairtypes", "bondtypes", "constrainttypes",
+              "angletypes", "dihedraltypes", "impropertypes", "cmaptypes"
+          *rebuild*
+              build a new index, e.g., after atom types of existing
+              types were modified [``False``]
+
+        :Returns: :class:`~gromacs.fileformats.blocks.TypeIndex`
+
+        .. versionadded:: 0.8.0
+        """
+        try:
+            atype_attrs, reversible, wildcard = self._type_index_sections[section]
+        except KeyError:
+            raise ValueError("No type index for section {0!r}; choose one of {1}".format(
+                section, ", ".join(sorted(self._type_index_sections))))
+        types = getattr(self, section)
+        signature = (id(types), len(types))
+        cached = self._type_indices.get(section)
+        if rebuild or cached is None or cached[0] != signature:
+            index = blocks.TypeIndex(types, atype_attrs, reversible=reversible, wildcard=wildcard)
+            self._type_indices[section] = cached = (signature, index)
+        return cached[1]
+
     def __repr__(self):
         """Represent the TOP object as a string"""
         moltypenames = list(self.dict_molname_mol.keys())
@@ -149,43 +310,123 @@ class TOP(blocks.System):
 
 
 
-    def _parse(self, fname):
-        """Parse a processed.top GROMACS topology file
+    #: Methods that parse a data line of each topology section; they are
+    #: called with the whitespace-separated fields of the line, the line
+    #: itself (without comments) and its line number.
+    _section_parsers = {
+        'defaults':                 '_parse_defaults',
+        'atomtypes':                '_parse_atomtypes',
+        'moleculetype':             '_parse_moleculetype',
+        'atoms':                    '_parse_atoms',
+        'pairtypes':                '_parse_pairtypes',
+        'pairs':                    '_parse_pairs',
+        'pairs_nb':                 '_parse_pairs_nb',
+        'nonbond_params':           '_parse_nonbond_params',
+        'bondtypes':                '_parse_bondtypes',
+        'bonds':                    '_parse_bonds',
+        'angletypes':               '_parse_angletypes',
+        'angles':                   '_parse_angles',
+        'dihedraltypes':            '_parse_dihedraltypes',
+        'dihedrals':                '_parse_dihedrals',
+        'cmaptypes':                '_parse_cmaptypes',
+        'cmap':                     '_parse_cmap',
+        'settles':                  '_parse_settles',
+        'virtual_sites3':           '_parse_virtual_sites3',
+        'exclusions':               '_parse_exclusions',
+        'constrainttypes':          '_parse_constrainttypes',
+        'constraints':              '_parse_constraints',
+        'position_restraints':      '_parse_ignore',
+        'distance_restraints':      '_parse_ignore',
+        'dihedral_restraints':      '_parse_ignore',
+        'orientation_restraints':   '_parse_ignore',
+        'angle_restraints':         '_parse_ignore',
+        'angle_restraints_z':       '_parse_ignore',
+        'implicit_genborn_params':  '_parse_ignore',
+        'system':                   '_parse_system',
+        'molecules':                '_parse_molecules',
+    }
+
+    #: Compact containers for the per-molecule terms and the section
+    #: name under which they appear in :attr:`blocks.Molecule.information`.
+    _param_arrays = odict([
+        ('pairs',       (blocks.PairArray, 'pairs')),
+        ('bonds',       (blocks.BondArray, 'bonds')),
+        ('angles',      (blocks.AngleArray, 'angles')),
+        ('dihedrals',   (blocks.DihedralArray, 'dihedrals')),
+        ('impropers',   (blocks.ImproperArray, 'dihedrals')),
+        ('cmaps',       (blocks.CMapArray, 'cmap')),
+        ('constraints', (blocks.ConstraintArray, 'constraints')),
+    ])
+
+    #: Sections of included files that can be kept in :attr:`_forcefield_cache`.
+    _forcefield_sections = frozenset(['defaults', 'atomtypes', 'pairtypes', 'bondtypes',
+                                      'constrainttypes', 'angletypes', 'dihedraltypes',
+                                      'cmaptypes', 'nonbond_params', 'implicit_genborn_params'])
+
+    #: Lists of the parameter types that are defined in force field files.
+    _forcefield_types = ('atomtypes', 'pairtypes', 'bondtypes', 'constrainttypes', 'angletypes',
+                         'dihedraltypes', 'impropertypes', 'nonbond_params')
+
+    #: Parsed force field files; (real path, mtime, size, defines): record.
+    _forcefield_cache = {}
+
+    @classmethod
+    def clear_cache(cls):
+        """Forget all force field files that were parsed by :class:`TOP` instances.
+
+        .. versionadded:: 0.8.0
+        """
+        cls._forcefield_cache.clear()
+
+    def _parse(self, fname, include_dirs=None, defines=None):
+        """Parse a GROMACS topology file
 
-        The function reads in the file line-by-line, and it's a bunch of 'elif' statements,
-        writing parameter/atom line to current section/molecule.
+        The lines of the file and of all included files come from a
+        :class:`~gromacs.fileformats.preprocessor.TopologyPreprocessor`.
+        When a new section starts, the method that parses lines of this
+        section is looked up in :attr:`_section_parsers` and then called
+        for each data line.
 
         ParamTypes are added to self.xyztypes (AtomType goes to self.atomtypes).
-        Params are added to current molecule (Atom goes to mol.atoms.append(atom))
+
+        Atoms and bonded terms of a molecule are collected as tuples and
+        turned into compact arrays (:class:`blocks.AtomArray` and
+        :class:`blocks.ParamArray`) once the molecule is complete; the
+        :class:`blocks.Atom` and :class:`blocks.Param` objects are only
+        created when they are accessed.
 
         MoleculeTypes and Molecules are odd, and are added to
             * MoleculeType to :attr:`self.dict_molname_mol[mol.name] = mol`
             * Molecule to :attr:`self.molecules.append(self.dict_molname_mol[mname])`
 
-        :obj:`curr_sec` variable stores to current section being read-in
-        :obj:`mol` variable stores the current molecule being read-in
-        :obj:`cmap_lines` are a little odd, since CMAP parameters are stored on multiple lines
+        :attr:`_mol` stores the current molecule being read-in,
+        :attr:`_records` its atoms and terms, and :attr:`_cmap_lines` the
+        CMAP parameters, which are stored on multiple lines.
+
+        Included files that only define parameter types are recorded in
+        :attr:`_forcefield_cache` and replayed from there when another
+        topology includes them with the same defines.
 
         :Arguments:
           *fname*
-              name of the processed.top file
+              name of the topology file
 
         :Returns: None
         """
-        def _find_section(line):
-            return  line.strip('[').strip(']').strip()
-
-        def _add_info(sys_or_mol, section, container):
-            # like (mol, 'atomtypes', mol.atomtypes)
-            if sys_or_mol.information.get(section, False) is False:
-                sys_or_mol.information[section] = container
-
-        mol        = None   # to hold the current mol
-        curr_sec   = None
-        cmap_lines = []
-
-        with open(fname) as f:
-            for i_line, line in enumerate(f):
+        self._curr_sec = None
+        self._source = None       # real path of the file of the current line
+        self._mol = None
+        self._records = None
+        self._cmap_lines = []
+        self._parse_line = self._parse_unknown
+
+        self._sources = odict()     # real path: (mtime, size) of all files read
+        pp = preprocessor.TopologyPreprocessor(include_dirs=include_dirs, defines=defines)
+        recordings = []   # _ForceFieldRecording of the open included files
+        depth = 0
+        for event in pp.events(fname):
+            if event[0] == 'line':
+                line = event[1]
 
                 # trimming
                 if ';' in line:
@@ -198,617 +439,561 @@ class TOP(blocks.System):
                 if line[0] == '*':
                     continue
 
-                # the topology must be stand-alone (i.e. no includes)
-                if line.startswith('#include'):
-                    msg = 'The topology file has "#include" statements.'
-                    msg+= ' You must provide a processed topology file that grompp creates.'
-                    raise ValueError(msg)
-
                 # find sections
                 if line[0] == '[':
-                    curr_sec = _find_section(line)
-                    self.found_sections.append(curr_sec)
+                    section = line.strip('[').strip(']').strip()
+                    self._enter_section(section)
+                    for recording in recordings:
+                        recording.section(section)
                     continue
 
-                fields = line.split()
-
-                if curr_sec == 'defaults':
-                    '''
-                    # ; nbfunc        comb-rule       gen-pairs       fudgeLJ fudgeQQ
-                    #1               2               yes             0.5     0.8333
-                    '''
-                    assert len(fields) in  [2, 5]
-                    self.defaults['nbfunc']    = int(fields[0])
-                    self.defaults['comb-rule'] = int(fields[1])
-                    if len(fields) == 5:
-
-                       self.defaults['gen-pairs'] = fields[2]
-                       self.defaults['fudgeLJ']   = float(fields[3])
-                       self.defaults['fudgeQQ']   = float(fields[4])
-
-                elif curr_sec == 'atomtypes':
-                    '''
-                    # ;name               at.num    mass         charge    ptype  sigma   epsilon
-                    # ;name   bond_type   at.num    mass         charge    ptype  sigma   epsilon
-                    # ;name                         mass         charge    ptype  c6      c12
-
-                    '''
-                    if len(fields) not in (6,7,8):
-                        self.logger('skipping atomtype line with neither 7 or 8 fields: \n {0:s}'.format(line))
-                        continue
-
-                    #shift = 0 if len(fields) == 7 else 1
-                    shift = len(fields) - 7
-                    at = blocks.AtomType('gromacs')
-                    at.atype = fields[0]
-                    if shift == 1: at.bond_type = fields[1]
-
-                    at.mass  = float(fields[2+shift])
-                    at.charge= float(fields[3+shift])
-
-                    particletype = fields[4+shift]
-                    assert particletype in ('A', 'S', 'V', 'D')
-                    if particletype not in ('A',):
-                        self.logger('warning: non-atom particletype: "{0:s}"'.format(line))
-
-                    sig = float(fields[5+shift])
-                    eps = float(fields[6+shift])
-
-                    at.gromacs= {'param': {'lje':eps, 'ljl':sig, 'lje14':None, 'ljl14':None} }
-
-                    self.atomtypes.append(at)
-
-                    _add_info(self, curr_sec, self.atomtypes)
-
-
-                # extend system.molecules
-                elif curr_sec == 'moleculetype':
-                    assert len(fields) == 2
-
-                    mol = blocks.Molecule()
-
-                    mol.name = fields[0]
-                    mol.exclusion_numb = int(fields[1])
-
-                    self.dict_molname_mol[mol.name] = mol
-
+                if recordings and recordings[-1].path == event[2]:
+                    recordings[-1].data()
+                self._source = event[2]
+                self._parse_line(line.split(), line, event[3])
 
-                elif curr_sec == 'atoms':
-                    '''
-                    #id    at_type     res_nr  residu_name at_name  cg_nr  charge   mass  typeB    chargeB      massB
-                    # 1       OC          1       OH          O1       1      -1.32
-
-                    OR
+            elif event[0] == 'begin':
+                depth += 1
+                key = self._forcefield_key(event[1], pp.defines)
+                self._sources[key[0]] = key[1:3]
+                if depth == 1:
+                    continue
+                record = self._forcefield_cache.get(key)
+                if record is not None and record.valid():
+                    pp.skip_include()
+                    depth -= 1
+                    self._replay(record, pp)
+                    self._sources.update((f[0], f[1:]) for f in record.files)
+                    for recording in recordings:
+                        recording.files.append(key[:3])
+                        recording.files.extend(record.files)
+                    continue
+                recordings.append(_ForceFieldRecording(self, key, pp))
+                for recording in recordings[:-1]:
+                    recording.files.append(key[:3])
 
-                    [ atoms ]
-                    ; id   at type  res nr  residu name at name     cg nr   charge
-                    1       OT      1       SOL              OW             1       -0.834
-
-                    '''
-
-                    aserial = int(fields[0])
-                    atype   = fields[1]
-                    resnumb = int(fields[2])
-                    resname = fields[3]
-                    aname   = fields[4]
-                    cgnr    = int(fields[5])
-                    charge  = float(fields[6])
-                    rest = fields[7:]
-
-                    atom         = blocks.Atom()
-                    atom.name    = aname
-                    atom.atomtype= atype
-                    atom.number  = aserial
-                    atom.resname = resname
-                    atom.resnumb = resnumb
-                    atom.charge  = charge
-
-                    if rest:
-                        mass = float(rest[0])
-                        atom.mass = mass
-
-                    mol.atoms.append(atom)
-
-                    _add_info(mol, curr_sec, mol.atoms)
-
-                elif curr_sec in ('pairtypes', 'pairs', 'pairs_nb'):
-                    '''
-                    section     #at     fu      #param
-                    ---------------------------------
-                    pairs       2       1       V,W
-                    pairs       2       2       fudgeQQ, qi, qj, V, W
-                    pairs_nb    2       1       qi, qj, V, W
-
-                    '''
-
-                    ai, aj = fields[:2]
-                    fu     = int(fields[2])
-                    assert fu in (1,2)
-
-                    pair = blocks.InteractionType('gromacs')
-                    if fu == 1:
-                        if curr_sec=='pairtypes':
-                            pair.atype1 = ai
-                            pair.atype2 = aj
-                            v, w = list(map(float, fields[3:5]))
-                            pair.gromacs = {'param': {'lje':None, 'ljl':None, 'lje14':w, 'ljl14':v}, 'func':fu }
-
-                            self.pairtypes.append(pair)
-                            _add_info(self, curr_sec, self.pairtypes)
-
-                        elif curr_sec == 'pairs':
-                            ai, aj = list( map(int, [ai,aj]) )
-                            pair.atom1 = mol.atoms[ai-1]
-                            pair.atom2 = mol.atoms[aj-1]
-                            pair.gromacs['func'] = fu
-
-                            mol.pairs.append(pair)
-                            _add_info(mol, curr_sec, mol.pairs)
-
-                        else:
-                            raise ValueError
-
-                    else:
-                        raise NotImplementedError('{0:s} with functiontype {1:d} is not supported'.format(curr_sec,fu))
-
-                elif curr_sec == 'nonbond_params':
-                    '''
-                    ; typei typej  f.type sigma   epsilon
-                    ; f.type=1 means LJ (not buckingham)
-                    ; sigma&eps since mixing-rule = 2
-                    '''
-
-                    assert len(fields) == 5
-                    ai, aj = fields[:2]
-                    fu     = int(fields[2])
-
-                    assert fu == 1
-                    sig    = float(fields[3])
-                    eps    = float(fields[4])
-
-                    nonbond_param = blocks.NonbondedParamType('gromacs')
-                    nonbond_param.atype1 = ai
-                    nonbond_param.atype2 = aj
-                    nonbond_param.gromacs['func'] = fu
-                    nonbond_param.gromacs['param'] = {'eps': eps, 'sig': sig}
-
-                    self.nonbond_params.append(nonbond_param)
-                    _add_info(self, curr_sec, self.nonbond_params)
-
-                elif curr_sec in ('bondtypes', 'bonds'):
-                    '''
-                    section     #at     fu      #param
-                    ----------------------------------
-                    bonds       2       1       2
-                    bonds       2       2       2
-                    bonds       2       3       3
-                    bonds       2       4       2
-                    bonds       2       5       ??
-                    bonds       2       6       2
-                    bonds       2       7       2
-                    bonds       2       8       ??
-                    bonds       2       9       ??
-                    bonds       2       10      4
-                    '''
-
-                    ai, aj = fields[:2]
-                    fu     = int(fields[2])
-                    assert fu in (1,2,3,4,5,6,7,8,9,10)
-
-                    if fu != 1:
-                        raise NotImplementedError('function {0:d} is not yet supported'.format(fu))
-
-                    bond = blocks.BondType('gromacs')
-
-                    if fu == 1:
-                        if curr_sec == 'bondtypes':
-                            bond.atype1 = ai
-                            bond.atype2 = aj
-
-                            b0, kb = list(map(float, fields[3:5]))
-                            bond.gromacs = {'param':{'kb':kb, 'b0':b0}, 'func':fu}
-
-                            self.bondtypes.append(bond)
-                            _add_info(self, curr_sec, self.bondtypes)
-
-                        elif curr_sec == 'bonds':
-                            ai, aj = list(map(int, [ai, aj]))
-                            bond.atom1 = mol.atoms[ai-1]
-                            bond.atom2 = mol.atoms[aj-1]
-                            bond.gromacs['func'] = fu
-
-                            if len(fields) > 3:
-                                b0, kb = list(map(float, fields[3:5]))
-                                bond.gromacs = {'param':{'kb':kb, 'b0':b0}, 'func':fu}
-
-                            mol.bonds.append(bond)
-                            _add_info(mol, curr_sec, mol.bonds)
-
-                    else:
-                        raise NotImplementedError
-
-                elif curr_sec in ('angletypes', 'angles'):
-                    '''
-                    section     #at     fu      #param
-                    ----------------------------------
-                    angles      3       1       2
-                    angles      3       2       2
-                    angles      3       3       3
-                    angles      3       4       4
-                    angles      3       5       4
-                    angles      3       6       6
-                    angles      3       8       ??
-                    '''
-
-                    ai, aj , ak = fields[:3]
-                    fu          = int(fields[3])
-                    assert fu in (1,2,3,4,5,6,8)  # no 7
-
-                    if fu not in (1,2,5):
-                        raise NotImplementedError('function {0:d} is not yet supported'.format(fu))
-
-                    ang = blocks.AngleType('gromacs')
-                    if fu == 1:
-                        if curr_sec == 'angletypes':
-                            ang.atype1 = ai
-                            ang.atype2 = aj
-                            ang.atype3 = ak
-
-                            tetha0, ktetha = list(map(float, fields[4:6]))
-                            ang.gromacs = {'param':{'ktetha':ktetha, 'tetha0':tetha0, 'kub':None, 's0':None}, 'func':fu}
-
-                            self.angletypes.append(ang)
-                            _add_info(self, curr_sec, self.angletypes)
-
-                        elif curr_sec == 'angles':
-                            ai, aj, ak = list(map(int, [ai, aj, ak]))
-                            ang.atom1 = mol.atoms[ai-1]
-                            ang.atom2 = mol.atoms[aj-1]
-                            ang.atom3 = mol.atoms[ak-1]
-                            ang.gromacs['func'] = fu
-
-                            mol.angles.append(ang)
-                            _add_info(mol, curr_sec, mol.angles)
-
-                        else:
-                            raise ValueError
-
-                    elif fu == 2:
-                        if curr_sec == 'angletypes':
-                            raise NotImplementedError()
-
-                        elif curr_sec == 'angles':
-                            ai, aj, ak = list(map(int, [ai, aj, ak]))
-                            ang.atom1 = mol.atoms[ai-1]
-                            ang.atom2 = mol.atoms[aj-1]
-                            ang.atom3 = mol.atoms[ak-1]
-                            ang.gromacs['func'] = fu
-
-                            tetha0, ktetha = list(map(float, fields[4:6]))
-                            ang.gromacs = {'param':{'ktetha':ktetha, 'tetha0':tetha0, 'kub':None, 's0':None}, 'func':fu}
-
-                            mol.angles.append(ang)
-                            _add_info(mol, curr_sec, mol.angles)
-
-                    elif fu == 5:
-                        if curr_sec == 'angletypes':
-                            ang.atype1 = ai
-                            ang.atype2 = aj
-                            ang.atype3 = ak
-                            tetha0, ktetha, s0, kub = list(map(float, fields[4:8]))
-
-                            ang.gromacs = {'param':{'ktetha':ktetha, 'tetha0':tetha0, 'kub':kub, 's0':s0}, 'func':fu}
-
-                            self.angletypes.append(ang)
-                            _add_info(self, curr_sec, self.angletypes)
-
-                        elif curr_sec == 'angles':
-                            ai, aj, ak = list(map(int, [ai, aj, ak]))
-                            ang.atom1 = mol.atoms[ai-1]
-                            ang.atom2 = mol.atoms[aj-1]
-                            ang.atom3 = mol.atoms[ak-1]
-                            ang.gromacs['func'] = fu
-
-                            mol.angles.append(ang)
-                            _add_info(mol, curr_sec, mol.angles)
-
-                        else:
-                            raise ValueError
-
-                    else:
-                        raise NotImplementedError
-
-
-                elif curr_sec in  ('dihedraltypes', 'dihedrals'):
-                    '''
-                    section     #at     fu      #param
-                    ----------------------------------
-                    dihedrals   4       1       3
-                    dihedrals   4       2       2
-                    dihedrals   4       3       6
-                    dihedrals   4       4       3
-                    dihedrals   4       5       4
-                    dihedrals   4       8       ??
-                    dihedrals   4       9       3
-                    '''
-
-                    if curr_sec == 'dihedraltypes' and len(fields) == 6:
-                        # in oplsaa - quartz parameters
-                        fields.insert(2, 'X')
-                        fields.insert(0, 'X')
-
-                    ai, aj, ak, am = fields[:4]
-                    fu = int(fields[4])
-                    assert fu in (1,2,3,4,5,8,9)
-
-                    if fu not in (1,2,3,4,9):
-                        raise NotImplementedError('dihedral function {0:d} is not yet supported'.format(fu))
-
-                    dih = blocks.DihedralType('gromacs')
-                    imp = blocks.ImproperType('gromacs')
-                    # proper dihedrals
-                    if fu in (1,3,9):
-                        if curr_sec == 'dihedraltypes':
-                            dih.atype1 = ai
-                            dih.atype2 = aj
-                            dih.atype3 = ak
-                            dih.atype4 = am
-
-                            dih.line = i_line + 1
-
-                            if fu == 1:
-                                delta, kchi, n = list(map(float, fields[5:8]))
-                                dih.gromacs['param'].append({'kchi':kchi, 'n':n, 'delta':delta})
-                            elif fu == 3:
-                                c0, c1, c2, c3, c4, c5 = list(map(float, fields[5:11]))
-                                m = dict(c0=c0, c1=c1, c2=c2, c3=c3, c4=c4, c5=c5)
-                                dih.gromacs['param'].append(m)
-                            elif fu == 4:
-                                delta, kchi, n = list(map(float, fields[5:8]))
-                                dih.gromacs['param'].append({'kchi':kchi, 'n':int(n), 'delta':delta})
-                            elif fu == 9:
-                                delta, kchi, n = list(map(float, fields[5:8]))
-                                dih.gromacs['param'].append({'kchi':kchi, 'n':int(n), 'delta':delta})
-                            else:
-                                raise ValueError
-
-                            dih.gromacs['func'] = fu
-                            self.dihedraltypes.append(dih)
-                            _add_info(self, curr_sec, self.dihedraltypes)
-
-                        elif curr_sec == 'dihedrals':
-                            ai, aj, ak, am = list(map(int, fields[:4]))
-                            dih.atom1 = mol.atoms[ai-1]
-                            dih.atom2 = mol.atoms[aj-1]
-                            dih.atom3 = mol.atoms[ak-1]
-                            dih.atom4 = mol.atoms[am-1]
-                            dih.gromacs['func'] = fu
-
-                            dih.line = i_line + 1
-
-                            if fu == 1:
-                                delta, kchi, n = list(map(float, fields[5:8]))
-                                dih.gromacs['param'].append({'kchi':kchi, 'n': int(n), 'delta':delta})
-                            elif fu == 3:
-                                pass
-                            elif fu == 4:
-                                pass
-                            elif fu == 9:
-                                if len(fields[5:8]) == 3:
-                                    delta, kchi, n = list(map(float, fields[5:8]))
-                                    dih.gromacs['param'].append({'kchi':kchi, 'n':int(n), 'delta':delta})
-                            else:
-                                raise ValueError
-
-                            mol.dihedrals.append(dih)
-                            _add_info(mol, curr_sec, mol.dihedrals)
-
-                        else:
-                            raise ValueError
-                    # impropers
-                    elif fu in (2,4):
-                        if curr_sec == 'dihedraltypes':
-                            imp.atype1 = ai
-                            imp.atype2 = aj
-                            imp.atype3 = ak
-                            imp.atype4 = am
-
-                            imp.line = i_line + 1
-
-                            if fu == 2:
-                                psi0 , kpsi = list(map(float, fields[5:7]))
-                                imp.gromacs['param'].append({'kpsi':kpsi, 'psi0': psi0})
-                            elif fu == 4:
-                                psi0 , kpsi, n = list(map(float, fields[5:8]))
-                                imp.gromacs['param'].append({'kpsi':kpsi, 'psi0': psi0, 'n': int(n)})
-                            else:
-                                raise ValueError
-
-                            imp.gromacs['func'] = fu
-                            self.impropertypes.append(imp)
-                            _add_info(self, curr_sec, self.impropertypes)
-
-                        elif curr_sec == 'dihedrals':
-                            ai, aj, ak, am = list(map(int, fields[:4]))
-                            imp.atom1 = mol.atoms[ai-1]
-                            imp.atom2 = mol.atoms[aj-1]
-                            imp.atom3 = mol.atoms[ak-1]
-                            imp.atom4 = mol.atoms[am-1]
-                            imp.gromacs['func'] = fu
-
-                            imp.line = i_line + 1
-
-                            if fu == 2:
-                                pass
-                            elif fu == 4:
-                                # in-line override of dihedral parameters
-                                if len(fields[5:8]) == 3:
-                                    psi0 , kpsi, n = list(map(float, fields[5:8]))
-                                    imp.gromacs['param'].append({'kpsi':kpsi, 'psi0': psi0, 'n': int(n)})
-                            else:
-                                raise ValueError
-
-                            mol.impropers.append(imp)
-                            _add_info(mol, curr_sec, mol.impropers)
-
-                        else:
-                            raise ValueError
-
-                    else:
-                        raise NotImplementedError
-
-
-                elif curr_sec in ('cmaptypes', 'cmap'):
-
-                    cmap = blocks.CMapType('gromacs')
-                    if curr_sec == 'cmaptypes':
-                        cmap_lines.append(line)
-                        _add_info(self, curr_sec, self.cmaptypes)
-                    else:
-                        ai, aj, ak, am, an = list(map(int, fields[:5]))
-                        fu = int(fields[5])
-                        assert fu == 1
-                        cmap.atom1 = mol.atoms[ai-1]
-                        cmap.atom2 = mol.atoms[aj-1]
-                        cmap.atom3 = mol.atoms[ak-1]
-                        cmap.atom4 = mol.atoms[am-1]
-                        cmap.atom8 = mol.atoms[an-1]
-                        cmap.gromacs['func'] = fu
-
-                        mol.cmaps.append(cmap)
-                        _add_info(mol, curr_sec, mol.cmaps)
-
-
-                elif curr_sec == 'settles':
-                    '''
-                    section     #at     fu      #param
-                    ----------------------------------
-                    '''
-
-                    assert len(fields) == 4
-                    ai = int(fields[0])
-                    fu = int(fields[1])
-                    assert fu == 1
+            else:
+                depth -= 1
+                if recordings and recordings[-1].path == event[1]:
+                    record = recordings.pop().finish()
+                    if record is not None:
+                        self._forcefield_cache[record.key] = record
+
+        self.defines = pp.defines
+        self._finish_molecule()
+        self._process_cmap_lines()
+        del self._curr_sec, self._mol, self._records, self._cmap_lines, self._parse_line
+        del self._source
+
+    def _enter_section(self, section):
+        self._curr_sec = section
+        self.found_sections.append(section)
+        self._parse_line = getattr(self, self._section_parsers.get(section, '_parse_unknown'))
 
+    @staticmethod
+    def _forcefield_key(path, defines):
+        stat = os.stat(path)
+        return (path, stat.st_mtime, stat.st_size, frozenset(defines.items()))
+
+    def _replay(self, record, pp):
+        """Add the parameter types of a cached force field file."""
+        for attr, types in record.types:
+            getattr(self, attr).extend([t.copy() for t in types])
+        self._cmap_lines.extend(record.cmap_lines)
+        if record.defaults is not None:
+            self.defaults.update(record.defaults)
+        self.found_sections.extend(record.sections)
+        for section, attr in record.information:
+            self._add_info(self, section, getattr(self, attr))
+        pp.defines.clear()
+        pp.defines.update(record.defines)
+        if record.last_section is not None:
+            self._curr_sec = record.last_section
+            self._parse_line = getattr(self, self._section_parsers[record.last_section])
+
+    def _add_info(self, sys_or_mol, section, container):
+        # like (mol, 'atomtypes', mol.atomtypes)
+        if sys_or_mol.information.get(section, False) is False:
+            sys_or_mol.information[section] = container
+
+    def _finish_molecule(self):
+        """Store the atoms and terms collected for the current molecule as arrays."""
+        mol = self._mol
+        if mol is None:
+            return
+        records = self._records
+        for section, rows in records.items():
+            if section == 'atoms':
+                mol.atoms = blocks.AtomArray(rows)
+                self._add_info(mol, section, mol.atoms)
+            elif section in self._param_arrays:
+                paramarray_cls, info_section = self._param_arrays[section]
+                terms = paramarray_cls(rows)
+                natoms = len(mol.atoms)
+                for field in terms.atom_fields:
+                    indices = terms.array[field]
+                    if len(indices) and (indices.min() < 0 or indices.max() >= natoms):
+                        raise IndexError("[ {0} ] of molecule {1} refers to atoms that do not "
+                                         "exist".format(info_section, mol.name))
+                setattr(mol, section, terms)
+                self._add_info(mol, info_section, terms)
+            elif section == 'settles':
+                for ai, fu, dOH, dHH in rows:
                     settle = blocks.SettleType('gromacs')
-                    settle.atom = mol.atoms[ai-1]
-                    settle.dOH = float(fields[2])
-                    settle.dHH = float(fields[3])
-
+                    settle.atom = mol.atoms[ai]
+                    settle.dOH = dOH
+                    settle.dHH = dHH
                     mol.settles.append(settle)
-                    _add_info(mol, curr_sec, mol.settles)
-
-                elif curr_sec == "virtual_sites3":
-                    '''
-                        ; Dummy from            funct   a       b
-                        4   1   2   3   1   0.131937768 0.131937768
-                    '''
-                    assert len(fields) == 7
-                    ai = int(fields[0])
-                    aj = int(fields[1])
-                    ak = int(fields[2])
-                    al = int(fields[3])
-                    fu = int(fields[4])
-                    assert fu == 1
-                    a = float(fields[5])
-                    b = float(fields[6])
-
-                    vs3 = blocks.VirtualSites3Type('gromacs')
-                    vs3.atom1 = ai
-                    vs3.atom2 = aj
-                    vs3.atom3 = ak
-                    vs3.atom4 = al
-                    vs3.gromacs['func'] = fu
-                    vs3.gromacs['param'] = { 'a': a, 'b':b }
-                    mol.virtual_sites3.append(vs3)
-                    _add_info(mol, curr_sec, mol.virtual_sites3)
-
-
-                elif curr_sec in ('exclusions',):
-                    ai = int(fields[0])
-                    other = list(map(int, fields[1:]))
-
+                self._add_info(mol, section, mol.settles)
+            elif section == 'exclusions':
+                for ai, other in rows:
                     exc = blocks.Exclusion()
-                    exc.main_atom  = mol.atoms[ai-1]
-                    exc.other_atoms= [mol.atoms[k-1] for k in other]
-
+                    exc.main_atom  = mol.atoms[ai]
+                    exc.other_atoms= [mol.atoms[k] for k in other]
                     mol.exclusions.append(exc)
-                    _add_info(mol, curr_sec, mol.exclusions)
-
-
-                elif curr_sec in ('constrainttypes', 'constraints'):
-                    '''
-                    section     #at     fu      #param
-                    ----------------------------------
-                    constraints 2       1       1
-                    constraints 2       2       1
-                    '''
-
-                    ai, aj = fields[:2]
-                    fu = int(fields[2])
-                    assert fu in (1,2)
-
-                    cons = blocks.ConstraintType('gromacs')
-
-                    # TODO: what's different between 1 and 2
-                    if fu in [1, 2]:
-                        if curr_sec == 'constrainttypes':
-                            cons.atype1 = ai
-                            cons.atype2 = aj
-                            b0 = float(fields[3])
-                            cons.gromacs = {'param':{'b0':b0}, 'func': fu}
-
-                            self.constrainttypes.append(cons)
-                            _add_info(self, curr_sec, self.constrainttypes)
+                self._add_info(mol, section, mol.exclusions)
+        self._mol = None
+        self._records = None
+
+    def _append_record(self, section, record):
+        try:
+            self._records[section].append(record)
+        except KeyError:
+            self._records[section] = [record]
+
+    def _parse_unknown(self, fields, line, lineno):
+        raise NotImplementedError('Unknown section in topology: {0}'.format(self._curr_sec))
+
+    def _parse_ignore(self, fields, line, lineno):
+        pass
+
+    def _parse_defaults(self, fields, line, lineno):
+        '''
+        # ; nbfunc        comb-rule       gen-pairs       fudgeLJ fudgeQQ
+        #1               2               yes             0.5     0.8333
+        '''
+        assert len(fields) in  [2, 5]
+        self.defaults['nbfunc']    = int(fields[0])
+        self.defaults['comb-rule'] = int(fields[1])
+        if len(fields) == 5:
+            self.defaults['gen-pairs'] = fields[2]
+            self.defaults['fudgeLJ']   = float(fields[3])
+            self.defaults['fudgeQQ']   = float(fields[4])
+
+    def _parse_atomtypes(self, fields, line, lineno):
+        '''
+        # ;name               at.num    mass         charge    ptype  sigma   epsilon
+        # ;name   bond_type   at.num    mass         charge    ptype  sigma   epsilon
+        # ;name                         mass         charge    ptype  c6      c12
+
+        '''
+        if len(fields) not in (6,7,8):
+            self.logger.warning('skipping atomtype line with neither 7 or 8 fields: \n {0:s}'.format(line))
+            return
+
+        #shift = 0 if len(fields) == 7 else 1
+        shift = len(fields) - 7
+        at = blocks.AtomType('gromacs')
+        at.atype = fields[0]
+        if shift == 1: at.bond_type = fields[1]
+
+        at.mass  = float(fields[2+shift])
+        at.charge= float(fields[3+shift])
+
+        particletype = fields[4+shift]
+        assert particletype in ('A', 'S', 'V', 'D')
+        if particletype not in ('A',):
+            self.logger.warning('warning: non-atom particletype: "{0:s}"'.format(line))
+
+        sig = float(fields[5+shift])
+        eps = float(fields[6+shift])
+
+        at.gromacs= {'param': {'lje':eps, 'ljl':sig, 'lje14':None, 'ljl14':None} }
+
+        self.atomtypes.append(at)
+        self._add_info(self, 'atomtypes', self.atomtypes)
+
+    def _parse_moleculetype(self, fields, line, lineno):
+        assert len(fields) == 2
+
+        self._finish_molecule()
+
+        mol = blocks.Molecule()
+        mol.name = fields[0]
+        mol.exclusion_numb = int(fields[1])
+
+        self.dict_molname_mol[mol.name] = mol
+        self._mol = mol
+        self._records = odict()
+
+    def _parse_atoms(self, fields, line, lineno):
+        '''
+        #id    at_type     res_nr  residu_name at_name  cg_nr  charge   mass  typeB    chargeB      massB
+        # 1       OC          1       OH          O1       1      -1.32
+
+        OR
+
+        [ atoms ]
+        ; id   at type  res nr  residu name at name     cg nr   charge
+        1       OT      1       SOL              OW             1       -0.834
+
+        '''
+        mass = float(fields[7]) if len(fields) > 7 else NaN
+        self._append_record('atoms', (int(fields[0]), intern(fields[1]), int(fields[2]),
+                                      intern(fields[3]), intern(fields[4]), int(fields[5]),
+                                      float(fields[6]), mass))
+
+    def _parse_pairtypes(self, fields, line, lineno):
+        '''
+        section     #at     fu      #param
+        ---------------------------------
+        pairs       2       1       V,W
+        pairs       2       2       fudgeQQ, qi, qj, V, W
+        pairs_nb    2       1       qi, qj, V, W
+
+        '''
+        ai, aj = fields[:2]
+        fu     = int(fields[2])
+        assert fu in (1,2)
+        if fu != 1:
+            raise NotImplementedError('{0:s} with functiontype {1:d} is not supported'.format(self._curr_sec,fu))
+
+        pair = blocks.InteractionType('gromacs')
+        pair.atype1 = ai
+        pair.atype2 = aj
+        v, w = list(map(float, fields[3:5]))
+        pair.gromacs = {'param': {'lje':None, 'ljl':None, 'lje14':w, 'ljl14':v}, 'func':fu }
+
+        self.pairtypes.append(pair)
+        self._add_info(self, 'pairtypes', self.pairtypes)
+
+    def _parse_pairs(self, fields, line, lineno):
+        fu = int(fields[2])
+        assert fu in (1,2)
+        if fu != 1:
+            raise NotImplementedError('{0:s} with functiontype {1:d} is not supported'.format(self._curr_sec,fu))
+        self._append_record('pairs', (int(fields[0]) - 1, int(fields[1]) - 1, fu))
+
+    def _parse_pairs_nb(self, fields, line, lineno):
+        fu = int(fields[2])
+        assert fu in (1,2)
+        if fu != 1:
+            raise NotImplementedError('{0:s} with functiontype {1:d} is not supported'.format(self._curr_sec,fu))
+        raise ValueError
+
+    def _parse_nonbond_params(self, fields, line, lineno):
+        '''
+        ; typei typej  f.type sigma   epsilon
+        ; f.type=1 means LJ (not buckingham)
+        ; sigma&eps since mixing-rule = 2
+        '''
+        assert len(fields) == 5
+        ai, aj = fields[:2]
+        fu     = int(fields[2])
+
+        assert fu == 1
+        sig    = float(fields[3])
+        eps    = float(fields[4])
+
+        nonbond_param = blocks.NonbondedParamType('gromacs')
+        nonbond_param.atype1 = ai
+        nonbond_param.atype2 = aj
+        nonbond_param.gromacs['func'] = fu
+        nonbond_param.gromacs['param'] = {'eps': eps, 'sig': sig}
+
+        self.nonbond_params.append(nonbond_param)
+        self._add_info(self, 'nonbond_params', self.nonbond_params)
 
-                        elif curr_sec == 'constraints':
-                            ai, aj = list(map(int, fields[:2]))
-                            cons.atom1 = mol.atoms[ai-1]
-                            cons.atom2 = mol.atoms[aj-1]
-                            cons.gromacs['func'] = fu
-
-                            mol.constraints.append(cons)
-                            _add_info(mol, curr_sec, mol.constraints)
-
-                        else:
-                            raise ValueError
-                    else:
-                        raise ValueError
-
-                elif curr_sec in ('position_restraints',
-                                  'distance_restraints',
-                                  'dihedral_restraints',
-                                  'orientation_restraints',
-                                  'angle_restraints',
-                                  'angle_restraints_z'):
-                    pass
-
-
-                elif curr_sec in ('implicit_genborn_params',):
-                    '''
-                    attype   sar     st      pi      gbr      hct
-                    '''
-                    pass
-
-                elif curr_sec == 'system':
-                    #assert len(fields) == 1
-                    self.name = fields[0]
-
-
-                elif curr_sec == 'molecules':
-                    assert len(fields) == 2
-                    mname, nmol = fields[0], int(fields[1])
+    @staticmethod
+    def _check_bond_func(fu):
+        '''
+        section     #at     fu      #param
+        ----------------------------------
+        bonds       2       1       2
+        bonds       2       2       2
+        bonds       2       3       3
+        bonds       2       4       2
+        bonds       2       5       ??
+        bonds       2       6       2
+        bonds       2       7       2
+        bonds       2       8       ??
+        bonds       2       9       ??
+        bonds       2       10      4
+        '''
+        assert fu in (1,2,3,4,5,6,7,8,9,10)
+        if fu != 1:
+            raise NotImplementedError('function {0:d} is not yet supported'.format(fu))
+
+    def _parse_bondtypes(self, fields, line, lineno):
+        ai, aj = fields[:2]
+        fu     = int(fields[2])
+        self._check_bond_func(fu)
+
+        bond = blocks.BondType('gromacs')
+        bond.atype1 = ai
+        bond.atype2 = aj
+
+        b0, kb = list(map(float, fields[3:5]))
+        bond.gromacs = {'param':{'kb':kb, 'b0':b0}, 'func':fu}
+
+        self.bondtypes.append(bond)
+        self._add_info(self, 'bondtypes', self.bondtypes)
+
+    def _parse_bonds(self, fields, line, lineno):
+        fu = int(fields[2])
+        self._check_bond_func(fu)
+        b0 = kb = NaN
+        if len(fields) > 3:
+            b0, kb = list(map(float, fields[3:5]))
+        self._append_record('bonds', (int(fields[0]) - 1, int(fields[1]) - 1, fu, b0, kb))
 
-                    # if the number of a molecule is more than 1, add copies to system.molecules
-                    for i in range(nmol):
-                        self.molecules.append(self.dict_molname_mol[mname])
+    @staticmethod
+    def _check_angle_func(fu):
+        '''
+        section     #at     fu      #param
+        ----------------------------------
+        angles      3       1       2
+        angles      3       2       2
+        angles      3       3       3
+        angles      3       4       4
+        angles      3       5       4
+        angles      3       6       6
+        angles      3       8       ??
+        '''
+        assert fu in (1,2,3,4,5,6,8)  # no 7
+        if fu not in (1,2,5):
+            raise NotImplementedError('function {0:d} is not yet supported'.format(fu))
+
+    def _parse_angletypes(self, fields, line, lineno):
+        ai, aj , ak = fields[:3]
+        fu          = int(fields[3])
+        self._check_angle_func(fu)
+
+        ang = blocks.AngleType('gromacs')
+        if fu == 1:
+            ang.atype1 = ai
+            ang.atype2 = aj
+            ang.atype3 = ak
+
+            tetha0, ktetha = list(map(float, fields[4:6]))
+            ang.gromacs = {'param':{'ktetha':ktetha, 'tetha0':tetha0, 'kub':None, 's0':None}, 'func':fu}
+
+        elif fu == 2:
+            raise NotImplementedError()
+
+        elif fu == 5:
+            ang.atype1 = ai
+            ang.atype2 = aj
+            ang.atype3 = ak
+            tetha0, ktetha, s0, kub = list(map(float, fields[4:8]))
+
+            ang.gromacs = {'param':{'ktetha':ktetha, 'tetha0':tetha0, 'kub':kub, 's0':s0}, 'func':fu}
+
+        self.angletypes.append(ang)
+        self._add_info(self, 'angletypes', self.angletypes)
+
+    def _parse_angles(self, fields, line, lineno):
+        fu = int(fields[3])
+        self._check_angle_func(fu)
+        tetha0 = ktetha = NaN
+        if fu == 2:
+            tetha0, ktetha = list(map(float, fields[4:6]))
+        self._append_record('angles', (int(fields[0]) - 1, int(fields[1]) - 1, int(fields[2]) - 1,
+                                       fu, tetha0, ktetha))
 
-                else:
-                    raise NotImplementedError('Unknown section in topology: {0}'.format(curr_sec))
+    @staticmethod
+    def _check_dihedral_func(fu):
+        '''
+        section     #at     fu      #param
+        ----------------------------------
+        dihedrals   4       1       3
+        dihedrals   4       2       2
+        dihedrals   4       3       6
+        dihedrals   4       4       3
+        dihedrals   4       5       4
+        dihedrals   4       8       ??
+        dihedrals   4       9       3
+        '''
+        assert fu in (1,2,3,4,5,8,9)
+        if fu not in (1,2,3,4,9):
+            raise NotImplementedError('dihedral function {0:d} is not yet supported'.format(fu))
+
+    def _parse_dihedraltypes(self, fields, line, lineno):
+        if len(fields) == 6:
+            # in oplsaa - quartz parameters
+            fields.insert(2, 'X')
+            fields.insert(0, 'X')
+
+        ai, aj, ak, am = fields[:4]
+        fu = int(fields[4])
+        self._check_dihedral_func(fu)
+
+        # proper dihedrals
+        if fu in (1,3,9):
+            dih = blocks.DihedralType('gromacs')
+            dih.atype1 = ai
+            dih.atype2 = aj
+            dih.atype3 = ak
+            dih.atype4 = am
+
+            dih.line = lineno
+            dih.source = self._source
+
+            if fu == 1:
+                delta, kchi, n = list(map(float, fields[5:8]))
+                dih.gromacs['param'].append({'kchi':kchi, 'n':n, 'delta':delta})
+            elif fu == 3:
+                c0, c1, c2, c3, c4, c5 = list(map(float, fields[5:11]))
+                m = dict(c0=c0, c1=c1, c2=c2, c3=c3, c4=c4, c5=c5)
+                dih.gromacs['param'].append(m)
+            elif fu == 9:
+                delta, kchi, n = list(map(float, fields[5:8]))
+                dih.gromacs['param'].append({'kchi':kchi, 'n':int(n), 'delta':delta})
+
+            dih.gromacs['func'] = fu
+            self.dihedraltypes.append(dih)
+            self._add_info(self, 'dihedraltypes', self.dihedraltypes)
+
+        # impropers
+        else:
+            imp = blocks.ImproperType('gromacs')
+            imp.atype1 = ai
+            imp.atype2 = aj
+            imp.atype3 = ak
+            imp.atype4 = am
+
+            imp.line = lineno
+            imp.source = self._source
+
+            if fu == 2:
+                psi0 , kpsi = list(map(float, fields[5:7]))
+                imp.gromacs['param'].append({'kpsi':kpsi, 'psi0': psi0})
+            elif fu == 4:
+                psi0 , kpsi, n = list(map(float, fields[5:8]))
+                imp.gromacs['param'].append({'kpsi':kpsi, 'psi0': psi0, 'n': int(n)})
+
+            imp.gromacs['func'] = fu
+            self.impropertypes.append(imp)
+            self._add_info(self, 'dihedraltypes', self.impropertypes)
+
+    def _parse_dihedrals(self, fields, line, lineno):
+        fu = int(fields[4])
+        self._check_dihedral_func(fu)
+        atoms = (int(fields[0]) - 1, int(fields[1]) - 1, int(fields[2]) - 1, int(fields[3]) - 1)
+
+        # proper dihedrals
+        if fu in (1,3,9):
+            delta = kchi = NaN
+            n = 0
+            if fu == 1:
+                delta, kchi, n = list(map(float, fields[5:8]))
+            elif fu == 9 and len(fields[5:8]) == 3:
+                delta, kchi, n = list(map(float, fields[5:8]))
+            self._append_record('dihedrals', atoms + (fu, delta, kchi, int(n), lineno))
+
+        # impropers
+        else:
+            psi0 = kpsi = NaN
+            n = 0
+            if fu == 4 and len(fields[5:8]) == 3:
+                # in-line override of dihedral parameters
+                psi0 , kpsi, n = list(map(float, fields[5:8]))
+            self._append_record('impropers', atoms + (fu, psi0, kpsi, int(n), lineno))
+
+    def _parse_cmaptypes(self, fields, line, lineno):
+        self._cmap_lines.append(line)
+        self._add_info(self, 'cmaptypes', self.cmaptypes)
+
+    def _parse_cmap(self, fields, line, lineno):
+        ai, aj, ak, am, an = list(map(int, fields[:5]))
+        fu = int(fields[5])
+        assert fu == 1
+        self._append_record('cmaps', (ai - 1, aj - 1, ak - 1, am - 1, an - 1, fu))
+
+    def _parse_settles(self, fields, line, lineno):
+        '''
+        section     #at     fu      #param
+        ----------------------------------
+        '''
+        assert len(fields) == 4
+        ai = int(fields[0])
+        fu = int(fields[1])
+        assert fu == 1
+        self._append_record('settles', (ai - 1, fu, float(fields[2]), float(fields[3])))
+
+    def _parse_virtual_sites3(self, fields, line, lineno):
+        '''
+            ; Dummy from            funct   a       b
+            4   1   2   3   1   0.131937768 0.131937768
+        '''
+        assert len(fields) == 7
+        ai = int(fields[0])
+        aj = int(fields[1])
+        ak = int(fields[2])
+        al = int(fields[3])
+        fu = int(fields[4])
+        assert fu == 1
+        a = float(fields[5])
+        b = float(fields[6])
+
+        vs3 = blocks.VirtualSites3Type('gromacs')
+        vs3.atom1 = ai
+        vs3.atom2 = aj
+        vs3.atom3 = ak
+        vs3.atom4 = al
+        vs3.gromacs['func'] = fu
+        vs3.gromacs['param'] = { 'a': a, 'b':b }
+        self._mol.virtual_sites3.append(vs3)
+        self._add_info(self._mol, 'virtual_sites3', self._mol.virtual_sites3)
+
+    def _parse_exclusions(self, fields, line, lineno):
+        self._append_record('exclusions', (int(fields[0]) - 1, [int(k) - 1 for k in fields[1:]]))
 
-        # process cmap_lines
+    @staticmethod
+    def _check_constraint_func(fu):
+        '''
+        section     #at     fu      #param
+        ----------------------------------
+        constraints 2       1       1
+        constraints 2       2       1
+        '''
+        # TODO: what's different between 1 and 2
+        assert fu in (1,2)
+
+    def _parse_constrainttypes(self, fields, line, lineno):
+        ai, aj = fields[:2]
+        fu = int(fields[2])
+        self._check_constraint_func(fu)
+
+        cons = blocks.ConstraintType('gromacs')
+        cons.atype1 = ai
+        cons.atype2 = aj
+        b0 = float(fields[3])
+        cons.gromacs = {'param':{'b0':b0}, 'func': fu}
+
+        self.constrainttypes.append(cons)
+        self._add_info(self, 'constrainttypes', self.constrainttypes)
+
+    def _parse_constraints(self, fields, line, lineno):
+        fu = int(fields[2])
+        self._check_constraint_func(fu)
+        self._append_record('constraints', (int(fields[0]) - 1, int(fields[1]) - 1, fu))
+
+    def _parse_system(self, fields, line, lineno):
+        #assert len(fields) == 1
+        self.name = fields[0]
+
+    def _parse_molecules(self, fields, line, lineno):
+        assert len(fields) == 2
+        self._finish_molecule()
+        mname, nmol = fields[0], int(fields[1])
+
+        # if the number of a molecule is more than 1, add copies to system.molecules
+        self.molecules.extend([self.dict_molname_mol[mname]] * nmol)
+
+    def _process_cmap_lines(self):
         curr_cons = None
-        for line in cmap_lines:
+        for line in self._cmap_lines:
 
             # cmaptype opening line
             if len(line.split()) == 8:
@@ -838,6 +1023,98 @@ class TOP(blocks.System):
             else:
                 raise ValueError
 
+class _ForceFieldRecord(object):
+    """Parameter types that were parsed from an included force field file."""
+    __slots__ = ('key', 'files', 'types', 'cmap_lines', 'defaults', 'sections',
+                 'information', 'defines', 'last_section')
+
+    def valid(self):
+        """``True`` if none of the files that the file includes changed."""
+        for path, mtime, size in self.files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if (stat.st_mtime, stat.st_size) != (mtime, size):
+                return False
+        return True
+
+
+class _ForceFieldRecording(object):
+    """Watch :class:`TOP` while it parses an included file.
+
+    The file can be cached if it starts with a section and only contains
+    the :attr:`TOP._forcefield_sections`.
+    """
+
+    def __init__(self, top, key, pp):
+        self.top = top
+        self.key = key
+        self.path = key[0]
+        self.pp = pp
+        self.files = []             # (path, mtime, size) of nested includes
+        self.cacheable = True
+        self.started = False
+        self.lengths = [(attr, len(getattr(top, attr))) for attr in top._forcefield_types]
+        self.ncmap_lines = len(top._cmap_lines)
+        self.nsections = len(top.found_sections)
+        self.information = set(top.information)
+        self.defaults = dict(top.defaults)
+
+    def section(self, section):
+        self.started = True
+        if section not in TOP._forcefield_sections:
+            self.cacheable = False
+
+    def data(self):
+        if not self.started:
+            # continues a section of the including file
+            self.cacheable = False
+            self.started = True
+
+    def finish(self):
+        """Return a :class:`_ForceFieldRecord` or ``None`` if the file cannot be cached."""
+        if not self.cacheable:
+            return None
+        top = self.top
+        record = _ForceFieldRecord()
+        record.key = self.key
+        record.files = self.files
+        # copies, so that changes to the types of top do not reach the cache
+        record.types = [(attr, [t.copy() for t in getattr(top, attr)[n:]])
+                        for attr, n in self.lengths if len(getattr(top, attr)) > n]
+        record.cmap_lines = top._cmap_lines[self.ncmap_lines:]
+        record.defaults = dict(top.defaults) if top.defaults != self.defaults else None
+        record.sections = top.found_sections[self.nsections:]
+        attrs = dict((id(getattr(top, attr)), attr) for attr in top._forcefield_types +
+                     ('cmaptypes',))
+        record.information = [(section, attrs[id(container)])
+                              for section, container in top.information.items()
+                              if section not in self.information]
+        record.defines = dict(self.pp.defines)
+        record.last_section = top._curr_sec if record.sections else None
+        return record
+
+
+_format_field = re.compile(r"\{\d*(?::(?P<align>[<>])?(?P<spec>[^}]*?)(?P<type>[sdg]?))?\}")
+
+def _printf_format(fmt):
+    """Convert a :meth:`str.format` format string into an equivalent printf-style format.
+
+    Only the fields used in :attr:`SystemToGroTop.formats` are supported.
+    """
+    def convert(match):
+        align, spec, ftype = match.group('align'), match.group('spec') or '', match.group('type')
+        if not ftype:
+            if spec and align is None:
+                raise ValueError("unsupported format field {0!r}".format(match.group(0)))
+            ftype = 's'
+        # strings are left-aligned and numbers right-aligned by default
+        left = align == '<' or (align is None and ftype == 's')
+        return '%' + ('-' if left and spec else '') + spec + ftype
+    return _format_field.sub(convert, fmt.replace('%', '%%'))
+
+
 class SystemToGroTop(object):
     """Converter class - represent TOP objects as GROMACS topology file."""
     formats = {
@@ -866,8 +1143,17 @@ class SystemToGroTop(object):
         'impropers'      : '{:3d} {:3d} {:3d} {:3d}   {:1d}\n',
         'impropers_2'  : '{:3d} {:3d} {:3d} {:3d}   {:1d} {} {} \n',
         'impropers_4'  : '{:3d} {:3d} {:3d} {:3d}   {:1d} {} {} {:2d}\n',
+        'cmaps'          : '{:5d} {:5d} {:5d} {:5d} {:5d}   {:d}\n',
     }
 
+    #: Number of terms that are formatted and written as one block.
+    chunksize = 10000
+
+    #: :attr:`formats` that are used for formatting blocks of terms.
+    _block_formats = ('atoms', 'atoms_nomass', 'pairs', 'bonds', 'bonds_ext', 'angles',
+                      'angles_ext', 'dihedrals', 'dihedrals_ext', 'impropers', 'impropers_4',
+                      'cmaps')
+
 
     toptemplate = """
             [ defaults ]
@@ -919,9 +1205,16 @@ class SystemToGroTop(object):
             """
     itptemplate = textwrap.dedent(itptemplate)
 
-    def __init__(self, system, outfile="output.top", multiple_output=False):
+    def __init__(self, system, outfile="output.top", multiple_output=False, workers=4):
         """Initialize GROMACS topology writer.
 
+        The topology is written section by section. Sections of bonded
+        terms that are still stored as :class:`~gromacs.fileformats.blocks.ParamArray`
+        (i.e., that were not accessed as lists of
+        :class:`~gromacs.fileformats.blocks.Param` instances) and the atoms of
+        a :class:`~gromacs.fileformats.blocks.AtomArray` are formatted in blocks
+        of :attr:`chunksize` lines.
+
         :Arguments:
           *system*
               :class:`blocks.System` object, containing the topology
@@ -929,6 +1222,12 @@ class SystemToGroTop(object):
               name of the file to write to
           *multiple_output*
               if True, write moleculetypes to separate files, named mol_MOLNAME.itp (default: False)
+          *workers*
+              number of threads that write the mol_MOLNAME.itp files of
+              *multiple_output* concurrently [4]
+
+        .. versionchanged:: 0.8.0
+           Added *workers*; sections are streamed to the output file.
         """
         self.logger = logging.getLogger('gromacs.fileformats.SystemToGroTop')
         self.logger.debug(">> entering SystemToGroTop")
@@ -936,6 +1235,9 @@ class SystemToGroTop(object):
         self.system   = system
         self.outfile = outfile
         self.multiple_output = multiple_output
+        self.workers = workers
+        self.printf_formats = dict((name, _printf_format(self.formats[name]))
+                                   for name in self._block_formats)
         self.assemble_topology()
 
         self.logger.debug("<< leaving SystemToGroTop")
@@ -946,63 +1248,196 @@ class SystemToGroTop(object):
         for i, atom in enumerate(mol.atoms):
             atom.atomtype = 'at{0:03d}'.format(i+1)
 
+    @staticmethod
+    def _write_template(out, template, sections):
+        """Write *template* to *out*, replacing placeholders by the lines from *sections*"""
+        for line in template.splitlines(True):
+            placeholder = line.strip()
+            if placeholder in sections:
+                out.writelines(sections[placeholder]())
+                line = line.replace(placeholder, '', 1)
+            out.write(line)
+
+    def _write_itp(self, out, molname, m):
+        """Write the moleculetype *m* to the open file *out*"""
+        sections = {
+            '*MOLECULETYPE*':  lambda: self._make_moleculetype(m, molname, m.exclusion_numb),
+            '*ATOMS*':         lambda: self._iter_atoms(m),
+            '*BONDS*':         lambda: self._iter_bonds(m),
+            '*PAIRS*':         lambda: self._iter_pairs(m),
+            '*SETTLES*':       lambda: self._make_settles(m),
+            '*VIRTUAL_SITES3*':lambda: self._make_virtual_sites3(m),
+            '*EXCLUSIONS*':    lambda: self._make_exclusions(m),
+            '*ANGLES*':        lambda: self._iter_angles(m),
+            '*DIHEDRALS*':     lambda: self._iter_dihedrals(m),
+            '*IMPROPERS*':     lambda: self._iter_impropers(m),
+            '*CMAPS*':         lambda: self._iter_cmaps(m),
+        }
+        self._write_template(out, self.itptemplate, sections)
+
+    def _write_itp_file(self, filename, molname, m):
+        with open(filename, "w") as f:
+            self._write_itp(f, molname, m)
+
     def assemble_topology(self):
-        """Call the various member self._make_* functions to convert the topology object into a string"""
+        """Call the various member self._make_* functions and write the topology to :attr:`outfile`"""
         self.logger.debug("starting to assemble topology...")
 
-        top = ''
-
-        self.logger.debug("making atom/pair/bond/angle/dihedral/improper types")
-        top += self.toptemplate
-        top = top.replace('*DEFAULTS*',       ''.join( self._make_defaults(self.system)) )
-        top = top.replace('*ATOMTYPES*',      ''.join( self._make_atomtypes(self.system)) )
-        top = top.replace('*NONBOND_PARAM*',  ''.join( self._make_nonbond_param(self.system)) )
-        top = top.replace('*PAIRTYPES*',      ''.join( self._make_pairtypes(self.system)) )
-        top = top.replace('*BONDTYPES*',      ''.join( self._make_bondtypes(self.system)) )
-        top = top.replace('*CONSTRAINTTYPES*',''.join( self._make_constrainttypes(self.system)))
-        top = top.replace('*ANGLETYPES*',     ''.join( self._make_angletypes(self.system)))
-        top = top.replace('*DIHEDRALTYPES*',  ''.join( self._make_dihedraltypes(self.system)) )
-        top = top.replace('*IMPROPERTYPES*',  ''.join( self._make_impropertypes(self.system)) )
-        top = top.replace('*CMAPTYPES*',      ''.join( self._make_cmaptypes(self.system)) )
-
-        for i,(molname,m) in enumerate(self.system.dict_molname_mol.items()):
-
-            itp = self.itptemplate
-            itp = itp.replace('*MOLECULETYPE*',  ''.join( self._make_moleculetype(m, molname, m.exclusion_numb))  )
-            itp = itp.replace('*ATOMS*',         ''.join( self._make_atoms(m))  )
-            itp = itp.replace('*BONDS*',         ''.join( self._make_bonds(m))  )
-            itp = itp.replace('*PAIRS*',         ''.join( self._make_pairs(m))  )
-            itp = itp.replace('*SETTLES*',       ''.join( self._make_settles(m))  )
-            itp = itp.replace('*VIRTUAL_SITES3*',''.join( self._make_virtual_sites3(m))  )
-            itp = itp.replace('*EXCLUSIONS*',    ''.join( self._make_exclusions(m))  )
-            itp = itp.replace('*ANGLES*',        ''.join( self._make_angles(m)) )
-            itp = itp.replace('*DIHEDRALS*',     ''.join( self._make_dihedrals(m)) )
-            itp = itp.replace('*IMPROPERS*',     ''.join( self._make_impropers(m)) )
-            itp = itp.replace('*CMAPS*',         ''.join( self._make_cmaps(m)) )
+        system = self.system
+        with open(self.outfile, 'w') as top:
+            self.logger.debug("making atom/pair/bond/angle/dihedral/improper types")
+            sections = {
+                '*DEFAULTS*':        lambda: self._make_defaults(system),
+                '*ATOMTYPES*':       lambda: self._make_atomtypes(system),
+                '*NONBOND_PARAM*':   lambda: self._make_nonbond_param(system),
+                '*PAIRTYPES*':       lambda: self._make_pairtypes(system),
+                '*BONDTYPES*':       lambda: self._make_bondtypes(system),
+                '*CONSTRAINTTYPES*': lambda: self._make_constrainttypes(system),
+                '*ANGLETYPES*':      lambda: self._make_angletypes(system),
+                '*DIHEDRALTYPES*':   lambda: self._make_dihedraltypes(system),
+                '*IMPROPERTYPES*':   lambda: self._make_impropertypes(system),
+                '*CMAPTYPES*':       lambda: self._make_cmaptypes(system),
+            }
+            self._write_template(top, self.toptemplate, sections)
+
             if not self.multiple_output:
-                top += itp
+                for molname, m in system.dict_molname_mol.items():
+                    self._write_itp(top, molname, m)
             else:
-                outfile = "mol_{0}.itp".format(molname)
-                top += '#include "mol_{0}.itp" \n'.format( molname )
-                with open(outfile, "w") as f:
-                    f.writelines([itp])
-
-        top += '\n[system]  \nConvertedSystem\n\n'
-        top += '[molecules] \n'
-        molecules = [("", 0)]
-
-        for m in self.system.molecules:
-            if (molecules[-1][0] != m.name):
-                molecules.append([m.name, 0])
-            if molecules[-1][0] == m.name:
-                molecules[-1][1] += 1
-
-        for molname, n in molecules[1:]:
-            top += '{0:s}     {1:d}\n'.format(molname, n)
-        top += '\n'
+                with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+                    itps = []
+                    for molname, m in system.dict_molname_mol.items():
+                        outfile = "mol_{0}.itp".format(molname)
+                        top.write('#include "mol_{0}.itp" \n'.format( molname ))
+                        itps.append(executor.submit(self._write_itp_file, outfile, molname, m))
+                    for itp in itps:
+                        itp.result()     # raise any exception from writing the itp file
+
+            top.write('\n[system]  \nConvertedSystem\n\n')
+            top.write('[molecules] \n')
+            molecules = [("", 0)]
+
+            for m in system.molecules:
+                if (molecules[-1][0] != m.name):
+                    molecules.append([m.name, 0])
+                if molecules[-1][0] == m.name:
+                    molecules[-1][1] += 1
+
+            for molname, n in molecules[1:]:
+                top.write('{0:s}     {1:d}\n'.format(molname, n))
+            top.write('\n')
+
+    def _iter_blocks(self, nrows, columns, fmt, ext_fmt=None, extended=None):
+        """Format rows of *columns* in blocks of :attr:`chunksize` lines.
+
+        All rows are formatted with the printf-style format *fmt*. If
+        *ext_fmt* is given then rows with a true value in the boolean array
+        *extended* are formatted with *ext_fmt* and all columns, the other
+        rows with *fmt* and only the first columns.
+        """
+        nplain = fmt.count('%')
+        for start in range(0, nrows, self.chunksize):
+            chunk = slice(start, start + self.chunksize)
+            rows = list(zip(*[c[chunk].tolist() for c in columns]))
+            if ext_fmt is None:
+                yield (fmt * len(rows)) % tuple(itertools.chain.from_iterable(rows))
+            else:
+                ext = extended[chunk].tolist()
+                block = ''.join([ext_fmt if e else fmt for e in ext])
+                values = itertools.chain.from_iterable(
+                    row if e else row[:nplain] for row, e in zip(rows, ext))
+                yield block % tuple(values)
+
+    def _terms(self, m, section):
+        """Return atom numbers and array of a section stored as a ParamArray (or ``None``)"""
+        terms = m.param_array(section)
+        if terms is None or not isinstance(m.atoms, blocks.AtomArray):
+            return None
+        numbers = m.atoms.array['number']
+        return [numbers[terms.array[field]] for field in terms.atom_fields], terms.array
 
-        with open(self.outfile, 'w') as f:
-            f.writelines([top])
+    @staticmethod
+    def _nonzero(*columns):
+        # like "if kb and b0" for parameters that are NaN when missing
+        selected = np.ones(len(columns[0]), dtype=bool)
+        for c in columns:
+            selected &= ~np.isnan(c) & (c != 0)
+        return selected
+
+    def _iter_atoms(self, m):
+        if not isinstance(m.atoms, blocks.AtomArray):
+            return self._make_atoms(m)
+        a = m.atoms.array
+        lines = self._iter_blocks(len(a),
+                                  [a['number'], a['atomtype'], a['resnumb'], a['resname'],
+                                   a['name'], a['number'], a['charge'], a['mass']],
+                                  self.printf_formats['atoms_nomass'],
+                                  self.printf_formats['atoms'], ~np.isnan(a['mass']))
+        return itertools.chain(['; {0:5d} atoms\n'.format(len(a))], lines)
+
+    def _iter_pairs(self, m):
+        terms = self._terms(m, 'pairs')
+        if terms is None:
+            return self._make_pairs(m)
+        atoms, a = terms
+        fu = np.ones(len(a), dtype=int)
+        lines = self._iter_blocks(len(a), atoms + [fu], self.printf_formats['pairs'])
+        return itertools.chain(['; {0:5d} pairs\n'.format(len(a))], lines)
+
+    def _iter_bonds(self, m):
+        terms = self._terms(m, 'bonds')
+        if terms is None:
+            return self._make_bonds(m)
+        atoms, a = terms
+        lines = self._iter_blocks(len(a), atoms + [a['func'], a['b0'], a['kb']],
+                                  self.printf_formats['bonds'], self.printf_formats['bonds_ext'],
+                                  self._nonzero(a['kb'], a['b0']))
+        return itertools.chain(['; {0:5d} bonds\n'.format(len(a))], lines)
+
+    def _iter_angles(self, m):
+        terms = self._terms(m, 'angles')
+        if terms is None:
+            return self._make_angles(m)
+        atoms, a = terms
+        lines = self._iter_blocks(len(a), atoms + [a['func'], a['tetha0'], a['ktetha']],
+                                  self.printf_formats['angles'], self.printf_formats['angles_ext'],
+                                  self._nonzero(a['ktetha'], a['tetha0']))
+        return itertools.chain(['; {0:5d} angles\n'.format(len(a))], lines)
+
+    def _iter_dihedrals(self, m):
+        terms = self._terms(m, 'dihedrals')
+        if terms is None:
+            return self._make_dihedrals(m)
+        atoms, a = terms
+        columns = atoms + [a['func'], a['delta'], a['kchi'], a['n']]
+        fmt, ext_fmt = self.printf_formats['dihedrals'], self.printf_formats['dihedrals_ext']
+        comments = m.param_array('dihedrals').comments
+        if comments is not None:
+            # like _make_dihedrals: comments only precede lines with parameters
+            columns.insert(0, comments)
+            fmt, ext_fmt = '%.0s' + fmt, '%s' + ext_fmt
+        lines = self._iter_blocks(len(a), columns, fmt, ext_fmt, ~np.isnan(a['kchi']))
+        return itertools.chain(['; {0:5d} dihedrals\n'.format(len(a))], lines)
+
+    def _iter_impropers(self, m):
+        terms = self._terms(m, 'impropers')
+        if terms is None:
+            return self._make_impropers(m)
+        atoms, a = terms
+        # parameters in the [ dihedrals ] section are only stored for function 4
+        lines = self._iter_blocks(len(a), atoms + [a['func'], a['psi0'], a['kpsi'], a['n']],
+                                  self.printf_formats['impropers'],
+                                  self.printf_formats['impropers_4'], ~np.isnan(a['kpsi']))
+        return itertools.chain(['; {0:5d} impropers\n'.format(len(a))], lines)
+
+    def _iter_cmaps(self, m):
+        terms = self._terms(m, 'cmaps')
+        if terms is None:
+            return self._make_cmaps(m)
+        atoms, a = terms
+        fu = np.ones(len(a), dtype=int)
+        lines = self._iter_blocks(len(a), atoms + [fu], self.printf_formats['cmaps'])
+        return itertools.chain(['; {0:5d} cmaps\n'.format(len(a))], lines)
 
     def _make_defaults(self,m):
         if m.defaults['gen-pairs'] and m.defaults['fudgeLJ']and m.defaults['fudgeQQ']:
@@ -1353,7 +1788,7 @@ class SystemToGroTop(object):
 
         for cmap in m.cmaps:
             fu = 1
-            line = '{0:5d} {1:5d} {2:5d} {3:5d} {4:5d}   {5:d}\n'.format(
+            line = self.formats['cmaps'].format(
                 cmap.atom1.number, cmap.atom2.number, cmap.atom3.number, cmap.atom4.number,
                 cmap.atom8.number, fu)
             result.append(line)
@@ -0,0 +1,268 @@
+# GromacsWrapper: resultcache.py
+# Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+"""
+:mod:`gromacs.resultcache` -- Re-use results of Gromacs tools
+============================================================
+
+Analysis tools such as :program:`gmx rms` or :program:`gmx energy` are
+often run again on exactly the same inputs, e.g. when a notebook is
+re-executed. With the :mod:`gromacs.environment` flag ``result_cache``
+(or the *cache* keyword of a :class:`~gromacs.core.GromacsCommand`) ::
+
+   gromacs.environment.flags['result_cache'] = True
+   gromacs.rms(s="md.tpr", f="md.xtc", o="rmsd.xvg", input=["Backbone", "Backbone"])
+
+the output files and the captured output of a successful invocation are
+stored in a cache directory (``flags['result_cache_dir']``, by default
+``results`` in :data:`gromacs.config.configdir`). The next invocation with
+the same :func:`key` copies the stored output files into place instead of
+running the tool again.
+
+The key is a hash over the complete command line (including the options
+fixed with :meth:`~gromacs.core.GromacsCommand.bind`), the input (STDIN),
+the working directory and the path, size and modification time of every
+input file, i.e. every existing file on the command line that is not an
+output. Outputs are the files of options that start with "o" (such as
+``-o`` or ``-oh``) and all other files on the command line that the tool
+wrote in an earlier run of the same command line (such as ``-e``, ``-g``
+or ``-cpo``); these are remembered in the cache. Files that a tool writes
+under a default name (i.e. without naming them on the command line) are
+not restored.
+
+When the size of the cache exceeds ``flags['result_cache_size']`` bytes
+the least recently used results are removed.
+
+.. autofunction:: key
+.. autofunction:: run
+.. autofunction:: cachedir
+.. autofunction:: evict
+.. autofunction:: clear
+
+.. versionadded:: 0.8.0
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import logging
+from subprocess import PIPE
+
+import six
+
+from . import config
+from . import environment
+from . import utilities
+
+logger = logging.getLogger('gromacs.resultcache')
+
+#: Version of the cache format; results of other versions are not used.
+CACHE_VERSION = 1
+
+def cachedir():
+    """Return the directory of the cache (``flags['result_cache_dir']``)."""
+    return environment.flags['result_cache_dir'] or os.path.join(config.configdir, 'results')
+
+
+def _filenames(value):
+    if isinstance(value, six.string_types):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [v for v in value if isinstance(v, six.string_types)]
+    return []
+
+
+def _is_output(option):
+    return str(option).lstrip('_-').startswith('o')
+
+
+def _signature(filename):
+    st = os.stat(filename)
+    return [os.path.realpath(filename), st.st_size, st.st_mtime]
+
+
+def _invocation(command, gmxargs):
+    # hash of the command line and the names of all files on it
+    options = dict((name, value) for name, value in gmxargs.items()
+                   if name not in command.run_keywords)
+    argv = command._commandline(**options)      # includes options fixed with bind()
+    files = []
+    for option, value in list(command._bound_options.items()) + list(options.items()):
+        files.extend((option, filename) for filename in _filenames(value))
+    h = hashlib.sha1()
+    h.update(json.dumps([CACHE_VERSION, argv, repr(gmxargs.get('input')),
+                         os.getcwd()]).encode('utf-8'))
+    return h.hexdigest(), files
+
+
+def _outputs_file(invocation):
+    return os.path.join(cachedir(), '.outputs', invocation + '.json')
+
+
+def _known_outputs(invocation):
+    try:
+        with open(_outputs_file(invocation)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def _remember_outputs(invocation, outputs):
+    known = _known_outputs(invocation)
+    if set(outputs) <= set(known):      # also no outputs
+        return
+    filename = _outputs_file(invocation)
+    try:
+        utilities.mkdir_p(os.path.dirname(filename))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(sorted(set(known) | set(outputs)), f)
+        os.rename(tmp, filename)
+    except (IOError, OSError) as err:
+        logger.warning("failed to store output files in cache %r: %s", filename, err)
+
+
+def key(command, gmxargs):
+    """Return the key for running *command* with the options *gmxargs*.
+
+    *gmxargs* are the combined options of the command (as returned by
+    :meth:`~gromacs.core.GromacsCommand._combine_arglist`); options that
+    were fixed with :meth:`~gromacs.core.GromacsCommand.bind` are included.
+
+    :Returns: ``(key, filenames)`` with the hexdigest *key* and the list of
+              the names of all files on the command line
+    """
+    invocation, files = _invocation(command, gmxargs)
+    outputs = _known_outputs(invocation)
+    inputs = [_signature(filename) for option, filename in files
+              if not _is_output(option) and filename not in outputs and os.path.isfile(filename)]
+    h = hashlib.sha1()
+    h.update(json.dumps([invocation, command.driver, command.command_name,
+                         sorted(inputs)]).encode('utf-8'))
+    return h.hexdigest(), sorted(set(filename for option, filename in files))
+
+
+def _record_file(entry):
+    return os.path.join(entry, 'record.json')
+
+
+def _lookup(entry, gmxargs):
+    try:
+        with open(_record_file(entry)) as f:
+            record = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    # output that the caller wants to analyze must have been captured previously
+    for stream in ('stdout', 'stderr'):
+        if gmxargs.get(stream) in (False, PIPE) and record.get(stream) is None:
+            return None
+    return record
+
+
+def _restore(entry, record):
+    for i, filename in enumerate(record['outputs']):
+        utilities.mkdir_p(os.path.dirname(os.path.abspath(filename)))
+        shutil.copyfile(os.path.join(entry, str(i)), filename)
+    os.utime(_record_file(entry), None)     # most recently used
+
+
+def _store(entry, record, outputs):
+    utilities.mkdir_p(cachedir())
+    tmpdir = tempfile.mkdtemp(dir=cachedir(), prefix='.tmp')
+    try:
+        for i, filename in enumerate(outputs):
+            shutil.copyfile(filename, os.path.join(tmpdir, str(i)))
+        with open(_record_file(tmpdir), 'w') as f:
+            json.dump(record, f)
+        if os.path.exists(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmpdir, entry)
+    except (IOError, OSError) as err:
+        logger.warning("failed to store result in cache %r: %s", entry, err)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run(command, args, gmxargs):
+    """Run *command* with the combined arguments *args* and *gmxargs* or re-use its cached result.
+
+    :Returns: the *results* tuple ``(rc, stdout, stderr)``
+    """
+    digest, filenames = key(command, gmxargs)
+    entry = os.path.join(cachedir(), digest)
+    record = _lookup(entry, gmxargs)
+    if record is not None:
+        try:
+            _restore(entry, record)
+        except (IOError, OSError) as err:
+            logger.warning("failed to restore cached result %r: %s", entry, err)
+        else:
+            logger.info("%s: inputs unchanged, re-using cached result %s",
+                        command.command_name, digest)
+            return 0, record['stdout'], record['stderr']
+
+    before = dict((fn, _signature(fn)) for fn in filenames if os.path.isfile(fn))
+    (rc, out, err), p = command._run_command(*args, **gmxargs)
+    if rc == 0:
+        # outputs: files that the tool (re)wrote; they are not inputs of
+        # later invocations of the same command line
+        outputs = [fn for fn in filenames if os.path.isfile(fn) and
+                   before.get(fn) != _signature(fn)]
+        invocation, files = _invocation(command, gmxargs)
+        _remember_outputs(invocation, [filename for option, filename in files
+                                       if not _is_output(option) and filename in outputs])
+        digest, filenames = key(command, gmxargs)
+        record = {'command': p.command,
+                  'outputs': outputs,
+                  'stdout': out,
+                  'stderr': err,
+                  }
+        _store(os.path.join(cachedir(), digest), record, outputs)
+        evict()
+    return rc, out, err
+
+
+def _entries():
+    entries = []
+    try:
+        names = os.listdir(cachedir())
+    except OSError:
+        return entries
+    for name in names:
+        if name.startswith('.'):
+            continue            # incomplete
+        entry = os.path.join(cachedir(), name)
+        try:
+            mtime = os.stat(_record_file(entry)).st_mtime
+        except OSError:
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, fn)) for fn in os.listdir(entry))
+        entries.append((mtime, size, entry))
+    return entries
+
+
+def evict(maxsize=None):
+    """Remove the least recently used results until the cache is smaller than *maxsize* bytes.
+
+    *maxsize* defaults to ``flags['result_cache_size']``.
+    """
+    if maxsize is None:
+        maxsize = environment.flags['result_cache_size']
+    entries = sorted(_entries())
+    total = sum(size for mtime, size, entry in entries)
+    for mtime, size, entry in entries:
+        if total <= maxsize:
+            break
+        logger.debug("removing cached result %r (%d bytes)", entry, size)
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def clear():
+    """Remove all cached results."""
+    evict(0)
+    shutil.rmtree(os.path.join(cachedir(), '.outputs'), ignore_errors=True)
@@ -15,88 +15,213 @@ Helper functions for scaling gromacs topologies; useful for setting up
 simulations with Hamiltonian replicate exchange and partial tempering
 (REST2).
 
+.. autoclass:: DihedralTypeResolver
+   :members:
 .. autofunction:: scale_dihedrals
 .. autofunction:: scale_impropers
 .. autofunction:: partial_tempering
+.. autoclass:: PartialTempering
+   :members:
+.. autofunction:: geometric_scales
 
 """
 from __future__ import absolute_import, division, print_function
 
+import os
 import math
 import copy
+import time
 import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
+import six
+from six.moves import cPickle as pickle
 
 from .fileformats import TOP
 from .fileformats import blocks
 
 logger = logging.getLogger("gromacs.scaling")
 
-def scale_dihedrals(mol, dihedrals, scale, banned_lines=None):
-        """Scale dihedral angles"""
+class DihedralTypeResolver(object):
+        """Find the dihedral (or improper) types that apply to the atom types of a term.
+
+        Atom types are matched like :program:`grompp` does, in forward and
+        reverse order and with ``X`` wildcards (see
+        :class:`~gromacs.fileformats.blocks.TypeIndex`); the scaling group
+        markers (``_`` and ``=``) are removed from the atom types first.
+        Every distinct combination of atom types and function type is only
+        resolved once, so a resolver should be re-used for all molecules
+        and scale factors of a topology::
+
+           resolver = DihedralTypeResolver(top.dihedraltypes)
+           for mol in molecules:
+                   scale_dihedrals(mol, resolver, scale)
+
+        .. versionadded:: 0.8.0
+        """
+        def __init__(self, types, markers=("_", "=")):
+                """Index *types*.
+
+                :Arguments:
+                  *types*
+                      list of dihedral or improper types or a dict of lists of
+                      types such as the one that :func:`scale_dihedrals` takes
+                  *markers*
+                      characters that are removed from atom types before they
+                      are matched
+                """
+                if isinstance(types, dict):
+                        types = [t for key in types for t in types[key]]
+                self.index = blocks.TypeIndex(types, ('atype1', 'atype2', 'atype3', 'atype4'),
+                                              wildcard='X')
+                self.markers = markers
+                self._resolved = {}     # (atype1, ..., atype4, func): [types]
+
+        def _strip(self, atype):
+                for marker in self.markers:
+                        atype = atype.replace(marker, "")
+                return atype
+
+        def lookup(self, atypes, func):
+                """Return the list of types for the atom types *atypes* and function *func*.
+
+                The list is empty if no type matches; it is the same list
+                object for all terms that match the same types.
+                """
+                key = tuple(atypes) + (func,)
+                try:
+                        return self._resolved[key]
+                except KeyError:
+                        types = self._resolved[key] = self.index.lookup(
+                                [self._strip(a) for a in atypes], func)
+                        return types
+
+
+def _resolver(types):
+        return types if isinstance(types, DihedralTypeResolver) else DihedralTypeResolver(types)
+
+
+def _banned_lines(banned_lines, source=None):
+        """Return *banned_lines* as a set of ``(path, line)`` pairs and line numbers
+
+        Line numbers without a path refer to the file *source* or, if
+        *source* is ``None``, are kept as numbers that match types from
+        any file.
+        """
+        banned = set()
+        for line in banned_lines or []:
+                if isinstance(line, tuple):
+                        path, line = line
+                        banned.add((os.path.realpath(path), line))
+                elif source is not None:
+                        banned.add((source, line))
+                else:
+                        banned.add(line)
+        return banned
+
+
+def _is_banned(t, banned):
+        """Return ``True`` if the type *t* was read from one of the *banned* lines"""
+        return (t.source, t.line) in banned or t.line in banned
+
+
+def _format_banned_lines(banned_lines):
+        return " ".join("{0}:{1}".format(*line) if isinstance(line, tuple) else str(line)
+                        for line in banned_lines)
+
+
+def _parse_banned_lines(banned_lines):
+        """Return the list of *banned_lines* from a string ``"12 ffbonded.itp:34"``"""
+        parsed = []
+        for line in banned_lines.split():
+                path, sep, number = line.rpartition(':')
+                parsed.append((path, int(number)) if sep else int(number))
+        return parsed
+
+
+def scale_dihedrals(mol, dihedrals, scale, banned_lines=None, source=None):
+        """Scale dihedral angles
+
+        *dihedrals* is a dict of the dihedral types keyed by
+        ``"atype1-atype2-atype3-atype4-func"`` or a
+        :class:`DihedralTypeResolver`, which should be used when the
+        dihedrals of several molecules or for several scale factors are
+        scaled.
+
+        Dihedral types on the *banned_lines* are not scaled. A banned line is
+        a line number or a ``(path, line)`` pair. Line numbers refer to the
+        file *source* (a real path, see
+        :attr:`~gromacs.fileformats.blocks.Param.source`) or, without
+        *source*, to the line of a type in whatever file it was read from.
+
+        .. versionchanged:: 0.8.0
+           *dihedrals* can be a :class:`DihedralTypeResolver`; added
+           keyword *source*.
+        """
 
         if banned_lines is None:
                 banned_lines = []
+        banned = _banned_lines(banned_lines, source)
+        resolver = _resolver(dihedrals)
         new_dihedrals = []
+        scaled_params = {}  # id of types: scaled parameters of the dihedral types, shared by all copies
         for dh in mol.dihedrals:
-                atypes = dh.atom1.get_atomtype(), dh.atom2.get_atomtype(), dh.atom3.get_atomtype(), dh.atom4.get_atomtype()
-                atypes = [a.replace("_", "").replace("=","") for a in atypes]
-
                 # special-case: this is a [ dihedral ] override in molecule block, continue and don't match
                 if dh.gromacs['param'] != []:
                     for p in dh.gromacs['param']:
-                        p['kch'] *= scale
+                        p['kchi'] *= scale
                     new_dihedrals.append(dh)
                     continue
 
-                for iswitch in range(32):
-                        if  (iswitch%2==0 ):
-                                a1=atypes[0]; a2=atypes[1]; a3=atypes[2]; a4=atypes[3]
-                        else:
-                                a1=atypes[3]; a2=atypes[2]; a3=atypes[1]; a4=atypes[0]
-
-                        if((iswitch//2)%2==1): a1="X";
-                        if((iswitch//4)%2==1): a2="X";
-                        if((iswitch//8)%2==1): a3="X";
-                        if((iswitch//16)%2==1): a4="X";
-                        key = "{0}-{1}-{2}-{3}-{4}".format(a1, a2, a3, a4, dh.gromacs['func'])
-                        if (key in dihedrals):
-                                for i, dt in enumerate(dihedrals[key]):
-                                        dhA = copy.deepcopy(dh)
-                                        param = copy.deepcopy(dt.gromacs['param'])
-                                        # Only check the first dihedral in a list
-                                        if not dihedrals[key][0].line in banned_lines:
-                                                for p in param: p['kchi'] *= scale
-                                        dhA.gromacs['param'] = param
-                                        #if key == "CT3-C-NH1-CT1-9": print i, dt, key
-                                        if i == 0:
-                                                dhA.comment = "; banned lines {0} found={1}\n".format(" ".join(
-                                                        map(str, banned_lines)), 1 if dt.line in banned_lines else 0)
-                                                dhA.comment += "; parameters for types {}-{}-{}-{}-9 at LINE({})\n".format(
-                                                        dhA.atom1.atomtype, dhA.atom2.atomtype, dhA.atom3.atomtype,
-                                                        dhA.atom4.atomtype, dt.line).replace("_","")
-                                        name = "{}-{}-{}-{}-9".format(dhA.atom1.atomtype, dhA.atom2.atomtype,
-                                                                      dhA.atom3.atomtype, dhA.atom4.atomtype).replace("_","")
-                                        #if name == "CL-CTL2-CTL2-HAL2-9": print dihedrals[key], key
-                                        new_dihedrals.append(dhA)
-                                break
-
+                types = resolver.lookup((dh.atom1.get_atomtype(), dh.atom2.get_atomtype(),
+                                         dh.atom3.get_atomtype(), dh.atom4.get_atomtype()),
+                                        dh.gromacs['func'])
+                if not types:
+                        continue
+                key = id(types)
+                if key not in scaled_params:
+                        scaled_params[key] = []
+                        for dt in types:
+                                param = copy.deepcopy(dt.gromacs['param'])
+                                # Only check the first dihedral in a list
+                                if not _is_banned(types[0], banned):
+                                        for p in param: p['kchi'] *= scale
+                                scaled_params[key].append(param)
+                for i, dt in enumerate(types):
+                        dhA = dh.copy(param=scaled_params[key][i])
+                        if i == 0:
+                                dhA.comment = "; banned lines {0} found={1}\n".format(
+                                        _format_banned_lines(banned_lines),
+                                        1 if _is_banned(dt, banned) else 0)
+                                dhA.comment += "; parameters for types {}-{}-{}-{}-9 at LINE({})\n".format(
+                                        dhA.atom1.atomtype, dhA.atom2.atomtype, dhA.atom3.atomtype,
+                                        dhA.atom4.atomtype, dt.line).replace("_","")
+                        new_dihedrals.append(dhA)
 
         mol.dihedrals = new_dihedrals
-        #assert(len(mol.dihedrals) == new_dihedrals)
         return mol
 
-def scale_impropers(mol, impropers, scale, banned_lines=None):
-        """Scale improper dihedrals"""
+def scale_impropers(mol, impropers, scale, banned_lines=None, source=None):
+        """Scale improper dihedrals
+
+        *impropers* is a dict of the improper types keyed by
+        ``"atype1-atype2-atype3-atype4-func"`` or a
+        :class:`DihedralTypeResolver` of the improper types. *banned_lines*
+        and *source* are used as in :func:`scale_dihedrals`.
+
+        .. versionchanged:: 0.8.0
+           *impropers* can be a :class:`DihedralTypeResolver`; added
+           keyword *source*.
+        """
         if banned_lines is None:
                 banned_lines = []
+        banned = _banned_lines(banned_lines, source)
+        resolver = _resolver(impropers)
         new_impropers = []
+        scaled_params = {}  # id of types: scaled parameters of the improper types, shared by all copies
         for im in mol.impropers:
-                atypes = (im.atom1.get_atomtype(), im.atom2.get_atomtype(),
-                          im.atom3.get_atomtype(), im.atom4.get_atomtype())
-                atypes = [a.replace("_", "").replace("=", "") for a in atypes]
-
                 # special-case: this is a [ dihedral ] override in molecule block, continue and don't match
                 if im.gromacs['param'] != []:
                     for p in im.gromacs['param']:
@@ -104,32 +229,28 @@ def scale_impropers(mol, impropers, scale, banned_lines=None):
                     new_impropers.append(im)
                     continue
 
-                for iswitch in range(32):
-                        if  (iswitch%2==0):
-                                a1=atypes[0]; a2=atypes[1]; a3=atypes[2]; a4=atypes[3];
-                        else:
-                                a1=atypes[3]; a2=atypes[2]; a3=atypes[1]; a4=atypes[0];
-                        if((iswitch//2)%2==1): a1="X";
-                        if((iswitch//4)%2==1): a2="X";
-                        if((iswitch//8)%2==1): a3="X";
-                        if((iswitch//16)%2==1): a4="X";
-                        key = "{0}-{1}-{2}-{3}-{4}".format(a1, a2, a3, a4, im.gromacs['func'])
-                        if (key in impropers):
-                                for i, imt in enumerate(impropers[key]):
-                                        imA = copy.deepcopy(im)
-                                        param = copy.deepcopy(imt.gromacs['param'])
-                                        # Only check the first dihedral in a list
-                                        if not impropers[key][0].line in banned_lines:
-                                                for p in param: p['kpsi'] *= scale
-                                        imA.gromacs['param'] = param
-                                        if i == 0:
-                                                imA.comment = "; banned lines {0} found={1}\n ; parameters for types {2}-{3}-{4}-{5}-9 at LINE({6})\n".format(
-                                                        " ".join(map(str, banned_lines)),
-                                                        1 if imt.line in banned_lines else 0,
-                                                        imt.atype1, imt.atype2, imt.atype3, imt.atype4, imt.line)
-                                        new_impropers.append(imA)
-                                break
-        #assert(len(mol.impropers) == new_impropers)
+                types = resolver.lookup((im.atom1.get_atomtype(), im.atom2.get_atomtype(),
+                                         im.atom3.get_atomtype(), im.atom4.get_atomtype()),
+                                        im.gromacs['func'])
+                if not types:
+                        continue
+                key = id(types)
+                if key not in scaled_params:
+                        scaled_params[key] = []
+                        for imt in types:
+                                param = copy.deepcopy(imt.gromacs['param'])
+                                # Only check the first dihedral in a list
+                                if not _is_banned(types[0], banned):
+                                        for p in param: p['kpsi'] *= scale
+                                scaled_params[key].append(param)
+                for i, imt in enumerate(types):
+                        imA = im.copy(param=scaled_params[key][i])
+                        if i == 0:
+                                imA.comment = "; banned lines {0} found={1}\n ; parameters for types {2}-{3}-{4}-{5}-9 at LINE({6})\n".format(
+                                        _format_banned_lines(banned_lines),
+                                        1 if _is_banned(imt, banned) else 0,
+                                        imt.atype1, imt.atype2, imt.atype3, imt.atype4, imt.line)
+                        new_impropers.append(imA)
         mol.impropers = new_impropers
         return mol
 
@@ -138,129 +259,299 @@ def partial_tempering(topfile="processed.top", outfile="scaled.top", banned_line
                       scale_lipids=1.0, scale_protein=1.0):
         """Set up topology for partial tempering (REST2) replica exchange.
 
+        See :class:`PartialTempering` for writing the topologies of many
+        replicas and for the format of *banned_lines*.
 
         .. versionchanged:: 0.7.0
            Use keyword arguments instead of an `args` Namespace object.
         """
+        rest2 = PartialTempering(topfile, banned_lines=banned_lines)
+        rest2.write(outfile, scale_protein=float(scale_protein), scale_lipids=float(scale_lipids))
+
+
+class PartialTempering(object):
+        """Scale a topology for partial tempering (REST2) replica exchange.
+
+        The topology is prepared once: copies of the atom, pair, bond,
+        angle and cmap types are created for the protein (``_``) and lipid
+        (``=``) scaling groups, the dihedral types are disabled and the
+        dihedrals of all molecules with "Protein" in their name get
+        explicit parameters. The parameters that depend on the scale
+        factors (the LJ epsilons of the atom and pair types, the cmap
+        grids, the protein charges and dihedral force constants) are kept
+        as arrays so that each replica only has to scale these columns
+        before its topology is written.
+
+        Example::
 
-        banned_lines = map(int, banned_lines.split())
-        top = TOP(topfile)
-        groups = [("_", float(scale_protein)), ("=", float(scale_lipids))]
-
-        #
-        # CMAPTYPES
-        #
-        cmaptypes = []
-        for ct in top.cmaptypes:
-                cmaptypes.append(ct)
-                for gr, scale in groups:
-                        ctA = copy.deepcopy(ct)
-                        ctA.atype1 += gr
-                        ctA.atype2 += gr
-                        ctA.atype3 += gr
-                        ctA.atype4 += gr
-                        ctA.atype8 += gr
-                        ctA.gromacs['param'] = [ v*scale for v in ct.gromacs['param'] ]
-                        cmaptypes.append(ctA)
-        logger.debug("cmaptypes was {0}, is {1}".format(len(top.cmaptypes), len(cmaptypes)))
-        top.cmaptypes = cmaptypes
-
-
-        #
-        # ATOMTYPES
-        #
-        atomtypes = []
-        for at in top.atomtypes:
-                atomtypes.append(at)
-                for gr, scale in groups:
-                        atA = copy.deepcopy(at)
-                        atA.atnum = atA.atype
-                        atA.atype += gr
-                        atA.gromacs['param']['lje'] *= scale
-                        atomtypes.append(atA)
-        top.atomtypes = atomtypes
-
-        #
-        # PAIRTYPES
-        #
-        pairtypes = []
-        for pt in top.pairtypes:
-                pairtypes.append(pt)
-                for gr, scale in groups:
-                        ptA = copy.deepcopy(pt)
-                        ptA.atype1 += gr
-                        ptA.atype2 += gr
-                        ptA.gromacs['param']['lje14'] *= scale
-
-                        pairtypes.append(ptA)
-        top.pairtypes = pairtypes
-
-        #
-        # BONDTYPES
-        #
-        bondtypes = []
-        for bt in top.bondtypes:
-                bondtypes.append(bt)
-                for gr, scale in groups:
-                        btA = copy.deepcopy(bt)
-                        btA.atype1 += gr
-                        btA.atype2 += gr
-                        bondtypes.append(btA)
-        top.bondtypes = bondtypes
-
-
-        #
-        # ANGLETYPES
-        #
-        angletypes = []
-        for at in top.angletypes:
-                angletypes.append(at)
-                for gr, scale in groups:
-                        atA = copy.deepcopy(at)
-                        atA.atype1 += gr
-                        atA.atype2 += gr
-                        atA.atype3 += gr
-                        angletypes.append(atA)
-        top.angletypes = angletypes
-
-        #
-        # Build dihedral dictionary
-        #
-        dihedraltypes = {}
-        for dt in top.dihedraltypes:
-                dt.disabled = True
-                dt.comment = "; type={0!s}-{1!s}-{2!s}-{3!s}-9\n; LINE({4:d}) ".format(
-                        dt.atype1, dt.atype2, dt.atype3, dt.atype4, dt.line)
-                dt.comment = dt.comment.replace("_","")
-
-                #if "X-CTL2-CTL2-X-9" in dt.comment: print dt
-                name = "{0}-{1}-{2}-{3}-{4}".format(dt.atype1, dt.atype2, dt.atype3, dt.atype4, dt.gromacs['func'])
-                if not name in dihedraltypes:
-                        dihedraltypes[name] = []
-                dihedraltypes[name].append(dt)
-        logger.debug("Build dihedraltypes dictionary with {0} entries".format(len(dihedraltypes)))
-
-        #
-        # Build improper dictionary
-        #
-        impropertypes = {}
-        for it in top.impropertypes:
-                it.disabled = True
-                it.comment = "; LINE({0:d}) ".format(it.line)
-                name = "{0}-{1}-{2}-{3}-{4}".format(
-                        it.atype1, it.atype2, it.atype3, it.atype4, it.gromacs['func'])
-                if not name in impropertypes:
-                        impropertypes[name] = []
-                impropertypes[name].append(it)
-        logger.debug("Build impropertypes dictionary with {0} entries".format(len(impropertypes)))
-
-        for molname_mol in top.dict_molname_mol:
-            if not 'Protein' in molname_mol:
-                continue
-            mol = top.dict_molname_mol[molname_mol]
-            for at in mol.atoms:
-                at.charge *= math.sqrt(scale_protein)
-            mol = scale_dihedrals(mol, dihedraltypes, scale_protein, banned_lines)
-            mol = scale_impropers(mol, impropertypes, 1.0, banned_lines)
-
-        top.write(outfile)
+           rest2 = PartialTempering("processed.top", banned_lines="1520 1522")
+           rest2.write("scaled.top", scale_protein=0.7)
+           rest2.write_replicas([1.0, 0.9, 0.8, 0.7], "scaled_{0}.top", processes=4)
+
+        The result for one replica is identical to :func:`partial_tempering`.
+
+        .. versionadded:: 0.8.0
+        """
+        #: Suffixes of the atom types of the protein and the lipid scaling group.
+        groups = ("_", "=")
+
+        def __init__(self, top, banned_lines=None):
+                """Prepare the topology *top*.
+
+                :Arguments:
+                  *top*
+                      :class:`~gromacs.fileformats.top.TOP` instance (which is
+                      copied and not modified) or name of a topology file
+                  *banned_lines*
+                      lines of dihedral and improper types that are not
+                      scaled, as a list or a whitespace separated string;
+                      a line number refers to the top-level topology file,
+                      lines of ``#include`` files are given as
+                      ``(path, line)`` pairs or as ``path:line`` in a string
+                """
+                #: Wall clock time in seconds of the stages ``"read"``,
+                #: ``"prepare"`` and (after :meth:`write_replicas`) ``"write"``.
+                self.timings = OrderedDict()
+                start = time.time()
+                if isinstance(top, TOP):
+                        top = pickle.loads(pickle.dumps(top, pickle.HIGHEST_PROTOCOL))
+                else:
+                        top = TOP(top)
+                self.timings['read'] = time.time() - start
+                if isinstance(banned_lines, six.string_types):
+                        banned_lines = _parse_banned_lines(banned_lines)
+                self.banned_lines = list(banned_lines or [])
+                self.top = top
+                #: Real path of the topology file that :attr:`banned_lines` refer to.
+                self.source = os.path.realpath(top.fname)
+                self._columns = []      # (types, parameter, unscaled values, group index)
+                self._cmaps = None      # (cmap types, unscaled grids, group index)
+                self._molecules = []    # (molecule, unscaled charges, DihedralArray, unscaled kchi, scaled)
+                start = time.time()
+                self._prepare_types()
+                self._prepare_molecules()
+                self.timings['prepare'] = time.time() - start
+
+        def _group_copies(self, types, attrs):
+                """Return *types* followed by a copy per group with the group suffix added to *attrs*"""
+                result, copies, group = [], [], []
+                for t in types:
+                        result.append(t)
+                        for g, gr in enumerate(self.groups):
+                                tA = t.copy()
+                                for attr in attrs:
+                                        setattr(tA, attr, getattr(tA, attr) + gr)
+                                result.append(tA)
+                                copies.append((t, tA))
+                                group.append(g)
+                return result, copies, np.array(group, dtype=int)
+
+        def _prepare_types(self):
+                top = self.top
+
+                top.cmaptypes, copies, group = self._group_copies(
+                        top.cmaptypes, ('atype1', 'atype2', 'atype3', 'atype4', 'atype8'))
+                if copies:
+                        grids = np.array([ct.gromacs['param'] for ct, ctA in copies], dtype=float)
+                        self._cmaps = ([ctA for ct, ctA in copies], grids, group)
+                logger.debug("cmaptypes: {0}".format(len(top.cmaptypes)))
+
+                top.atomtypes, copies, group = self._group_copies(top.atomtypes, ('atype',))
+                for at, atA in copies:
+                        atA.atnum = at.atype
+                self._columns.append(([atA for at, atA in copies], 'lje',
+                                      np.array([at.gromacs['param']['lje'] for at, atA in copies],
+                                               dtype=float), group))
+
+                top.pairtypes, copies, group = self._group_copies(top.pairtypes, ('atype1', 'atype2'))
+                self._columns.append(([ptA for pt, ptA in copies], 'lje14',
+                                      np.array([pt.gromacs['param']['lje14'] for pt, ptA in copies],
+                                               dtype=float), group))
+
+                top.bondtypes = self._group_copies(top.bondtypes, ('atype1', 'atype2'))[0]
+                top.angletypes = self._group_copies(top.angletypes, ('atype1', 'atype2', 'atype3'))[0]
+
+                # dihedral and improper types are replaced by explicit parameters
+                for dt in top.dihedraltypes:
+                        dt.disabled = True
+                        dt.comment = "; type={0!s}-{1!s}-{2!s}-{3!s}-9\n; LINE({4:d}) ".format(
+                                dt.atype1, dt.atype2, dt.atype3, dt.atype4, dt.line)
+                        dt.comment = dt.comment.replace("_","")
+                for it in top.impropertypes:
+                        it.disabled = True
+                        it.comment = "; LINE({0:d}) ".format(it.line)
+
+        def _prepare_molecules(self):
+                top = self.top
+                self._dihedraltypes = DihedralTypeResolver(top.dihedraltypes, self.groups)
+                impropertypes = DihedralTypeResolver(top.impropertypes, self.groups)
+
+                for molname, mol in top.dict_molname_mol.items():
+                        if not 'Protein' in molname:
+                                continue
+                        if isinstance(mol.atoms, blocks.AtomArray):
+                                charges = mol.atoms.array['charge'].copy()
+                        else:
+                                charges = np.array([atom.charge for atom in mol.atoms], dtype=float)
+                        dihedrals, scaled = self._expand_dihedrals(mol)
+                        self._molecules.append((mol, charges, dihedrals,
+                                                dihedrals.array['kchi'].copy(), scaled))
+                        scale_impropers(mol, impropertypes, 1.0, self.banned_lines, self.source)
+
+        def _iter_dihedrals(self, mol):
+                """Yield atom indices, function, parameters and line of the dihedrals of *mol*"""
+                terms = mol.param_array('dihedrals')
+                if terms is not None:
+                        for ai, aj, ak, al, fu, delta, kchi, n, line in terms.array.tolist():
+                                params = [{'delta': delta, 'kchi': kchi, 'n': n}] if kchi == kchi else []
+                                yield (ai, aj, ak, al), fu, params, line
+                        return
+                index = dict((id(atom), i) for i, atom in enumerate(mol.atoms))
+                for dh in mol.dihedrals:
+                        atoms = tuple(index[id(atom)] for atom in (dh.atom1, dh.atom2, dh.atom3, dh.atom4))
+                        yield atoms, dh.gromacs['func'], dh.gromacs['param'], dh.line
+
+        def _expand_dihedrals(self, mol):
+                """Return the dihedrals of *mol* with the parameters of their types.
+
+                Like :func:`scale_dihedrals`, every dihedral is replaced by one
+                term per parameter of the matching dihedral types and dihedrals
+                without a type are dropped. Returns a :class:`blocks.DihedralArray`
+                and a boolean array that is ``True`` for terms that are scaled.
+                """
+                resolver = self._dihedraltypes
+                banned = _banned_lines(self.banned_lines, self.source)
+                banned_str = _format_banned_lines(self.banned_lines)
+                atomtypes = [atom.atomtype for atom in mol.atoms]
+
+                rows, comments, scaled = [], [], []
+                for atoms, fu, params, line in self._iter_dihedrals(mol):
+                        if params:
+                                # [ dihedrals ] override in the molecule: scale, don't match
+                                for p in params:
+                                        rows.append(atoms + (fu, p['delta'], p['kchi'], p['n'], line))
+                                        comments.append("")
+                                        scaled.append(True)
+                                continue
+                        atypes = [atomtypes[i] for i in atoms]
+                        types = resolver.lookup(atypes, fu)
+                        if not types:
+                                continue
+                        found = _is_banned(types[0], banned)
+                        comment = ("; banned lines {0} found={1}\n; parameters for types "
+                                   "{2}-{3}-{4}-{5}-9 at LINE({6})\n").format(
+                                           banned_str, 1 if found else 0, atypes[0], atypes[1],
+                                           atypes[2], atypes[3], types[0].line).replace("_", "")
+                        for i, dt in enumerate(types):
+                                for p in dt.gromacs['param']:
+                                        rows.append(atoms + (fu, p['delta'], p['kchi'], p['n'], line))
+                                        comments.append(comment if i == 0 else "")
+                                        scaled.append(not found)
+                dihedrals = blocks.DihedralArray(rows, comments=comments)
+                mol.dihedrals = dihedrals
+                if 'dihedrals' in mol.information:
+                        mol.information['dihedrals'] = dihedrals
+                return dihedrals, np.array(scaled, dtype=bool)
+
+        def topology(self, scale_protein=1.0, scale_lipids=1.0):
+                """Return the topology scaled by *scale_protein* and *scale_lipids*.
+
+                The same :class:`~gromacs.fileformats.top.TOP` instance is
+                returned (and modified) by every call.
+                """
+                scales = np.array([scale_protein, scale_lipids], dtype=float)
+                for types, parameter, values, group in self._columns:
+                        for t, value in zip(types, (values * scales[group]).tolist()):
+                                t.gromacs['param'][parameter] = value
+                if self._cmaps is not None:
+                        cmaptypes, grids, group = self._cmaps
+                        for ct, grid in zip(cmaptypes, (grids * scales[group][:, np.newaxis]).tolist()):
+                                ct.gromacs['param'] = grid
+
+                charge_scale = math.sqrt(scale_protein)
+                for mol, charges, dihedrals, kchi, scaled in self._molecules:
+                        if isinstance(mol.atoms, blocks.AtomArray):
+                                mol.atoms.array['charge'] = charges * charge_scale
+                        else:
+                                for atom, charge in zip(mol.atoms, (charges * charge_scale).tolist()):
+                                        atom.charge = charge
+                        dihedrals.array['kchi'] = kchi * np.where(scaled, scale_protein, 1.0)
+                        mol.dihedrals = dihedrals
+                return self.top
+
+        def write(self, outfile, scale_protein=1.0, scale_lipids=1.0):
+                """Write the topology for one replica to *outfile*."""
+                self.topology(scale_protein, scale_lipids).write(outfile)
+                return outfile
+
+        def write_replicas(self, scales, outfiles, scale_lipids=1.0, processes=None):
+                """Write the topologies of all replicas.
+
+                :Arguments:
+                  *scales*
+                      list of the protein scale factors of the replicas
+                  *outfiles*
+                      list of file names or a pattern such as
+                      ``"scaled_{0}.top"`` that is formatted with the replica
+                      index and the scale factor
+                  *scale_lipids*
+                      lipid scale factor, a number or a list with one factor
+                      per replica [1.0]
+                  *processes*
+                      write the topologies in a pool of this many processes;
+                      ``None`` writes them one after the other [``None``]
+
+                :Returns: list of the file names
+                """
+                scales = [float(scale) for scale in scales]
+                if isinstance(outfiles, six.string_types):
+                        outfiles = [outfiles.format(i, scale) for i, scale in enumerate(scales)]
+                if isinstance(scale_lipids, (int, float)):
+                        scale_lipids = [scale_lipids] * len(scales)
+                if not len(outfiles) == len(scale_lipids) == len(scales):
+                        raise ValueError("scales, outfiles and scale_lipids must have the same length")
+                jobs = list(zip(outfiles, scales, [float(s) for s in scale_lipids]))
+
+                start = time.time()
+                if not processes or processes < 2 or len(jobs) < 2:
+                        _write_replicas(self, jobs)
+                else:
+                        processes = min(processes, len(jobs))
+                        with ProcessPoolExecutor(max_workers=processes) as executor:
+                                # the engine is sent once to each worker with its share of the replicas
+                                results = [executor.submit(_write_replicas, self, jobs[i::processes])
+                                           for i in range(processes)]
+                                for result in results:
+                                        result.result()
+                self.timings['write'] = time.time() - start
+                logger.info("wrote {0} replica topologies in {1:.2f} s".format(
+                        len(jobs), self.timings['write']))
+                return outfiles
+
+
+def _write_replicas(rest2, jobs):
+        return [rest2.write(outfile, scale_protein, scale_lipids)
+                for outfile, scale_protein, scale_lipids in jobs]
+
+
+def geometric_scales(nreplicas, scale_min, scale_max=1.0):
+        """Return a geometric ladder of *nreplicas* scale factors.
+
+        The factors decrease from *scale_max* to *scale_min* with a
+        constant ratio, which corresponds to the geometric spacing of
+        the effective temperatures ``T0/scale`` that is commonly used
+        for REST2::
+
+           >>> geometric_scales(4, 0.125)
+           [1.0, 0.5, 0.25, 0.125]
+
+        .. versionadded:: 0.8.0
+        """
+        if nreplicas < 1:
+                raise ValueError("nreplicas must be at least 1")
+        if not 0 < scale_min <= scale_max:
+                raise ValueError("scale factors must satisfy 0 < scale_min <= scale_max")
+        if nreplicas == 1:
+                return [float(scale_max)]
+        ratio = float(scale_min) / scale_max
+        return [scale_max * ratio ** (i / (nreplicas - 1)) for i in range(nreplicas)]
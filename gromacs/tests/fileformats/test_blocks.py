@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# GromacsWrapper
+# Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+from __future__ import division, absolute_import, print_function
+
+import copy
+import json
+import pickle
+
+import pytest
+
+from gromacs.fileformats import blocks
+
+
+@pytest.mark.parametrize('cls', [blocks.Atom, blocks.BondType, blocks.DihedralType,
+                                 blocks.InteractionType])
+def test_slots(cls):
+    obj = cls() if cls is blocks.Atom else cls('gromacs')
+    assert not hasattr(obj, '__dict__')
+    with pytest.raises(AttributeError):
+        obj.no_such_attribute = 1
+
+
+def test_gromacs_parameters_default():
+    bond = blocks.BondType('gromacs')
+    assert bond.gromacs == {'param': {'kb': None, 'b0': None}, 'func': None}
+    assert {'param': {'kb': None, 'b0': None}, 'func': None} == bond.gromacs
+    assert bond.gromacs == blocks.BondType('gromacs').gromacs
+    assert bond.charmm == {'param': {'kb': None, 'b0': None}}
+    # no 'func' entry like in the original dicts
+    assert 'func' not in blocks.DihedralType('gromacs').gromacs
+    assert blocks.SettleType('gromacs').gromacs is None
+
+
+def test_gromacs_parameters_modify():
+    bond = blocks.BondType('gromacs')
+    bond.gromacs['func'] = 1
+    bond.gromacs['param']['kb'] = 100.
+    assert bond.gromacs['func'] == 1
+    assert bond.gromacs == {'param': {'kb': 100., 'b0': None}, 'func': 1}
+    assert bond != blocks.BondType('gromacs')
+
+    bond.gromacs = {'param': {'kb': 1., 'b0': 0.1}, 'func': 2}
+    assert bond.gromacs['param']['b0'] == 0.1
+    assert sorted(bond.gromacs.keys()) == ['func', 'param']
+
+    dih = blocks.DihedralType('gromacs')
+    dih.gromacs['param'].append({'kchi': 1., 'n': 2, 'delta': 0.})
+    assert len(dih.gromacs['param']) == 1
+    assert len(blocks.DihedralType('gromacs').gromacs['param']) == 0
+
+
+def test_gromacs_parameters_dict():
+    # Param.gromacs is a dict, as in older versions
+    bond = blocks.BondType('gromacs')
+    bond.gromacs = {'param': {'kb': 1., 'b0': 0.1}, 'func': 1, 'extra': 'x'}
+    assert isinstance(bond.gromacs, dict)
+    assert json.loads(json.dumps(bond.gromacs)) == {'param': {'kb': 1., 'b0': 0.1},
+                                                    'func': 1, 'extra': 'x'}
+    assert dict(bond.gromacs) == bond.gromacs
+    assert bond.gromacs.get('func') == 1 and bond.gromacs.get('nofunc') is None
+    assert 'extra' in bond.gromacs and len(bond.gromacs) == 3
+    assert json.loads(json.dumps(blocks.BondType('gromacs').gromacs)) == \
+        {'param': {'kb': None, 'b0': None}, 'func': None}
+
+    gromacs = bond.gromacs
+    gromacs.update(func=2)
+    assert gromacs.pop('extra') == 'x'
+    assert gromacs.setdefault('func', 3) == 2
+    assert json.loads(json.dumps(gromacs)) == {'param': {'kb': 1., 'b0': 0.1}, 'func': 2}
+    assert bond.gromacs == {'param': {'kb': 1., 'b0': 0.1}, 'func': 2}
+    gromacs.clear()
+    assert bond.gromacs == {'param': {'kb': None, 'b0': None}}
+
+
+def test_gromacs_parameters_deepcopy():
+    bond = blocks.BondType('gromacs')
+    bond.gromacs = {'param': {'kb': 1., 'b0': 0.1}, 'func': 1}
+    bondA = copy.deepcopy(bond)
+    bondA.gromacs['param']['kb'] = 2.
+    assert bond.gromacs['param']['kb'] == 1.
+    assert bondA == copy.deepcopy(bondA)
+
+
+@pytest.fixture
+def dihedraltypes():
+    types = []
+    for atypes in [('A', 'B', 'C', 'D'), ('X', 'B', 'C', 'X'), ('X', 'C', 'B', 'X'),
+                   ('E', 'F', 'G', 'H')]:
+        dt = blocks.DihedralType('gromacs')
+        dt.atype1, dt.atype2, dt.atype3, dt.atype4 = atypes
+        dt.gromacs['func'] = 9
+        types.append(dt)
+    return types
+
+
+def test_type_index_lookup(dihedraltypes):
+    index = blocks.TypeIndex(dihedraltypes, ('atype1', 'atype2', 'atype3', 'atype4'),
+                             wildcard='X')
+    assert len(index) == 4
+    assert index.lookup(('A', 'B', 'C', 'D'), 9) == [dihedraltypes[0]]
+    assert index.lookup(('D', 'C', 'B', 'A'), 9) == [dihedraltypes[0]]
+    # forward wildcard match has precedence over reverse match
+    assert index.lookup(('Q', 'B', 'C', 'R'), 9) == [dihedraltypes[1]]
+    assert index.lookup(('Q', 'C', 'B', 'R'), 9) == [dihedraltypes[2]]
+    assert index.lookup(('H', 'G', 'F', 'E'), 9) == [dihedraltypes[3]]
+    assert index.lookup(('A', 'B', 'C', 'D'), 4) == []
+    assert index.resolve(('Q', 'B', 'C', 'R'), 9) == ('X', 'B', 'C', 'X', 9)
+    assert (('Q', 'B', 'C', 'R'), 9) in index
+    assert (('A', 'A', 'A', 'A'), 9) not in index
+    with pytest.raises(KeyError):
+        index[('A', 'A', 'A', 'A'), 9]
+
+
+def test_type_index_candidates():
+    # same order as the 32 keys of scale_dihedrals
+    index = blocks.TypeIndex([], ('atype1', 'atype2', 'atype3', 'atype4'), wildcard='X')
+    candidates = list(index._candidates(('A', 'B', 'C', 'D')))
+    assert len(candidates) == 32
+    assert candidates[:12] == [('A', 'B', 'C', 'D'), ('D', 'C', 'B', 'A'),
+                               ('X', 'B', 'C', 'D'), ('X', 'C', 'B', 'A'),
+                               ('A', 'X', 'C', 'D'), ('D', 'X', 'B', 'A'),
+                               ('X', 'X', 'C', 'D'), ('X', 'X', 'B', 'A'),
+                               ('A', 'B', 'X', 'D'), ('D', 'C', 'X', 'A'),
+                               ('X', 'B', 'X', 'D'), ('X', 'C', 'X', 'A')]
+    assert candidates[-2:] == [('X', 'X', 'X', 'X')] * 2
+    index = blocks.TypeIndex([], ('atype1', 'atype2'), reversible=False, wildcard='X')
+    assert list(index._candidates(('A', 'B'))) == [('A', 'B'), ('X', 'B'), ('A', 'X'), ('X', 'X')]
+
+
+def test_type_index_no_wildcard(dihedraltypes):
+    index = blocks.TypeIndex(dihedraltypes, ('atype1', 'atype2', 'atype3', 'atype4'),
+                             reversible=False)
+    assert index.lookup(('A', 'B', 'C', 'D'), 9) == [dihedraltypes[0]]
+    assert index.lookup(('D', 'C', 'B', 'A'), 9) == []
+    assert index.lookup(('Q', 'B', 'C', 'R'), 9) == []
+
+
+def test_copy_on_write():
+    dih = blocks.DihedralType('gromacs')
+    dih.gromacs['func'] = 9
+    dih.gromacs['param'].append({'kchi': 1., 'n': 3, 'delta': 0.})
+    dihA = dih.copy()
+    assert dihA == dih
+    assert dihA._param_value() is dih._param_value()
+
+    for p in dihA.gromacs['param']:
+        p['kchi'] *= 0.5
+    assert dihA.gromacs['param'][0]['kchi'] == 0.5
+    assert dih.gromacs['param'][0]['kchi'] == 1.
+    assert dihA._param_value() is not dih._param_value()
+
+
+def test_copy_aliases():
+    # parameters that were obtained before the copy do not modify the copy
+    dih = blocks.DihedralType('gromacs')
+    dih.gromacs['param'].append({'kchi': 1., 'n': 3, 'delta': 0.})
+    param = dih.gromacs['param']
+    dihA = dih.copy()
+    param[0]['kchi'] = 99.
+    param.append({'kchi': 2., 'n': 1, 'delta': 0.})
+    assert dih.gromacs['param'][0]['kchi'] == 99.
+    assert len(dih.gromacs['param']) == 2
+    assert dihA.gromacs['param'] == [{'kchi': 1., 'n': 3, 'delta': 0.}]
+
+    # the dicts that are handed out are the same on every access and stay current
+    assert dih.gromacs is dih.gromacs
+    assert dih.gromacs['param'] is param
+    gromacs = dihA.gromacs
+    dihB = dihA.copy()
+    dihA.gromacs['param'][0]['kchi'] = 2.
+    assert dihA.gromacs is gromacs
+    assert json.loads(json.dumps(gromacs)) == {'param': [{'kchi': 2., 'n': 3, 'delta': 0.}]}
+    paramA = dihA.gromacs['param']
+    paramA[0]['kchi'] = 3.
+    assert gromacs['param'][0]['kchi'] == 3.
+    assert dihB.gromacs['param'][0]['kchi'] == 1.
+
+    # the same holds for pickled parameters
+    dihC = pickle.loads(pickle.dumps(dih, pickle.HIGHEST_PROTOCOL))
+    paramC = dihC.gromacs['param']
+    dihD = dihC.copy()
+    paramC[0].update(kchi=5.)
+    assert dihD.gromacs['param'][0]['kchi'] == 99.
+
+
+def test_copy_types():
+    # shared parameters keep the types of the original parameters
+    dih = blocks.DihedralType('gromacs')
+    dih.gromacs['param'].append({'kchi': 1., 'n': 3, 'delta': 0.})
+    bond = blocks.BondType('gromacs')
+    bond.gromacs = {'param': {'kb': 1., 'b0': 0.1}, 'func': 1}
+    dihA, bondA = dih.copy(), bond.copy()
+    assert isinstance(dihA.gromacs['param'], list)
+    assert isinstance(dihA.gromacs['param'][0], dict)
+    assert isinstance(bondA.gromacs['param'], dict)
+    assert isinstance(bondA.charmm['param'], dict)
+    assert json.loads(json.dumps(dihA.gromacs)) == {'param': [{'kchi': 1., 'n': 3, 'delta': 0.}]}
+    assert json.dumps(bondA.gromacs['param'], sort_keys=True) == '{"b0": 0.1, "kb": 1.0}'
+    assert dihA._param_value() is dih._param_value()
+
+    # modifications through any view are not seen by the original
+    params = list(dihA.gromacs['param'])
+    params[0]['kchi'] = 2.
+    dict(bondA.gromacs['param']).update(kb=5.)
+    bondA.gromacs['param'].update(kb=3.)
+    assert json.loads(json.dumps(dihA.gromacs['param'])) == [{'kchi': 2., 'n': 3, 'delta': 0.}]
+    assert dih.gromacs['param'] == [{'kchi': 1., 'n': 3, 'delta': 0.}]
+    assert bondA.gromacs['param'] == {'kb': 3., 'b0': 0.1}
+    assert bond.gromacs['param'] == {'kb': 1., 'b0': 0.1}
+
+
+def test_copy_shared_param():
+    bond = blocks.BondType('gromacs')
+    bond.gromacs = {'param': {'kb': 1., 'b0': 0.1}, 'func': 1}
+    param = {'kb': 2., 'b0': 0.2}
+    copies = [bond.copy(param=param) for i in range(3)]
+    assert all(c.gromacs['param'] == param for c in copies)
+    assert bond.gromacs['param']['kb'] == 1.
+
+    copies[0].gromacs['param']['kb'] = 3.
+    assert copies[0].gromacs['param']['kb'] == 3.
+    assert copies[1].gromacs['param']['kb'] == 2.
+    assert param['kb'] == 2.
+
+
+def test_atom_array_append():
+    atoms = blocks.AtomArray([(1, 'CT', 1, 'ALA', 'CA', 1, 0.1, 12.011)])
+    buffers = set()
+    for i in range(2, 101):
+        atom = blocks.Atom()
+        atom.number, atom.atomtype, atom.resnumb, atom.resname = i, 'HC', 1, 'ALA'
+        atom.name, atom.charge = 'H{0}'.format(i), 0.01 * i
+        atoms.append(atom)
+        buffers.add(id(atoms.array.base))
+    # the array grows geometrically instead of being copied for every atom
+    assert len(buffers) <= 4
+    assert len(atoms) == 100
+    assert atoms[0].name == 'CA' and atoms[99].name == 'H100'
+    assert atoms.array['number'].tolist() == list(range(1, 101))
+    assert atoms.array['cgnr'][99] == 100
+    assert not hasattr(atoms[99], 'mass')
+
+    atoms.extend([atoms[0]._to_atom(), atoms[1]])
+    assert [a.name for a in atoms[-3:]] == ['H100', 'CA', 'H2']
+    atomsA = pickle.loads(pickle.dumps(atoms, pickle.HIGHEST_PROTOCOL))
+    assert len(atomsA) == len(atomsA.array) == 102
+
+
+def test_pickle():
+    dih = blocks.DihedralType('gromacs')
+    dih.gromacs['param'].append({'kchi': 1., 'n': 3, 'delta': 0.})
+    dihA = pickle.loads(pickle.dumps(dih, pickle.HIGHEST_PROTOCOL))
+    assert dihA == dih
+    assert 'func' not in dihA.gromacs
+
+    atoms = blocks.AtomArray([(1, 'CT', 1, 'ALA', 'CA', 1, 0.1, 12.011),
+                              (2, 'HC', 1, 'ALA', 'HA', 1, 0.05, float('nan'))])
+    bond = blocks.BondType('gromacs')
+    bond.atom1, bond.atom2 = atoms[0], atoms[1]
+    atomsA, bondA = pickle.loads(pickle.dumps((atoms, bond), pickle.HIGHEST_PROTOCOL))
+    assert [a.name for a in atomsA] == ['CA', 'HA']
+    assert atomsA.array['charge'].tolist() == [0.1, 0.05]
+    assert bondA.atom1 is atomsA[0]
+    assert bondA.atom2.atomtype == 'HC'
+    assert not hasattr(bondA.atom2, 'mass')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# GromacsWrapper
+# Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+from __future__ import division, absolute_import, print_function
+
+import pytest
+
+from gromacs.fileformats.preprocessor import TopologyPreprocessor
+
+
+@pytest.fixture
+def topology(tmpdir, monkeypatch):
+    gmxlib = tmpdir.mkdir('gmxlib')
+    gmxlib.join('ff.itp').write("#define gb_1 0.1000 1.5700e+07\n"
+                                "[ bondtypes ]\n"
+                                "#ifdef FLEXIBLE\n"
+                                "C  C  1  gb_1 ; flexible\n"
+                                "#else\n"
+                                "C  C  2  gb_1\n"
+                                "#endif\n")
+    tmpdir.join('topol.top').write("#include <ff.itp>\n"
+                                   "#ifndef FLEXIBLE\n"
+                                   "#undef gb_1\n"
+                                   "#endif\n"
+                                   "  #include \"local.itp\"\n")
+    tmpdir.join('local.itp').write("[ bonds ]\n"
+                                   "1 2 1 gb_1\n")
+    monkeypatch.setenv('GMXLIB', str(gmxlib))
+    return str(tmpdir.join('topol.top'))
+
+
+def test_lines(topology):
+    lines = list(TopologyPreprocessor().lines(topology))
+    assert lines == ["[ bondtypes ]\n",
+                     "C  C  2  0.1000 1.5700e+07\n",
+                     "[ bonds ]\n",
+                     "1 2 1 gb_1\n"]
+
+
+def test_defines(topology):
+    pp = TopologyPreprocessor(defines="-DFLEXIBLE -DPOSRES=1".split())
+    lines = list(pp.lines(topology))
+    assert lines[1] == "C  C  1  0.1000 1.5700e+07 ; flexible\n"
+    assert lines[3] == "1 2 1 0.1000 1.5700e+07\n"
+    assert pp.defines['POSRES'] == '1'
+
+
+def test_events(topology):
+    pp = TopologyPreprocessor()
+    events = []
+    for event in pp.events(topology):
+        events.append(event[:1] + tuple(str(e).split('/')[-1] for e in event[1:]))
+        if event[0] == 'begin' and event[1].endswith('local.itp'):
+            pp.skip_include()
+    assert events == [('begin', 'topol.top'),
+                      ('begin', 'ff.itp'),
+                      ('line', '[ bondtypes ]\n', 'ff.itp', '2'),
+                      ('line', 'C  C  2  0.1000 1.5700e+07\n', 'ff.itp', '6'),
+                      ('end', 'ff.itp'),
+                      ('begin', 'local.itp'),
+                      ('end', 'topol.top')]
+
+
+@pytest.mark.parametrize('content,exception', [
+    ('#include "missing.itp"\n', IOError),
+    ('#ifdef A\n[ bonds ]\n', ValueError),
+    ('#endif\n', ValueError),
+    ('#if A > 1\n#endif\n', ValueError),
+    ('#include "topol.top"\n', ValueError),
+])
+def test_errors(tmpdir, content, exception):
+    topol = tmpdir.join('topol.top')
+    topol.write(content)
+    with pytest.raises(exception):
+        list(TopologyPreprocessor().lines(str(topol)))
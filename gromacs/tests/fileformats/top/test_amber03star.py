@@ -14,5 +14,6 @@ from ...datafiles import datafile
 
 class TestAmber03star(TopologyTest):
         processed = datafile('fileformats/top/amber03star/processed.top')
+        scaled = datafile('fileformats/top/amber03star/scaled.top')
         conf = datafile('fileformats/top/amber03star/conf.gro')
         molecules = ['Protein', 'SOL', 'IB+', 'CA', 'CL', 'NA', 'MG', 'K', 'RB', 'CS', 'LI', 'ZN']
@@ -14,5 +14,6 @@ from ...datafiles import datafile
 
 class TestAmber03w(TopologyTest):
         processed = datafile('fileformats/top/amber03w/processed.top')
+        scaled = datafile('fileformats/top/amber03w/scaled.top')
         conf = datafile('fileformats/top/amber03w/conf.gro')
         molecules = ['Protein_chain_A', 'SOL', 'IB+', 'CA', 'CL', 'NA', 'MG', 'K', 'RB', 'CS', 'LI', 'ZN']
@@ -12,5 +12,8 @@ from ...datafiles import datafile
 
 class TestCharmm22st(TopologyTest):
         processed = datafile('fileformats/top/charmm22st/processed.top')
+        scaled = datafile('fileformats/top/charmm22st/scaled.top')
         conf = datafile('fileformats/top/charmm22st/conf.gro')
         molecules = ['SOL', 'Protein', 'Ion', 'Cal', 'Ces', 'CL', 'K', 'NA', 'ZN']
+        # dihedral types that are not scaled in scaled.top
+        banned_lines = '2562 2569 2590'
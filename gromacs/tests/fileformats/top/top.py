@@ -9,14 +9,15 @@ import os.path
 
 import numpy as np
 
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 from pandas.util.testing import assert_frame_equal
 
 import pytest
 
 import gromacs
-from gromacs.fileformats import TOP, XVG
+from gromacs.fileformats import TOP, XVG, SystemToGroTop, blocks
 from gromacs import scaling
+from gromacs.exceptions import ParseError
 
 from ...datafiles import datafile
 
@@ -60,6 +61,7 @@ def rerun_energy(s, o, prefix, nt=0):
 
 class TopologyTest(object):
         mdp = datafile('fileformats/top/grompp.mdp')
+        banned_lines = ''
 
         def test_basic(self):
                 path = self.processed
@@ -108,6 +110,208 @@ class TopologyTest(object):
                 attrs1 = [section for section in top1.found_sections if "types" in section]
                 assert attrs1
 
+        def test_compact_storage(self):
+                """Atoms and terms are stored in arrays and materialized on access"""
+                top = TOP(self.processed)
+                for mol in top.dict_molname_mol.values():
+                        assert isinstance(mol.atoms, blocks.AtomArray)
+                        charges = [atom.charge for atom in mol.atoms]
+                        assert_array_equal(mol.atoms.array['charge'], charges)
+
+                        terms = mol.param_array('bonds')
+                        if terms is None:
+                                continue
+                        nbonds = len(terms)
+                        bonds = mol.bonds
+                        assert len(bonds) == nbonds
+                        assert mol.param_array('bonds') is None
+                        for bond in bonds:
+                                assert bond.atom1 in mol.atoms
+                                assert bond.atom2 in mol.atoms
+
+        def test_type_index(self):
+                """TypeIndex finds the same dihedral types as the 32-key search of scaling"""
+                top = TOP(self.processed)
+                dihedraltypes = {}
+                for dt in top.dihedraltypes:
+                        key = "{0}-{1}-{2}-{3}-{4}".format(dt.atype1, dt.atype2, dt.atype3,
+                                                           dt.atype4, dt.gromacs['func'])
+                        dihedraltypes.setdefault(key, []).append(dt)
+                index = top.type_index('dihedraltypes')
+                assert top.type_index('dihedraltypes') is index
+
+                for mol in top.dict_molname_mol.values():
+                        for dh in mol.dihedrals:
+                                atypes = [a.atomtype for a in (dh.atom1, dh.atom2, dh.atom3, dh.atom4)]
+                                func = dh.gromacs['func']
+                                expected = []
+                                for iswitch in range(32):
+                                        a = atypes if iswitch % 2 == 0 else atypes[::-1]
+                                        a = ["X" if (iswitch // 2**(k + 1)) % 2 else a[k]
+                                             for k in range(4)]
+                                        key = "{0}-{1}-{2}-{3}-{4}".format(*(a + [func]))
+                                        if key in dihedraltypes:
+                                                expected = dihedraltypes[key]
+                                                break
+                                assert index.lookup(atypes, func) == expected
+
+        def test_memory(self):
+                """Memory per bonded term after all terms were materialized"""
+                tracemalloc = pytest.importorskip("tracemalloc")
+                top = TOP(self.processed)
+                molecules = list(top.dict_molname_mol.values())
+                tracemalloc.start()
+                try:
+                        terms = [getattr(mol, section) for mol in molecules
+                                 for section in blocks.Molecule.param_sections]
+                        size, peak = tracemalloc.get_traced_memory()
+                finally:
+                        tracemalloc.stop()
+                nterms = sum(len(t) for t in terms)
+                # dict-based Param instances needed more than 1 kB per term
+                assert size / nterms < 400
+
+        def _split_topology(self, tmpdir):
+                """Split processed.top into a force field directory and a topol.top"""
+                with open(self.processed) as f:
+                        processed = f.read()
+                start = processed.index('[ moleculetype ]')
+                split = processed.index('[ bondtypes ]')
+                ffdir = tmpdir.mkdir('gmxlib').mkdir('test.ff')
+                ffdir.join('forcefield.itp').write(
+                        '#define _FF_TEST\n' + processed[:split] + '#include "ffbonded.itp"\n')
+                ffdir.join('ffbonded.itp').write(processed[split:start])
+                topol = tmpdir.join('topol.top')
+                topol.write('#include "test.ff/forcefield.itp"\n'
+                            '#ifdef _FF_TEST\n' + processed[start:] +
+                            '#else\n[ unknown ]\n1 2 3\n#endif\n')
+                return str(tmpdir.join('gmxlib')), str(topol)
+
+        def test_include(self, tmpdir, monkeypatch):
+                """A topology with #include statements reads like processed.top"""
+                gmxlib, topol = self._split_topology(tmpdir)
+                monkeypatch.setenv('GMXLIB', gmxlib)
+                TOP.clear_cache()
+                top = TOP(topol)
+                reference = TOP(self.processed)
+                assert top.found_sections == reference.found_sections
+                assert list(top.dict_molname_mol.keys()) == self.molecules
+                with tmpdir.as_cwd():
+                        top.write('include.top')
+                        reference.write('reference.top')
+                        with open('include.top') as f1, open('reference.top') as f2:
+                                assert f1.read() == f2.read()
+
+        def test_include_cache(self, tmpdir, monkeypatch):
+                """Force field files are only parsed by the first TOP instance"""
+                gmxlib, topol = self._split_topology(tmpdir)
+                monkeypatch.setenv('GMXLIB', gmxlib)
+                TOP.clear_cache()
+                top1 = TOP(topol)
+                calls = []
+                parse_atomtypes = TOP._parse_atomtypes
+                def counting_parse_atomtypes(self, *args):
+                        calls.append(args)
+                        return parse_atomtypes(self, *args)
+                monkeypatch.setattr(TOP, '_parse_atomtypes', counting_parse_atomtypes)
+
+                top2 = TOP(topol)
+                assert not calls
+                assert top2.atomtypes == top1.atomtypes
+                assert top2.dihedraltypes == top1.dihedraltypes
+                assert top2.information.keys() == top1.information.keys()
+
+                # the cache does not share changes of the parameter types
+                lje = top1.atomtypes[0].gromacs['param']['lje']
+                top2.atomtypes[0].gromacs['param']['lje'] *= 0.5
+                assert top2.atomtypes[0].gromacs['param']['lje'] == 0.5 * lje
+                assert top1.atomtypes[0].gromacs['param']['lje'] == lje
+                assert TOP(topol).atomtypes[0].gromacs['param']['lje'] == lje
+
+                # a change of a nested force field file is noticed
+                ffbonded = tmpdir.join('gmxlib', 'test.ff', 'ffbonded.itp')
+                ffbonded.write(ffbonded.read() + '\n')
+                TOP(topol)
+                assert calls
+                del calls[:]
+                TOP(topol)
+                assert not calls
+
+        def test_banned_lines_include(self, tmpdir, monkeypatch):
+                """banned_lines only refer to the top-level topology file"""
+                gmxlib, topol = self._split_topology(tmpdir)
+                monkeypatch.setenv('GMXLIB', gmxlib)
+                TOP.clear_cache()
+                top = TOP(topol)
+                ffbonded = os.path.realpath(os.path.join(gmxlib, 'test.ff', 'ffbonded.itp'))
+                assert all(dt.source == ffbonded for dt in top.dihedraltypes)
+                reference = TOP(self.processed)
+                processed = os.path.realpath(self.processed)
+                assert all(dt.source == processed for dt in reference.dihedraltypes)
+
+                def scaled(top, banned_lines):
+                        rest2 = scaling.PartialTempering(top, banned_lines=banned_lines)
+                        return np.concatenate([m[4] for m in rest2._molecules])
+
+                # line numbers refer to the top-level file and ban nothing in ffbonded.itp ...
+                lines = [dt.line for dt in top.dihedraltypes]
+                assert scaled(top, lines).all()
+                # ... unless the file is given
+                assert not scaled(top, [(ffbonded, line) for line in lines]).all()
+                assert not scaled(top, " ".join("{0}:{1}".format(ffbonded, line)
+                                                for line in lines)).all()
+                # the same types in processed.top are banned by their line numbers
+                assert not scaled(reference, [dt.line for dt in reference.dihedraltypes]).all()
+
+                # without the source file, line numbers match types from any file
+                def found(source):
+                        scaled = TOP(topol)
+                        comments = []
+                        for molname, mol in scaled.dict_molname_mol.items():
+                                if 'Protein' in molname:
+                                        scaling.scale_dihedrals(mol, scaled.dihedraltypes, 0.5, lines,
+                                                                source)
+                                        comments.extend(dh.comment for dh in mol.dihedrals)
+                        return any('found=1' in (comment or '') for comment in comments)
+
+                assert found(None)
+                assert not found(processed)
+
+        def test_snapshot(self, tmpdir):
+                """A snapshot loads the same topology, including modifications"""
+                top = TOP(self.processed)
+                mol = list(top.dict_molname_mol.values())[0]
+                mol.bonds   # materialized terms refer to the atoms of the molecule
+                top.atomtypes[0].gromacs['param']['lje'] *= 0.5
+                with tmpdir.as_cwd():
+                        top.save_snapshot('top.snapshot')
+                        loaded = TOP.load_snapshot('top.snapshot')
+                        assert loaded.found_sections == top.found_sections
+                        assert loaded.atomtypes[0].gromacs == top.atomtypes[0].gromacs
+                        loaded_mol = loaded.dict_molname_mol[mol.name]
+                        if loaded_mol.bonds:
+                                assert loaded_mol.bonds[0].atom1 is loaded_mol.atoms[
+                                        mol.atoms.array['number'].tolist().index(
+                                                mol.bonds[0].atom1.number)]
+                        top.write('top.top')
+                        loaded.write('loaded.top')
+                        with open('top.top') as f1, open('loaded.top') as f2:
+                                assert f1.read() == f2.read()
+
+        def test_snapshot_validation(self, tmpdir):
+                topol = tmpdir.join('processed.top')
+                with open(self.processed) as f:
+                        topol.write(f.read())
+                with tmpdir.as_cwd():
+                        TOP(str(topol)).save_snapshot('top.snapshot')
+                        topol.write('\n', mode='a')
+                        with pytest.raises(ParseError):
+                                TOP.load_snapshot('top.snapshot')
+                        top = TOP.load_snapshot('top.snapshot', validate=False)
+                        assert list(top.dict_molname_mol.keys()) == self.molecules
+                        with pytest.raises(ParseError):
+                                TOP.load_snapshot(str(topol))
+
         def test_read_write(self, tmpdir):
                 """Read a topology, write it out, and read in the output again.
                 Writing the topology out should make no change to the topology.
@@ -139,6 +343,122 @@ class TopologyTest(object):
                                 attr2 = getattr(top2, attr)
                                 assert attr1 == attr2, errmsg_helper(attr, attr1, attr2)
 
+        def test_write_blocks(self, tmpdir, monkeypatch):
+                """Output does not depend on the block size or on materialized terms"""
+                top = TOP(self.processed)
+                with tmpdir.as_cwd():
+                        top.write('blocks.top')
+                        monkeypatch.setattr(SystemToGroTop, 'chunksize', 7)
+                        top.write('small_blocks.top')
+                        for mol in top.dict_molname_mol.values():
+                                for section in blocks.Molecule.param_sections:
+                                        getattr(mol, section)
+                                list(mol.atoms)
+                        top.write('materialized.top')
+                        with open('blocks.top') as f:
+                                reference = f.read()
+                        for filename in ('small_blocks.top', 'materialized.top'):
+                                with open(filename) as f:
+                                        assert f.read() == reference, filename
+
+        def test_write_multiple_output(self, tmpdir):
+                top = TOP(self.processed)
+                with tmpdir.as_cwd():
+                        top.write('single.top')
+                        SystemToGroTop(top, 'multiple.top', multiple_output=True, workers=2)
+                        with open('single.top') as f:
+                                single = f.read()
+                        with open('multiple.top') as f:
+                                multiple = f.read()
+                        for molname in top.dict_molname_mol:
+                                include = '#include "mol_{0}.itp" \n'.format(molname)
+                                assert include in multiple
+                                with open('mol_{0}.itp'.format(molname)) as f:
+                                        itp = f.read()
+                                assert itp in single
+                                multiple = multiple.replace(include, itp)
+                        assert multiple == single
+
+        def test_partial_tempering(self, tmpdir):
+                """partial_tempering() writes the reference topology (scale_protein=0.5, scale_lipids=0.9)
+
+                The reference topologies were written with partial_tempering() of
+                GromacsWrapper 0.7.0.
+                """
+                with tmpdir.as_cwd():
+                        scaling.partial_tempering(topfile=self.processed, outfile="scaled.top",
+                                                  banned_lines=self.banned_lines,
+                                                  scale_protein=0.5, scale_lipids=0.9)
+                        with open("scaled.top") as f1, open(self.scaled) as f2:
+                                assert f1.read() == f2.read()
+
+        def test_partial_tempering_replicas(self, tmpdir):
+                """PartialTempering writes the reference topology for each replica"""
+                top = TOP(self.processed)
+                rest2 = scaling.PartialTempering(top, banned_lines=self.banned_lines)
+                # the topology of the caller is not modified
+                assert all(not dt.disabled for dt in top.dihedraltypes)
+                scales = [1.0, 0.5, 0.8, 0.5]
+                with tmpdir.as_cwd():
+                        outfiles = rest2.write_replicas(scales, "replica_{0}.top", scale_lipids=0.9)
+                        assert outfiles == ["replica_0.top", "replica_1.top", "replica_2.top",
+                                            "replica_3.top"]
+                        assert list(rest2.timings) == ['read', 'prepare', 'write']
+                        with open(self.scaled) as f:
+                                reference = f.read()
+                        replicas = []
+                        for outfile in outfiles:
+                                with open(outfile) as f:
+                                        replicas.append(f.read())
+                        assert replicas[1] == reference
+                        assert replicas[3] == reference
+                        assert replicas[0] != reference and replicas[2] != reference
+
+                        # dihedrals with comments are written like materialized ones
+                        scaled = rest2.topology(0.5, 0.9)
+                        scaled.write("compact.top")
+                        for mol in scaled.dict_molname_mol.values():
+                                mol.dihedrals
+                        scaled.write("materialized.top")
+                        with open("compact.top") as f1, open("materialized.top") as f2:
+                                assert f1.read() == f2.read()
+
+        def test_geometric_scales(self):
+                assert_array_almost_equal(scaling.geometric_scales(4, 0.125), [1.0, 0.5, 0.25, 0.125])
+                assert_array_almost_equal(scaling.geometric_scales(3, 0.4, 0.9), [0.9, 0.6, 0.4])
+                assert scaling.geometric_scales(1, 0.5) == [1.0]
+                with pytest.raises(ValueError):
+                        scaling.geometric_scales(3, 1.5)
+
+        def test_dihedral_type_resolver(self):
+                """DihedralTypeResolver finds the types of the 32-key search of scale_dihedrals"""
+                top = TOP(self.processed)
+                dihedraltypes = {}
+                for dt in top.dihedraltypes:
+                        key = "{0}-{1}-{2}-{3}-{4}".format(dt.atype1, dt.atype2, dt.atype3,
+                                                           dt.atype4, dt.gromacs['func'])
+                        dihedraltypes.setdefault(key, []).append(dt)
+                index = top.type_index('dihedraltypes')
+                resolver = scaling.DihedralTypeResolver(top.dihedraltypes)
+                for mol in top.dict_molname_mol.values():
+                        for dh in mol.dihedrals:
+                                atypes = [a.atomtype for a in (dh.atom1, dh.atom2, dh.atom3, dh.atom4)]
+                                func = dh.gromacs['func']
+                                expected = []
+                                for iswitch in range(32):
+                                        a = atypes if iswitch % 2 == 0 else atypes[::-1]
+                                        a = ["X" if (iswitch // 2**(k + 1)) % 2 else a[k]
+                                             for k in range(4)]
+                                        key = "{0}-{1}-{2}-{3}-{4}".format(*(a + [func]))
+                                        if key in dihedraltypes:
+                                                expected = dihedraltypes[key]
+                                                break
+                                # atom types carry the scaling group marker
+                                types = resolver.lookup([a + "_" for a in atypes], func)
+                                assert types == expected
+                                assert resolver.lookup([a + "_" for a in atypes], func) is types
+                                assert types == index.lookup(atypes, func)
+
         def test_grompp(self, tmpdir):
                 """Check if grompp can be run successfully at all"""
                 f = self.mdp
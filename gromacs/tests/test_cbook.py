@@ -5,11 +5,15 @@
 
 from __future__ import division, absolute_import, print_function
 
+import os
+import sys
+
 import pytest
 
 from numpy.testing import assert_almost_equal
 
 from gromacs import cbook
+import gromacs.core
 import gromacs.setup
 
 from gromacs.tests.datafiles import datafile
@@ -25,3 +29,136 @@ def test_grompp_qtot(tmpdir):
                                  stdout=False, maxwarn=10)
     assert_almost_equal(qtot, -4, decimal=5,
                         err_msg="grompp_qtot() failed to compute total charge correctly")
+
+
+FAKE_GROMPP = """#!{python}
+import sys
+args = sys.argv[1:]
+for opt in ('-o', '-po', '-pp'):
+    if opt in args:
+        with open(args[args.index(opt) + 1], 'w') as out:
+            out.write('output')
+with open('ncalls', 'a') as ncalls:
+    ncalls.write('1')
+print('fake grompp ran')
+"""
+
+@pytest.fixture
+def fake_grompp(tmpdir):
+    script = tmpdir.join("fake_grompp")
+    script.write(FAKE_GROMPP.format(python=sys.executable))
+    script.chmod(0o755)
+    Grompp = type("Grompp", (gromacs.core.GromacsCommand,),
+                  {'command_name': str(script)})
+    return Grompp()
+
+@pytest.fixture
+def grompp_inputs(tmpdir):
+    with tmpdir.as_cwd():
+        tmpdir.mkdir("ff").join("forcefield.itp").write("[ defaults ]\n1 2\n")
+        tmpdir.join("mol.itp").write('#include "forcefield.itp"\n')
+        tmpdir.join("topol.top").write('#include "mol.itp"\n#include <missing.itp>\n')
+        tmpdir.join("grompp.mdp").write("include = -I{0}\n".format(tmpdir.join("ff")))
+        tmpdir.join("conf.gro").write("conf\n")
+    return tmpdir
+
+def test_topology_includes(grompp_inputs):
+    with grompp_inputs.as_cwd():
+        includes = cbook.topology_includes("topol.top", include_dirs=["ff"])
+    assert includes == sorted([str(grompp_inputs.join("mol.itp")),
+                               str(grompp_inputs.join("ff", "forcefield.itp"))])
+
+def test_grompp_cache_key_includes(fake_grompp, grompp_inputs):
+    with grompp_inputs.as_cwd():
+        key1 = cbook.grompp_cache_key(fake_grompp, f="grompp.mdp", o="md.tpr")
+        assert key1 == cbook.grompp_cache_key(fake_grompp, f="grompp.mdp", o="md.tpr")
+        assert key1 != cbook.grompp_cache_key(fake_grompp, f="grompp.mdp", o="md.tpr",
+                                              maxwarn=1)
+        grompp_inputs.join("ff", "forcefield.itp").write("[ defaults ]\n1 3\n")
+        assert key1 != cbook.grompp_cache_key(fake_grompp, f="grompp.mdp", o="md.tpr")
+
+def test_grompp_cached(fake_grompp, grompp_inputs):
+    def run():
+        return cbook._grompp_cached(fake_grompp, f="grompp.mdp", o="md.tpr",
+                                    stdout=False, cache=True)
+    with grompp_inputs.as_cwd():
+        rc, out, err = run()
+        assert rc == 0 and "fake grompp ran" in out
+        rc, out, err = run()
+        assert rc == 0 and "fake grompp ran" in out
+        assert grompp_inputs.join("ncalls").read() == "1"
+        grompp_inputs.join("mol.itp").write('#include "forcefield.itp"\n; changed\n')
+        run()
+        assert grompp_inputs.join("ncalls").read() == "11"
+        os.unlink("md.tpr")
+        run()
+        assert grompp_inputs.join("ncalls").read() == "111"
+
+
+FAKE_TRJCONV = """#!{python}
+import sys
+args = sys.argv[1:]
+def option(name, default):
+    return float(args[args.index(name) + 1]) if name in args else default
+b, e = option('-b', -1e10), option('-e', 1e10)
+prefix = args[args.index('-o') + 1].rsplit('.', 1)
+times = [t for t in range(10) if b <= t <= e]
+for i, t in enumerate(times):
+    with open('{{0}}{{1}}.{{2}}'.format(prefix[0], i, prefix[1]), 'w') as out:
+        out.write(str(t))
+"""
+
+FAKE_GMXCHECK = """#!/bin/sh
+printf 'Reading frame       0 time    0.000   \\nLast frame          9 time    9.000   \\n\\n' >&2
+printf 'Item        #frames Timestep (ps)\\nStep            10    1\\nTime            10    1\\n' >&2
+"""
+
+@pytest.fixture
+def fake_frames_tools(tmpdir, monkeypatch):
+    for name, script in (("trjconv", FAKE_TRJCONV.format(python=sys.executable)),
+                         ("gmxcheck", FAKE_GMXCHECK)):
+        tmpdir.join(name).write(script)
+        tmpdir.join(name).chmod(0o755)
+        monkeypatch.setattr(gromacs.tools, name.capitalize(),
+                            type(name.capitalize(), (gromacs.core.GromacsCommand,),
+                                 {'command_name': str(tmpdir.join(name))}),
+                            raising=False)
+
+def frame_time(frame):
+    with open(frame) as f:
+        return int(f.read())
+
+class TestFrames(object):
+    def test_all_frames(self, fake_frames_tools):
+        frames = cbook.Frames("md.tpr", "md.xtc")
+        assert [frame_time(frame) for frame in frames] == list(range(10))
+        assert frames.totalframes == 10
+
+    @pytest.mark.parametrize("prefetch", [True, False])
+    def test_maxframes(self, fake_frames_tools, prefetch):
+        frames = cbook.Frames("md.tpr", "md.xtc", maxframes=3, prefetch=prefetch)
+        assert list(frames.chunks()) == [(-0.5, 2.5), (2.5, 5.5), (5.5, 8.5), (8.5, 9.0)]
+        times, ondisk = [], []
+        for frame in frames:
+            times.append(frame_time(frame))
+            ondisk.append(len(frames.all_frames))
+        assert times == list(range(10))
+        assert max(ondisk) <= 6
+        assert frames.totalframes == 10
+        assert os.listdir(frames.framedir) == []
+
+    def test_maxframes_window(self, fake_frames_tools):
+        frames = cbook.Frames("md.tpr", "md.xtc", maxframes=4, b=3, e=7)
+        assert [frame_time(frame) for frame in frames] == [3, 4, 5, 6, 7]
+
+    def test_maxframes_break(self, fake_frames_tools):
+        frames = cbook.Frames("md.tpr", "md.xtc", maxframes=2)
+        iterator = iter(frames)
+        assert frame_time(next(iterator)) == 0
+        iterator.close()
+        assert os.listdir(frames.framedir) == []
+
+    def test_map(self, fake_frames_tools):
+        frames = cbook.Frames("md.tpr", "md.xtc", maxframes=4)
+        assert frames.map(frame_time, processes=2) == list(range(10))
+        assert frames.map(frame_time) == list(range(10))
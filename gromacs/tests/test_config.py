@@ -72,3 +72,34 @@ def test_get_configuration():
     # could test more variables
     assert cfg.getpath('DEFAULT', 'configdir')
 
+
+def test_set_gmxrc_environment_snapshot(tmpdir, monkeypatch):
+    calls = tmpdir.join("calls.log")
+    GMXRC = tmpdir.join("GMXRC")
+    GMXRC.write("echo sourced >> {0}\n"
+                "export GMXBIN={1}\n"
+                "export GMXDATA=\n".format(calls, tmpdir))
+    monkeypatch.setattr(gromacs.config, "configdir", str(tmpdir.mkdir("config")))
+
+    with temp_environ() as environ:
+        environ.pop('GMXBIN', None)
+        gromacs.config.set_gmxrc_environment(str(GMXRC))
+        assert environ['GMXBIN'] == str(tmpdir)
+        assert environ['GMXDATA'] == ""
+        assert calls.read().split() == ["sourced"]
+        assert tmpdir.join("config", "cache", "gmxrc.json").check()
+
+    with temp_environ() as environ:
+        environ.pop('GMXBIN', None)
+        gromacs.config.set_gmxrc_environment(str(GMXRC))
+        assert environ['GMXBIN'] == str(tmpdir)
+        assert calls.read().split() == ["sourced"]
+        # changed input environment invalidates the snapshot
+        environ['GMXBIN'] = "/nonexisting"
+        gromacs.config.set_gmxrc_environment(str(GMXRC))
+        assert environ['GMXBIN'] == str(tmpdir)
+        assert calls.read().split() == ["sourced", "sourced"]
+        # never cached
+        environ['GMXBIN'] = "/nonexisting"
+        gromacs.config.set_gmxrc_environment(str(GMXRC), cache=False)
+        assert calls.read().split() == ["sourced"] * 3
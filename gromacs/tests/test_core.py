@@ -9,9 +9,11 @@ from __future__ import division, absolute_import, print_function
 import six
 
 import os.path
+import json
 import pytest
 
 import gromacs
+import gromacs.resultcache
 
 # use 'ls' as command and only use common BSD/GNU options
 @pytest.fixture
@@ -83,3 +85,482 @@ class TestCommand(object):
         captured = capsys.readouterr()
         assert command.command_name in captured.out
         assert gromacs.core.Command.__call__.__doc__ in captured.out
+
+
+@pytest.fixture
+def gromacs_command():
+    # GromacsCommand that fails for a missing file
+    cls = type('Ls', (gromacs.core.GromacsCommand,), {'command_name': 'ls'})
+    return cls(failure='raise')
+
+
+class TestConcurrent(object):
+    def test_submit(self, command):
+        future = command.submit(stdout=False)
+        rc, out, err = future.result()
+        assert rc == 0
+        assert out == command(stdout=False)[1]
+
+    def test_map(self, command, tmpdir):
+        for i in range(4):
+            tmpdir.join("file{0}".format(i)).write("")
+        results = gromacs.map(command, [dict(d=str(tmpdir.join("file{0}".format(i))), stdout=False)
+                                        for i in range(4)], workers=2)
+        assert [out.split()[-1] for rc, out, err in results] == \
+            [str(tmpdir.join("file{0}".format(i))) for i in range(4)]
+
+    def test_map_failure(self, gromacs_command, tmpdir):
+        arguments = [dict(d=str(tmpdir), stdout=False, stderr=False),
+                     dict(d='/this_does_not_exist_Foo_Bar', stdout=False, stderr=False)]
+        with pytest.raises(gromacs.GromacsError):
+            gromacs.map(gromacs_command, arguments)
+        gromacs_command.failuremode = None
+        results = gromacs.map(gromacs_command, arguments)
+        assert results[0][0] == 0
+        assert results[1][0] > 0
+
+    def test_executor(self):
+        executor = gromacs.core.get_executor(3)
+        assert gromacs.core.get_executor() is executor
+        assert executor._max_workers == 3
+        gromacs.core.shutdown_executor()
+        assert gromacs.core.get_executor() is not executor
+
+    def test_executor_replaced(self, command):
+        # a pool that is replaced still runs jobs submitted to it
+        executor = gromacs.core.get_executor(2)
+        assert gromacs.core.get_executor(3) is not executor
+        assert executor.submit(command.run, stdout=False).result()[0] == 0
+        # map() with workers uses its own pool
+        shared = gromacs.core.get_executor()
+        gromacs.map(command, [dict(stdout=False)], workers=1)
+        assert gromacs.core.get_executor() is shared
+        gromacs.core.shutdown_executor()
+
+
+@pytest.mark.skipif(six.PY2, reason="asyncio requires Python 3")
+class TestAsync(object):
+    @staticmethod
+    def run(coroutine):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_arun(self, command):
+        rc, out, err = self.run(command.arun(stdout=False))
+        assert rc == 0
+        assert out == command(stdout=False)[1]
+
+    def test_arun_with_input(self):
+        cat = type('Cat', (gromacs.core.Command,), {'command_name': 'cat'})()
+        rc, out, err = self.run(cat.arun(stdout=False, input=("a", u"Ångström")))
+        assert out == u"a\nÅngström\n"
+
+    def test_arun_failure(self, gromacs_command):
+        with pytest.raises(gromacs.GromacsError):
+            self.run(gromacs_command.arun(d='/this_does_not_exist_Foo_Bar',
+                                          stdout=False, stderr=False))
+
+    def test_arun_timeout(self):
+        import asyncio
+        sleep = type('Sleep', (gromacs.core.Command,), {'command_name': 'sleep'})()
+        with pytest.raises(asyncio.TimeoutError):
+            self.run(sleep.arun("10", timeout=0.1))
+
+
+@pytest.fixture
+def capture_output_lines():
+    lines = gromacs.environment.flags['capture_output_lines']
+    gromacs.environment.flags['capture_output_lines'] = 10
+    yield 10
+    gromacs.environment.flags['capture_output_lines'] = lines
+
+
+class TestStream(object):
+    @pytest.fixture
+    def seq(self):
+        return type('Seq', (gromacs.core.Command,), {'command_name': 'seq'})()
+
+    def test_stream(self, seq, capture_output_lines):
+        lines = []
+        rc, out, err = seq("5000", stream=lines.append)
+        assert rc == 0
+        assert lines == ["{0}\n".format(i) for i in range(1, 5001)]
+        assert out.split() == [str(i) for i in range(4991, 5001)]
+        assert err is None
+
+    def test_iterlines(self, seq):
+        lines = seq.iterlines("3")
+        assert next(lines) == "1\n"
+        assert list(lines) == ["2\n", "3\n"]
+
+    def test_iterlines_input(self):
+        cat = type('Cat', (gromacs.core.Command,), {'command_name': 'cat'})()
+        assert list(cat.iterlines(input=("a", "b"))) == ["a\n", "b\n"]
+
+    def test_stream_flag(self, seq, capture_output_lines):
+        gromacs.environment.flags['capture_output'] = "stream"
+        try:
+            rc, out, err = seq("100")
+        finally:
+            gromacs.environment.flags['capture_output'] = False
+        assert len(out.split()) == capture_output_lines
+
+    def test_stream_failure(self, gromacs_command):
+        with pytest.raises(gromacs.GromacsError):
+            list(gromacs_command.iterlines(d='/this_does_not_exist_Foo_Bar'))
+        gromacs_command.failuremode = None
+        rc, out, err = gromacs_command(d='/this_does_not_exist_Foo_Bar', stderr=False,
+                                       stream=lambda line: None)
+        assert rc > 0
+        assert '/this_does_not_exist_Foo_Bar' in err
+
+
+class TestCaptureFiles(object):
+    @pytest.fixture
+    def flags(self, tmpdir):
+        flags = gromacs.environment.flags
+        saved = {name: flags[name] for name in ('capture_output', 'capture_output_filename',
+                                                'capture_output_keep')}
+        flags['capture_output'] = "rotate"
+        flags['capture_output_filename'] = str(tmpdir.join("captured.txt"))
+        flags['capture_output_keep'] = 3
+        yield flags
+        for name, value in saved.items():
+            flags[name] = value
+
+    def test_rotate(self, flags, command, tmpdir):
+        for i in range(5):
+            tmpdir.join("file{0}".format(i)).write("")
+        gromacs.map(command, [dict(d=str(tmpdir.join("file{0}".format(i)))) for i in range(5)],
+                    workers=2)
+        captured = tmpdir.listdir(lambda p: p.basename.startswith("captured."))
+        assert len(captured) == 3
+        assert all(p.ext == ".txt" for p in captured)
+
+        command(d=str(tmpdir.join("file0")))
+        fn = gromacs.core.captured_output_file()
+        assert fn.startswith(str(tmpdir.join("captured.")))
+        with open(fn) as f:
+            assert f.read().split()[-1] == str(tmpdir.join("file0"))
+
+    def test_file(self, flags, command, tmpdir):
+        flags['capture_output'] = "file"
+        command('-d', str(tmpdir))
+        assert gromacs.core.captured_output_file() == flags['capture_output_filename']
+        assert tmpdir.join("captured.txt").read().split()[-1] == str(tmpdir)
+
+
+class TestInstrumentation(object):
+    @pytest.fixture
+    def flags(self, tmpdir):
+        flags = gromacs.environment.flags
+        saved = {name: flags[name] for name in ('instrumentation', 'instrumentation_log')}
+        flags['instrumentation'] = True
+        flags['instrumentation_log'] = str(tmpdir.join("timings.jsonl"))
+        gromacs.core.clear_timings()
+        yield flags
+        for name, value in saved.items():
+            flags[name] = value
+        gromacs.core.clear_timings()
+
+    def test_timings(self, flags, command, tmpdir):
+        command(stdout=False)
+        list(command.iterlines())
+        records = gromacs.core.timings()
+        assert len(records) == 2
+        r = records[0]
+        assert r.command == "ls"
+        assert r.commandline[0] == "ls"
+        assert r.returncode == 0
+        assert r.stdout_size > 0
+        assert r.stderr_size is None
+        assert min(r.build, r.spawn, r.runtime) >= 0
+        lines = tmpdir.join("timings.jsonl").readlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])["stdout_size"] == r.stdout_size
+        assert gromacs.core.format_timings().split("\n")[1].split()[:2] == ["ls", "2"]
+
+    def test_profile(self, command):
+        assert not gromacs.environment.flags['instrumentation']
+        with gromacs.core.profile("ls") as prof:
+            command(stdout=False)
+        command(stdout=False)
+        assert len(prof.records) == 1
+        assert prof.elapsed >= prof.records[0].runtime
+        assert gromacs.core.timings() == []
+
+
+class TestBind(object):
+    @pytest.fixture
+    def gmx(self):
+        cls = type('Gmx', (gromacs.core.GromacsCommand,), {'command_name': 'gmx'})
+        return cls(nobackup=True)
+
+    @pytest.fixture
+    def options(self):
+        options = {'o{0}'.format(i): 'file{0}.xvg'.format(i) for i in range(20)}
+        options['n'] = ['index.ndx', 'other.ndx']
+        return options
+
+    @staticmethod
+    def args(commandline):
+        # options as a set of tuples because their order is arbitrary
+        args, option = {}, None
+        for arg in commandline[1:]:
+            if arg.startswith('-'):
+                option = arg
+                args[option] = ()
+            else:
+                args[option] += (arg,)
+        return args
+
+    def test_commandline(self, gmx, options):
+        bound = gmx.bind('v', **options)
+        assert self.args(bound.commandline(dump=5)) == \
+            self.args(gmx.commandline('v', dump=5, **options))
+        assert self.args(bound.commandline(dump=5, o3='x.xvg', v=False)) == \
+            self.args(gmx.commandline(dump=5, v=False, **dict(options, o3='x.xvg')))
+        assert self.args(bound.bind(e=1).commandline()) == \
+            self.args(gmx.commandline('v', e=1, **options))
+
+    def test_input(self):
+        cat = type('Cat', (gromacs.core.GromacsCommand,), {'command_name': 'cat'})()
+        bound = cat.bind(input=["System", "Protein"])
+        assert bound(stdout=False)[1] == "System\nProtein\n"
+        assert bound.bind()(stdout=False)[1] == "System\nProtein\n"
+        assert bound(input="other", stdout=False)[1] == "other\n"
+
+    def test_bound_options(self, gmx, options, monkeypatch):
+        # per-call work of a bound command only depends on the new arguments
+        bound = gmx.bind('v', input=["System"], **options)
+        calls = []
+        build_arg_list = gromacs.core.GromacsCommand._build_arg_list
+
+        def _build_arg_list(self, **kwargs):
+            calls.append(kwargs)
+            return build_arg_list(self, **kwargs)
+
+        monkeypatch.setattr(gromacs.core.GromacsCommand, '_build_arg_list', _build_arg_list)
+        _args, _kwargs = bound._combine_arglist((), {'dump': 5})
+        cmd = bound._popen_arguments(*_args, **_kwargs)[0]
+        assert calls == [{'dump': 5}]
+        assert self.args(cmd) == self.args(gmx.commandline('v', dump=5, **options))
+
+    def test_benchmark(self, gmx, options):
+        # informational only: wall-clock times depend on the load of the machine
+        import timeit
+        bound = gmx.bind('v', input=["System"], **options)
+
+        def build(command, *args, **kwargs):
+            _args, _kwargs = command._combine_arglist(args, kwargs)
+            return command._popen_arguments(*_args, **_kwargs)
+
+        unbound_time = min(timeit.repeat(
+            lambda: build(gmx, 'v', dump=5, input=["System"], **options), number=500, repeat=3))
+        bound_time = min(timeit.repeat(
+            lambda: build(bound, dump=5), number=500, repeat=3))
+        print("command line of 500 calls: unbound {0:.4f} s, bound {1:.4f} s".format(
+            unbound_time, bound_time))
+
+
+class TestRetry(object):
+    @pytest.fixture
+    def flaky(self, tmpdir):
+        # fails with return code 3 on the first two invocations
+        counter = tmpdir.join("counter")
+        script = ("echo x >> {0}; test $(wc -l < {0}) -ge 3 || "
+                  "{{ echo 'NFS hiccup' >&2; exit 3; }}".format(counter))
+        cls = type('Sh', (gromacs.core.GromacsCommand,), {'command_name': 'sh'})
+        return cls(c=script, backoff=0.01), counter
+
+    @pytest.mark.parametrize('retry_on', ([3], ["NFS hiccup"], [1, 3]))
+    def test_retry(self, flaky, retry_on):
+        sh, counter = flaky
+        sh.retries, sh.retry_on = 2, retry_on
+        rc, out, err = sh(stderr=False)
+        assert rc == 0
+        assert len(counter.readlines()) == 3
+
+    def test_retry_other_failure(self, flaky):
+        sh, counter = flaky
+        sh.retries, sh.retry_on = 2, [4, "other"]
+        with pytest.raises(gromacs.GromacsError):
+            sh(stderr=False)
+        assert len(counter.readlines()) == 1
+
+    def test_retries_exhausted(self, flaky):
+        sh, counter = flaky
+        sh.retries, sh.retry_on = 1, [3]
+        with pytest.raises(gromacs.GromacsError):
+            sh(stderr=False)
+        assert len(counter.readlines()) == 2
+
+    def test_timeout(self, tmpdir):
+        sleep = type('Sleep', (gromacs.core.Command,), {'command_name': 'sleep'})()
+        rc, out, err = sleep("10", timeout=0.1)
+        assert rc != 0
+        counter = tmpdir.join("counter")
+        sh = type('Sh', (gromacs.core.GromacsCommand,), {'command_name': 'sh'})(
+            c="echo x >> {0}; sleep 10".format(counter),
+            timeout=0.1, retries=1, retry_on=["timeout"], backoff=0.01)
+        with pytest.raises(gromacs.GromacsError) as err:
+            sh()
+        assert "timed out" in str(err.value)
+        assert len(counter.readlines()) == 2
+
+
+class TestPipeline(object):
+    @staticmethod
+    def command(name, *args, **kwargs):
+        base = kwargs.pop('base', gromacs.core.Command)
+        return type(name.capitalize(), (base,), {'command_name': name})(*args, **kwargs)
+
+    def test_pipe(self):
+        seq = self.command("seq", "5")
+        tail = self.command("tail", "-n", "2")
+        results = seq.pipe(tail, stdout=False).run()
+        assert [rc for rc, out, err in results] == [0, 0]
+        assert results[1][1] == "4\n5\n"
+
+    def test_pipe_chain(self):
+        pipeline = gromacs.core.Pipeline([self.command("seq", "10"),
+                                          self.command("tail", "-n", "3")])
+        results = pipeline.pipe(self.command("head", "-n", "1"), stdout=False)()
+        assert results[2][1] == "8\n"
+
+    def test_fifo(self, tmpdir):
+        sh = self.command("sh")
+        with gromacs.core.Pipeline(fifodir=str(tmpdir)) as pipeline:
+            fifo = pipeline.fifo(".txt")
+            pipeline.add(sh, "-c", "seq 3 > {0}".format(fifo))
+            pipeline.add(self.command("cat"), fifo, stdout=False)
+            results = pipeline.run()
+            assert os.path.exists(fifo)
+        assert results[1][1] == "1\n2\n3\n"
+        assert not os.path.exists(fifo)
+
+    def test_failure(self, tmpdir):
+        # the reader of the FIFO is terminated when the writer fails
+        with gromacs.core.Pipeline(fifodir=str(tmpdir)) as pipeline:
+            fifo = pipeline.fifo()
+            pipeline.add(self.command("sh", base=gromacs.core.GromacsCommand), c="exit 2")
+            pipeline.add(self.command("cat"), fifo, stdout=False)
+            with pytest.raises(gromacs.GromacsError):
+                pipeline.run()
+
+    def test_piped_input(self):
+        with pytest.raises(ValueError):
+            self.command("seq", "5").pipe(self.command("cat"), input="1")
+
+    def test_stream(self):
+        seq = self.command("seq", "5")
+        with pytest.raises(ValueError):
+            gromacs.core.Pipeline().add(seq, stream=lambda line: None)
+        with pytest.raises(ValueError):
+            seq.pipe(self.command("cat"), stream=lambda line: None)
+        # also for a default argument of a command
+        cat = self.command("cat", stream=lambda line: None)
+        with pytest.raises(ValueError):
+            seq.pipe(cat).run()
+
+
+class TestResultCache(object):
+    @pytest.fixture
+    def tool(self, tmpdir, monkeypatch):
+        # fake analysis tool: "tool -f IN -o OUT" copies IN to OUT and logs the call
+        script = tmpdir.join("tool")
+        script.write("#!/bin/sh\n"
+                     "echo run >> {0}\n"
+                     "cat \"$2\" > \"$4\"\n"
+                     "echo done\n".format(tmpdir.join("calls.log")))
+        script.chmod(0o755)
+        flags = gromacs.environment.flags
+        monkeypatch.setitem(flags, 'result_cache_dir', str(tmpdir.join("cache")))
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join("in.dat").write("data\n")
+        cls = type('Tool', (gromacs.core.GromacsCommand,), {'command_name': str(script)})
+        return cls(f="in.dat", o="out.dat", cache=True)
+
+    @staticmethod
+    def calls(tmpdir):
+        return len(tmpdir.join("calls.log").readlines())
+
+    def test_cache(self, tool, tmpdir):
+        assert tool(stdout=False) == (0, "done\n", None)
+        tmpdir.join("out.dat").remove()
+        assert tool(stdout=False) == (0, "done\n", None)
+        assert tmpdir.join("out.dat").read() == "data\n"
+        assert self.calls(tmpdir) == 1
+        tool(stdout=False, cache=False)
+        assert self.calls(tmpdir) == 2
+
+    def test_changed_inputs(self, tool, tmpdir):
+        tool()
+        tool(input=["System"])
+        assert self.calls(tmpdir) == 2
+        infile = tmpdir.join("in.dat")
+        infile.write("other\n")
+        infile.setmtime(infile.mtime() + 10)
+        tool()
+        assert tmpdir.join("out.dat").read() == "other\n"
+        assert self.calls(tmpdir) == 3
+        # captured output is required
+        tool(stdout=False)
+        assert self.calls(tmpdir) == 4
+
+    def test_bound_inputs(self, tool, tmpdir):
+        tmpdir.join("in2.dat").write("other\n")
+        unbound = tool.__class__(cache=True)
+        first = unbound.bind(f="in.dat", o="out.dat")
+        second = unbound.bind(f="in2.dat", o="out.dat")
+        assert gromacs.resultcache.key(first, first.gmxargs) != \
+            gromacs.resultcache.key(second, second.gmxargs)
+        first()
+        assert tmpdir.join("out.dat").read() == "data\n"
+        second()
+        assert tmpdir.join("out.dat").read() == "other\n"
+        assert self.calls(tmpdir) == 2
+        infile = tmpdir.join("in2.dat")
+        infile.write("changed\n")
+        infile.setmtime(infile.mtime() + 10)
+        second()
+        assert tmpdir.join("out.dat").read() == "changed\n"
+        assert self.calls(tmpdir) == 3
+
+    def test_other_outputs(self, tool, tmpdir):
+        # output option that does not start with "o" (like -e or -cpo)
+        energy = tool.__class__(f="in.dat", e="energy.dat", cache=True)
+        energy()
+        energy()
+        assert self.calls(tmpdir) == 1
+        tmpdir.join("energy.dat").remove()
+        energy()
+        assert tmpdir.join("energy.dat").read() == "data\n"
+        assert self.calls(tmpdir) == 1
+        gromacs.resultcache.clear()
+        assert tmpdir.join("cache").listdir() == []
+
+    def test_run_only(self):
+        # the other ways of running a tool do not pass cache on to the tool
+        echo = type('Echo', (gromacs.core.GromacsCommand,), {'command_name': 'echo'})(cache=True)
+        assert list(echo.iterlines(cache=False)) == ["\n"]
+        assert gromacs.core.Pipeline().add(echo, cache=False, stdout=False).run() == \
+            [(0, "\n", None)]
+        if not six.PY2:
+            assert TestAsync.run(echo.arun(cache=False, stdout=False)) == (0, "\n", None)
+
+    def test_evict(self, tool, tmpdir):
+        tool()
+        tool(o="out2.dat")
+        assert len(tmpdir.join("cache").listdir()) == 2
+        # room for the most recently used result only
+        gromacs.resultcache.evict(max(size for mtime, size, entry in gromacs.resultcache._entries()))
+        assert len(tmpdir.join("cache").listdir()) == 1
+        tool(o="out2.dat")
+        assert self.calls(tmpdir) == 2
+        gromacs.resultcache.clear()
+        assert tmpdir.join("cache").listdir() == []
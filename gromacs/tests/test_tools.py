@@ -5,6 +5,10 @@
 
 from __future__ import division, absolute_import, print_function
 
+import os
+import sys
+import importlib
+
 import pytest
 
 import gromacs
@@ -41,3 +45,103 @@ def test_failure_ignore():
         grompp_ignore(y=True)
     except Exception as err:
         raise AssertionError("Should have ignored exception {}".format(err))
+
+
+@pytest.fixture
+def drivers(tmpdir, monkeypatch):
+    # fake drivers that log their invocations and list two tools
+    log = tmpdir.join("calls.log")
+    for driver in ("gmx", "gmx_d"):
+        script = tmpdir.join(driver)
+        script.write("#!/bin/sh\n"
+                     "echo {0} >> {1}\n"
+                     "printf 'GROMACS:\\n\\nVERSION\\n\\nCommands:\\n"
+                     "    trjconv       Convert trajectories\\n"
+                     "    sasa          Compute solvent accessible surface area\\n\\n'\n".format(driver, log))
+        script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmpdir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr(gromacs.tools, "find_drivers", lambda: ["gmx", "gmx_d"])
+    # tool cache only used when the (initially missing) config dir is created
+    monkeypatch.setattr(gromacs.config, "configdir", str(tmpdir.join("config")))
+    monkeypatch.setattr(gromacs.toolcache, "_signatures", {})
+    return log
+
+
+def test_registry_lazy(drivers):
+    registry = gromacs.tools.ToolRegistry("2018")
+    assert not drivers.check()
+    assert registry["Trjconv_d"].driver == "gmx_d"
+    assert drivers.read().split() == ["gmx_d"]
+    assert registry["G_sas_d"] is registry["Sasa_d"]
+    assert registry["Sasa"].command_name == "sasa"
+    assert drivers.read().split() == ["gmx_d", "gmx"]
+    assert "Nonexisting" not in registry
+    assert sorted(registry) == ["G_sas", "G_sas_d", "Sasa", "Sasa_d", "Trjconv", "Trjconv_d"]
+    assert drivers.read().split() == ["gmx_d", "gmx"]
+
+
+def test_toolcache(drivers):
+    drivers.dirpath("config").mkdir()
+    tools = gromacs.tools.load_v5_tools(["gmx"])
+    assert drivers.read().split() == ["gmx"]
+    assert gromacs.toolcache.get("gmx", "tools") == ["trjconv", "sasa"]
+    assert sorted(gromacs.tools.load_v5_tools(["gmx"])) == sorted(tools)
+    assert drivers.read().split() == ["gmx"]
+    # modified executable invalidates the cache
+    gmx = drivers.dirpath("gmx")
+    gmx.setmtime(gmx.mtime() - 100)
+    gromacs.toolcache._signatures.clear()
+    assert gromacs.toolcache.get("gmx", "tools") is None
+    gromacs.tools.load_v5_tools(["gmx"])
+    assert drivers.read().split() == ["gmx", "gmx"]
+    gromacs.toolcache.clear()
+    assert drivers.dirpath("config").join("cache").listdir() == []
+
+
+def test_merge_ndx(tmpdir):
+    a = tmpdir.join("a.ndx")
+    a.write("[ System ]\n1 2 3\n4\n[ Protein ]\n1 2\n")
+    b = tmpdir.join("b.ndx")
+    b.write("[ System ]\n5 6\n[ Ligand ]\n  7\n")
+    merged = gromacs.tools.merge_ndx(str(a), str(b), str(tmpdir.join("md.tpr")))
+    with open(merged) as f:
+        groups = [line.strip() for line in f if line.startswith("[")]
+    # like make_ndx: all groups in order, no default groups, duplicates kept
+    assert groups == ["[ System ]", "[ Protein ]", "[ System ]", "[ Ligand ]"]
+    ndx = gromacs.fileformats.ndx.NDX(merged)
+    assert list(ndx["Ligand"]) == [7]
+    assert gromacs.tools.merge_ndx(str(a), str(b)) == merged
+    b.setmtime(b.mtime() - 100)
+    assert gromacs.tools.merge_ndx(str(a), str(b)) != merged
+    with pytest.raises(ValueError):
+        gromacs.tools.merge_ndx(str(a), "md.tpr", "md.gro")
+
+
+def test_multi_index_arguments(tmpdir):
+    for name in ("a.ndx", "b.ndx"):
+        tmpdir.join(name).write("[ {0} ]\n1\n".format(name))
+    ndx = [str(tmpdir.join("a.ndx")), str(tmpdir.join("b.ndx"))]
+    Trjconv = gromacs.tools.tool_factory("Trjconv", "trjconv", "gmx",
+                                         base=gromacs.tools.GromacsCommandMultiIndex)
+    trjconv = Trjconv(n=ndx, s="md.tpr")
+    assert ndx == [str(tmpdir.join("a.ndx")), str(tmpdir.join("b.ndx"))]
+    assert trjconv.gmxargs["n"] == gromacs.tools.merge_ndx(*ndx)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="lazy module attributes require Python 3.7")
+def test_lazy_attributes(drivers, monkeypatch):
+    monkeypatch.setattr(gromacs.tools, "registry", gromacs.tools.ToolRegistry("2018"))
+    # submodules and names that cannot be tools do not run the drivers
+    scaling = importlib.import_module("gromacs.scaling")
+    monkeypatch.delattr(gromacs, "scaling")
+    from gromacs import scaling as imported
+    assert imported is scaling
+    with pytest.raises(AttributeError):
+        gromacs.__getattr__("NoSuchTool")
+    assert not drivers.check()
+    monkeypatch.delattr(gromacs, "sasa", raising=False)
+    try:
+        assert gromacs.__getattr__("sasa").command_name == "sasa"
+        assert drivers.read().split() == ["gmx"]
+    finally:
+        vars(gromacs).pop("sasa", None)
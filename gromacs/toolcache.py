@@ -0,0 +1,170 @@
+# GromacsWrapper: toolcache.py
+# Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
+# Released under the GNU Public License 3 (or higher, your choice)
+# See the file COPYING for details.
+
+"""
+:mod:`gromacs.toolcache` -- Cache of Gromacs tool lists and documentation
+=========================================================================
+
+Finding the available Gromacs tools (``gmx help commands``, see
+:func:`gromacs.tools.load_v5_tools`) and their documentation (``gmx
+trjconv -h``, see :class:`gromacs.core.GromacsCommand`) requires running
+Gromacs. The results only change when the Gromacs installation changes,
+so they are stored in JSON files in the ``cache`` directory of the
+GromacsWrapper configuration directory (:data:`gromacs.config.configdir`,
+``~/.gromacswrapper/cache``), one file per executable. The entries are
+keyed on the :func:`signature` of the executable, i.e. its path,
+modification time and size and the Gromacs environment variables set by
+``GMXRC``, so that a new or updated installation is detected.
+
+The cache is only used if the configuration directory exists (see
+:func:`gromacs.config.setup`) and it can be switched off with the
+:mod:`gromacs.environment` flag ``tool_cache``::
+
+   gromacs.environment.flags['tool_cache'] = False
+
+:func:`clear` removes all cached data.
+
+.. autofunction:: signature
+.. autofunction:: get
+.. autofunction:: put
+.. autofunction:: clear
+
+.. versionadded:: 0.8.0
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import errno
+import hashlib
+import tempfile
+import logging
+
+from . import config
+from . import environment
+
+logger = logging.getLogger('gromacs.toolcache')
+
+#: Version of the cache format; entries of other versions are ignored.
+CACHE_VERSION = 1
+
+#: Environment variables (set by ``GMXRC``) that are part of the cache key.
+ENVIRONMENT = ('GMXBIN', 'GMXDATA', 'GMXLDLIB', 'GMXPREFIX', 'GROMACS_DIR')
+
+_signatures = {}
+
+
+def cachedir():
+    """Return the cache directory (inside :data:`gromacs.config.configdir`)."""
+    return os.path.join(config.configdir, 'cache')
+
+
+def _which(executable):
+    if os.path.dirname(executable):
+        return executable if os.access(executable, os.X_OK) else None
+    for d in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(d, executable)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def signature(executable):
+    """Return the cache key of *executable* or ``None`` if it cannot be found.
+
+    The key consists of the real path of the executable found on
+    :envvar:`PATH`, its modification time and size, the configured
+    ``GMXRC`` and the values of the environment variables in
+    :data:`ENVIRONMENT`.
+    """
+    gmxrc = [config.cfg.get('Gromacs', 'GMXRC')] + [os.environ.get(name) for name in ENVIRONMENT]
+    key = (executable, os.environ.get('PATH')) + tuple(gmxrc)
+    try:
+        return _signatures[key]
+    except KeyError:
+        pass
+    path = _which(executable)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    _signatures[key] = sig = [CACHE_VERSION, path, st.st_mtime, st.st_size] + gmxrc
+    return sig
+
+
+def _filename(sig):
+    digest = hashlib.sha1(json.dumps(sig).encode('utf-8')).hexdigest()
+    return os.path.join(cachedir(), digest + '.json')
+
+
+def _enabled():
+    return environment.flags['tool_cache'] and os.path.isdir(config.configdir)
+
+
+def _read(sig):
+    try:
+        with open(_filename(sig)) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if data.get('signature') == sig else {}
+
+
+def get(executable, item):
+    """Return the cached *item* for *executable* or ``None``.
+
+    *item* is ``"tools"`` (the list of tool names of a driver) or the name
+    of a tool (its documentation).
+    """
+    if not _enabled():
+        return None
+    sig = signature(executable)
+    if sig is None:
+        return None
+    return _read(sig).get('items', {}).get(item)
+
+
+def put(executable, item, value):
+    """Store *value* as *item* for *executable* (see :func:`get`).
+
+    Errors are logged and otherwise ignored. The file is replaced
+    atomically so that concurrent processes never read a partial file.
+    """
+    if not _enabled():
+        return
+    sig = signature(executable)
+    if sig is None:
+        return
+    data = _read(sig)
+    data['signature'] = sig
+    data.setdefault('items', {})[item] = value
+    filename = _filename(sig)
+    try:
+        try:
+            os.mkdir(cachedir())
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=cachedir(), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, filename)
+    except (IOError, OSError) as err:
+        logger.debug("failed to write tool cache %r: %s", filename, err)
+
+
+def clear():
+    """Remove all cached tool lists and documentation."""
+    _signatures.clear()
+    try:
+        names = os.listdir(cachedir())
+    except OSError:
+        return
+    for name in names:
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.unlink(os.path.join(cachedir(), name))
+            except OSError:
+                pass
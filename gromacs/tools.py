@@ -18,6 +18,14 @@ The list of tools to be loaded is configured with the ``tools`` and ``groups``
 options of the ``~/.gromacswrapper.cfg`` file. Guesses are made if these
 options are not provided.
 
+Tools are discovered lazily (with Python 3.7 or later): the
+:data:`registry` of command classes only runs a Gromacs driver such as
+``gmx`` or ``gmx_d`` (to list its tools) when a tool of this driver is
+requested for the first time, e.g. by accessing ``tools.Trjconv`` or
+``gromacs.trjconv``. Listing all tools (e.g. ``registry.keys()``) runs all
+drivers. With older versions of Python all tools are loaded when the module
+is imported.
+
 In the following example we create two instances of the
 :class:`gromacs.tools.Trjconv` command (which runs the Gromacs ``trjconv``
 command)::
@@ -52,6 +60,11 @@ all tools.
 Helpers
 -------
 
+.. autoclass:: ToolRegistry
+.. data:: registry
+
+   The :class:`ToolRegistry` of all Gromacs command classes.
+
 .. autofunction:: tool_factory
 .. autofunction:: load_v4_tools
 .. autofunction:: load_v5_tools
@@ -66,13 +79,20 @@ Gromacs tools
 from __future__ import absolute_import
 
 import os.path
+import sys
 import tempfile
 import subprocess
 import atexit
+import threading
 import logging
 import six
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 from . import config
+from . import toolcache
 from .core import GromacsCommand
 
 logger = logging.getLogger("gromacs.tools")
@@ -151,8 +171,7 @@ class GromacsCommandMultiIndex(GromacsCommand):
         ndx = kwargs.get('n')
         if not (ndx is None or isinstance(ndx, six.string_types)) and \
            len(ndx) > 1 and 's' in kwargs:
-            ndx.append(kwargs.get('s'))
-            kwargs['n'] = merge_ndx(*ndx)
+            kwargs['n'] = merge_ndx(*(list(ndx) + [kwargs.get('s')]))
         return kwargs
 
 
@@ -194,18 +213,14 @@ def find_executables(path):
     return execs
 
 
-def load_v5_tools():
-    """ Load Gromacs 2018/2016/5.x tools automatically using some heuristic.
+def find_drivers():
+    """ Find the Gromacs 2018/2016/5.x drivers.
 
-    Tries to load tools (1) using the driver from configured groups (2) and
-    falls back to automatic detection from ``GMXBIN`` (3) then to rough guesses.
-
-    In all cases the command ``gmx help`` is ran to get all tools available.
+    Uses (1) the drivers from configured groups and falls back to automatic
+    detection from ``GMXBIN`` (2) then to rough guesses.
 
-    :return: dict mapping tool names to GromacsCommand classes
+    :return: list of driver names
     """
-    logger.debug("Loading 2018/2016/5.x tools...")
-
     drivers = config.get_tool_names()
 
     if len(drivers) == 0 and 'GMXBIN' in os.environ:
@@ -213,23 +228,52 @@ def load_v5_tools():
 
     if len(drivers) == 0 or len(drivers) > 4:
         drivers = ['gmx', 'gmx_d', 'gmx_mpi', 'gmx_mpi_d']
+    return drivers
+
+
+def load_v5_tools(drivers=None):
+    """ Load Gromacs 2018/2016/5.x tools automatically using some heuristic.
+
+    Tries to load tools (1) using the driver from configured groups (2) and
+    falls back to automatic detection from ``GMXBIN`` (3) then to rough guesses
+    (see :func:`find_drivers`).
+
+    In all cases the command ``gmx help`` is ran to get all tools available
+    (unless the tools of the driver are in the :mod:`~gromacs.toolcache`).
+
+    :param drivers: list of drivers to load the tools of; ``None`` uses
+                    all drivers from :func:`find_drivers`
+    :return: dict mapping tool names to GromacsCommand classes
+
+    .. versionchanged:: 0.8.0
+       Added the *drivers* argument.
+    """
+    logger.debug("Loading 2018/2016/5.x tools...")
+
+    if drivers is None:
+        drivers = find_drivers()
 
     tools = {}
     for driver in drivers:
-        try:
-            out = subprocess.check_output([driver, '-quiet', 'help',
-                                           'commands'])
+        names = toolcache.get(driver, 'tools')
+        if names is None:
+            try:
+                out = subprocess.check_output([driver, '-quiet', 'help',
+                                               'commands'])
+            except (subprocess.CalledProcessError, OSError):
+                continue
+            names = []
             for line in out.splitlines()[5:-1]:
                 line = str(line.decode('ascii'))   # Python 3: byte string -> str, Python 2: normal string
                 if line[4] != ' ':
-                    name = line[4:line.index(' ', 4)]
-                    fancy = make_valid_identifier(name)
-                    suffix = driver.partition('_')[2]
-                    if suffix:
-                        fancy = '{0!s}_{1!s}'.format(fancy, suffix)
-                    tools[fancy] = tool_factory(fancy, name, driver)
-        except (subprocess.CalledProcessError, OSError):
-            pass
+                    names.append(line[4:line.index(' ', 4)])
+            toolcache.put(driver, 'tools', names)
+        for name in names:
+            fancy = make_valid_identifier(name)
+            suffix = driver.partition('_')[2]
+            if suffix:
+                fancy = '{0!s}_{1!s}'.format(fancy, suffix)
+            tools[fancy] = tool_factory(fancy, name, driver)
 
     if not tools:
         errmsg = "Failed to load 2018/2016/5.x tools (tried drivers: {})".format(drivers)
@@ -274,13 +318,34 @@ def load_v4_tools():
     return tools
 
 
+#: Merged index files of this session, keyed on the signatures of the inputs.
+_merged_ndx = {}
+_merged_ndx_lock = threading.Lock()
+
+
+def _ndx_signature(filename):
+    st = os.stat(filename)
+    return os.path.realpath(filename), st.st_size, st.st_mtime
+
+
 def merge_ndx(*args):
     """ Takes one or more index files and optionally one structure file and
     returns a path for a new merged index file.
 
+    The index groups of all index files are written in order to a temporary
+    file, exactly as :program:`make_ndx` does when it is given index files
+    (it then does not add the default groups of the structure), but without
+    running :program:`make_ndx`. The same inputs (unchanged since the last
+    call) return the same merged file during a session.
+
     :param args: index files and zero or one structure file
     :return: path for the new merged index file
+
+    .. versionchanged:: 0.8.0
+       Merges in-process and re-uses merged files.
     """
+    from .fileformats.ndx import NDX
+
     ndxs = []
     struct = None
     for fname in args:
@@ -291,80 +356,190 @@ def merge_ndx(*args):
                 raise ValueError("only one structure file supported")
             struct = fname
 
-    fd, multi_ndx = tempfile.mkstemp(suffix='.ndx', prefix='multi_')
-    os.close(fd)
-    atexit.register(os.unlink, multi_ndx)
-
-    if struct:
-        make_ndx = registry['Make_ndx'](f=struct, n=ndxs, o=multi_ndx)
-    else:
-        make_ndx = registry['Make_ndx'](n=ndxs, o=multi_ndx)
-
-    _, _, _ = make_ndx(input=['q'], stdout=False, stderr=False)
+    key = tuple(_ndx_signature(fname) for fname in ndxs)
+    with _merged_ndx_lock:
+        multi_ndx = _merged_ndx.get(key)
+        if multi_ndx is not None and os.path.exists(multi_ndx):
+            return multi_ndx
+
+        fd, multi_ndx = tempfile.mkstemp(suffix='.ndx', prefix='multi_')
+        atexit.register(_unlink, multi_ndx)
+        with os.fdopen(fd, 'w') as out:
+            # one NDX per file: group names may appear in several files
+            for fname in ndxs:
+                NDX(fname).dump(out)
+        _merged_ndx[key] = multi_ndx
+        logger.debug("merged index files %r into %r", ndxs, multi_ndx)
     return multi_ndx
 
 
-# Load tools
-if config.MAJOR_RELEASE in ('5', '2016', '2018'):
-    logger.debug("Trying to load configured Gromacs major release {0}".format(
-        config.MAJOR_RELEASE))
-    registry = load_v5_tools()
-elif config.MAJOR_RELEASE == '4':
-    logger.debug("Trying to load configured Gromacs major release {0}".format(
-        config.MAJOR_RELEASE))
-    registry = load_v4_tools()
-else:
-    logger.debug("No major release configured: trying 2018/2016/5.x -> 4.x")
+def _unlink(filename):
     try:
-        registry = load_v5_tools()
-    except GromacsToolLoadingError:
-        try:
-            registry = load_v4_tools()
-        except GromacsToolLoadingError:
-            errmsg = "Autoloading was unable to load any Gromacs tool"
-            logger.critical(errmsg)
-            raise GromacsToolLoadingError(errmsg)
-
-# Aliases command names to run unmodified GromacsWrapper scripts on a machine
-# with only 5.x
-# update with temporary directory
-for fancy, cmd in list(registry.items()):
-    for c5, c4 in six.iteritems(NAMES5TO4):
-        # have to check each one, since it's possible there are suffixes
-        # like for double precision; cmd.command_name is Gromacs name
-        # (e.g. 'convert-tpr') so we need to be careful in the processing below.
-        name = cmd.command_name
-        if name.startswith(c5):
-            if c4 == c5:
-                break
-            else:
-                # maintain suffix (note: need to split with fancy because Gromacs
-                # names (c5) may contain '-' etc)
-                name = c4 + fancy.split(make_valid_identifier(c5))[1]
-                registry[make_valid_identifier(name)] = registry[fancy]
-                break
-    else:
-        # the common case of just adding the 'g_'
-        registry['G_{0!s}'.format(fancy.lower())] = registry[fancy]
+        os.unlink(filename)
+    except OSError:
+        pass
+
 
+def add_aliases(tools):
+    """ Add the Gromacs 4 names and multi index commands to the dict *tools*.
 
+    Gromacs 5 tools are aliased to their Gromacs 4 names (see
+    :data:`NAMES5TO4`) or get the ``G_`` prefix and the commands that
+    should accept multiple index files are replaced with
+    :class:`GromacsCommandMultiIndex` classes.
+    """
+    # Aliases command names to run unmodified GromacsWrapper scripts on a machine
+    # with only 5.x
+    for fancy, cmd in list(tools.items()):
+        for c5, c4 in six.iteritems(NAMES5TO4):
+            # have to check each one, since it's possible there are suffixes
+            # like for double precision; cmd.command_name is Gromacs name
+            # (e.g. 'convert-tpr') so we need to be careful in the processing below.
+            name = cmd.command_name
+            if name.startswith(c5):
+                if c4 == c5:
+                    break
+                else:
+                    # maintain suffix (note: need to split with fancy because Gromacs
+                    # names (c5) may contain '-' etc)
+                    name = c4 + fancy.split(make_valid_identifier(c5))[1]
+                    tools[make_valid_identifier(name)] = tools[fancy]
+                    break
+        else:
+            # the common case of just adding the 'g_'
+            tools['G_{0!s}'.format(fancy.lower())] = tools[fancy]
+
+    # Patching up commands that may be useful to accept multiple index files
+    for name4, name5 in [('G_mindist', 'Mindist'), ('G_dist', 'Distance')]:
+        if name4 in tools:
+            cmd = tools[name4]
+            tools[name4] = tool_factory(name4, cmd.command_name, cmd.driver,
+                                        GromacsCommandMultiIndex)
+            if name5 in tools:
+                tools[name5] = tools[name4]
+    return tools
 
-# Patching up commands that may be useful to accept multiple index files
-for name4, name5 in [('G_mindist', 'Mindist'), ('G_dist', 'Distance')]:
-    if name4 in registry:
-        cmd = registry[name4]
-        registry[name4] = tool_factory(name4, cmd.command_name, cmd.driver,
-                                       GromacsCommandMultiIndex)
-        if name5 in registry:
-            registry[name5] = registry[name4]
 
+class ToolRegistry(MutableMapping):
+    """ Mapping of tool class names to command classes that loads tools on demand.
+
+    For Gromacs 2018/2016/5.x (or if no release is configured), looking up
+    a tool only runs the drivers that may provide it, starting with the
+    driver whose suffix (e.g. ``_d`` in ``Trjconv_d``) matches the name.
+    Iterating over the registry loads the tools of all drivers. Gromacs 4.x
+    tools are used when no driver provides any tools (and no release is
+    configured).
+
+    .. versionadded:: 0.8.0
+    """
+    def __init__(self, release=None):
+        """ :param release: configured major release (:data:`gromacs.config.MAJOR_RELEASE`) """
+        self.release = release
+        self._tools = {}
+        self._drivers = None    # drivers that were not run yet
+        self._complete = False
+
+    def _pending_drivers(self):
+        if self._drivers is None:
+            if self.release in ('5', '2016', '2018') or self.release is None:
+                logger.debug("Trying to load configured Gromacs major release {0}".format(
+                    self.release))
+                self._drivers = list(find_drivers())
+            else:
+                self._drivers = []
+        return self._drivers
 
-# Append class doc for each command
-for name in six.iterkeys(registry):
-    __doc__ += ".. class:: {0!s}\n    :noindex:\n".format(name)
+    def _load_drivers(self, drivers):
+        for driver in drivers:
+            self._drivers.remove(driver)
+        try:
+            tools = load_v5_tools(drivers)
+        except GromacsToolLoadingError:
+            return
+        self._tools.update(add_aliases(tools))
+
+    def _candidates(self, name):
+        """ Drivers that were not run yet; the ones that may provide *name* come first. """
+        drivers = self._pending_drivers()
+        suffixes = [d.partition('_')[2] for d in drivers]
+        matching = [sfx for sfx in suffixes if sfx and name.endswith('_' + sfx)]
+        suffix = max(matching, key=len) if matching else ''
+        return sorted(drivers, key=lambda d: d.partition('_')[2] != suffix)
+
+    def load(self):
+        """ Load the tools of all drivers. """
+        if self._complete:
+            return
+        self._load_drivers(list(self._pending_drivers()))
+        if not self._tools:
+            if self.release in ('5', '2016', '2018'):
+                errmsg = "Failed to load 2018/2016/5.x tools"
+                logger.critical(errmsg)
+                raise GromacsToolLoadingError(errmsg)
+            elif self.release is None:
+                logger.debug("No major release configured: trying 2018/2016/5.x -> 4.x")
+            try:
+                self._tools.update(add_aliases(load_v4_tools()))
+            except GromacsToolLoadingError:
+                errmsg = "Autoloading was unable to load any Gromacs tool"
+                logger.critical(errmsg)
+                raise GromacsToolLoadingError(errmsg)
+        self._complete = True
+
+    def __getitem__(self, name):
+        try:
+            return self._tools[name]
+        except KeyError:
+            pass
+        if not self._complete:
+            for driver in self._candidates(name):
+                self._load_drivers([driver])
+                if name in self._tools:
+                    return self._tools[name]
+            self.load()
+        return self._tools[name]
+
+    def __setitem__(self, name, cls):
+        self._tools[name] = cls
+
+    def __delitem__(self, name):
+        self.load()
+        del self._tools[name]
+
+    def __iter__(self):
+        self.load()
+        return iter(self._tools)
+
+    def __len__(self):
+        self.load()
+        return len(self._tools)
+
+
+registry = ToolRegistry(config.MAJOR_RELEASE)
+
+_module_all = ['GromacsCommandMultiIndex', 'merge_ndx']
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # PEP 562: command classes are only looked up when they are used
+        if name == '__all__':
+            return _module_all + list(registry.keys())
+        if name[:1].isupper():
+            try:
+                return registry[name]
+            except KeyError:
+                pass
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(registry.keys()))
+else:
+    registry.load()
 
+    # Append class doc for each command
+    for name in six.iterkeys(registry):
+        __doc__ += ".. class:: {0!s}\n    :noindex:\n".format(name)
 
-# Finally add command classes to module's scope
-globals().update(registry)
-__all__ = ['GromacsCommandMultiIndex', 'merge_ndx']
-__all__.extend(list(registry.keys()))
+    # Finally add command classes to module's scope
+    globals().update(registry)
+    __all__ = _module_all + list(registry.keys())
@@ -98,7 +98,6 @@ import subprocess
 from contextlib import contextmanager
 import bz2, gzip
 import datetime
-import numpy
 from six import string_types
 
 import logging
@@ -141,6 +140,7 @@ def autoconvert(s):
             if len(s) == 1:
                 return s[0]
             else:
+                import numpy
                 return numpy.array(s)
         except (ValueError, AttributeError):
             pass
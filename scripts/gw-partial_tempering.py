@@ -1,26 +1,64 @@
-
 # GromacsWrapper: gw-partial_tempering.py
 # Copyright (c) 2009 Oliver Beckstein <orbeckst@gmail.com>
 # Released under the GNU Public License 3 (or higher, your choice)
 # See the file COPYING for details.
 
-from gromacs.scaling import partial_tempering
+from __future__ import print_function
+
+import os.path
 import argparse
 
+from gromacs.scaling import PartialTempering, geometric_scales
+
 description="""
 Modify gromacs processed topology (processed.top, generated by `grompp -pp` command)
-for running with solute tempering replica exchange (REST2). 
+for running with solute tempering replica exchange (REST2).
+
+The topology is read once and the topologies of all replicas are written
+from it. With several scale factors (--scale_protein 1.0,0.9,0.8 or
+--ladder 8 0.5) OUTPUT is a pattern that is formatted with the replica index
+and the scale factor such as "scaled_{0}.top"; without a "{" in OUTPUT the
+replica index is appended to the file name.
 """
 
+def scale_list(value):
+	return [float(scale) for scale in value.split(",")]
+
 def parse_args():
 	parser = argparse.ArgumentParser(description=description)
-	parser.add_argument("--scale_protein", type=float, help="scale protein interactions by this scaling factor (0-1)")
-	parser.add_argument("--scale_lipids", type=float, help="scale lipid interactions by this scaling factor (0-1)")
-	parser.add_argument("--scale_protein_lipids", type=float, help="scale lipid-lipid interactions by this scaling factor (0-1)")
+	parser.add_argument("--scale_protein", type=scale_list, default=[1.0],
+			    help="scale protein interactions by this scaling factor (0-1) or by a comma separated list of factors, one per replica")
+	parser.add_argument("--ladder", nargs=2, metavar=("N", "MIN"),
+			    help="geometric ladder of N protein scaling factors from 1.0 to MIN (replaces --scale_protein)")
+	parser.add_argument("--scale_lipids", type=float, default=1.0, help="scale lipid interactions by this scaling factor (0-1)")
 	parser.add_argument("input", help="input topology (processed.top)")
-	parser.add_argument("output", help="output topology")
-	parser.add_argument("--banned_lines", default="", help="line numbers of dihedrals/impropers that one wishes to exclude from scaling")
+	parser.add_argument("output", help="output topology or pattern for the replica topologies")
+	parser.add_argument("--banned_lines", default="", help="line numbers of dihedrals/impropers in the input topology (or path:line for #include files) that one wishes to exclude from scaling")
+	parser.add_argument("--processes", type=int, default=1, help="write the topologies with this many processes")
 	return parser.parse_args()
 
-args = parse_args()
-partial_tempering(args)
\ No newline at end of file
+def output_files(output, nreplicas):
+	if nreplicas == 1 or "{" in output:
+		return output
+	root, ext = os.path.splitext(output)
+	return root + "_{0}" + ext
+
+def main():
+	args = parse_args()
+	if args.ladder:
+		scales = geometric_scales(int(args.ladder[0]), float(args.ladder[1]))
+	else:
+		scales = args.scale_protein
+
+	rest2 = PartialTempering(args.input, banned_lines=args.banned_lines)
+	outfiles = rest2.write_replicas(scales, output_files(args.output, len(scales)),
+					scale_lipids=args.scale_lipids, processes=args.processes)
+
+	for outfile, scale in zip(outfiles, scales):
+		print("{0:8.4f}  {1}".format(scale, outfile))
+	print("timings:")
+	for stage, seconds in rest2.timings.items():
+		print("  {0:<8s} {1:8.3f} s".format(stage, seconds))
+
+if __name__ == "__main__":
+	main()
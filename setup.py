@@ -55,6 +55,7 @@ setup(name="GromacsWrapper",
                           'six',          # towards py 3 compatibility
                           'numkit',       # numerical helpers
                           'matplotlib',
+                          'futures; python_version < "3"',  # concurrent.futures
                           ],
       tests_require = ['pytest', 'numpy>=1.0', 'pandas>=0.17'],
       zip_safe = True,